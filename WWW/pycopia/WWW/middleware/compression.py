@@ -0,0 +1,265 @@
+#!/usr/bin/python3.4
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compress WSGI responses with gzip or deflate, as the client accepts.
+
+Response bodies are compressed as the application produces them. Compressed
+bodies of responses with a strong ETag are also kept in a size bounded LRU
+cache, and sent from there while the ETag stays the same.
+"""
+
+import zlib
+import threading
+from collections import OrderedDict
+
+from pycopia.inet import httputils
+from pycopia.WWW.middleware import Middleware
+
+# zlib window bits for each content coding.
+CODINGS = OrderedDict([
+    ("gzip", 16 + zlib.MAX_WBITS),
+    ("deflate", zlib.MAX_WBITS),
+])
+
+# Media types worth compressing, besides text/*, *+xml and *+json. Images,
+# audio, video and archives are already compressed.
+COMPRESSIBLE = frozenset([
+    "application/json",
+    "application/javascript",
+    "application/x-javascript",
+    "application/xml",
+    "application/rss+xml",
+    "application/xhtml+xml",
+    "image/svg+xml",
+])
+
+
+def is_compressible(content_type):
+    mtype = content_type.partition(";")[0].strip().lower()
+    return (mtype.startswith("text/") or mtype in COMPRESSIBLE or
+            mtype.endswith("+xml") or mtype.endswith("+json"))
+
+
+class _Response:
+    """What the start_response wrapper decided about one response."""
+    started = False
+    coding = None # Content coding to apply, if any.
+    compressor = None
+    cachekey = None
+    cached = None # Compressed body from the cache.
+    nobody = False # A HEAD request, so there is no body to compress.
+
+
+class CompressionMiddleware(Middleware):
+    """Compress responses with a compressible media type and a 200 status.
+
+    Responses shorter than minsize, by their Content-Length, are left
+    alone. Up to cachesize bytes of compressed bodies are cached, each at
+    most maxentry bytes.
+    """
+
+    def __init__(self, application, level=6, minsize=256,
+                 cachesize=32*1024*1024, maxentry=4*1024*1024):
+        self.application = application
+        self.level = level
+        self.minsize = minsize
+        self.cachesize = cachesize
+        self.maxentry = maxentry
+        self._cache = OrderedDict()
+        self._cached = 0 # bytes in the cache
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        accept = environ.get("HTTP_ACCEPT_ENCODING")
+        coding = None
+        if accept:
+            coding = httputils.AcceptEncoding(accept).select(CODINGS)
+        if coding is not None:
+            _strip_inm(environ, coding)
+        resp = _Response()
+        resp.nobody = environ.get("REQUEST_METHOD") == "HEAD"
+
+        def compress_start_response(status, headers, exc_info=None):
+            # Called again with exc_info, the new headers are decided anew.
+            resp.started = True
+            resp.coding = resp.compressor = None
+            resp.cachekey = resp.cached = None
+            headers = self._headers(environ, status, headers, coding, resp)
+            write = start_response(status, headers, exc_info)
+            if resp.coding is None:
+                return write
+            resp.compressor = self._compressor(resp.coding)
+            def compress_write(data):
+                compressor = resp.compressor
+                if compressor is None: # The error response is not compressed.
+                    write(data)
+                elif data and resp.cached is None and not resp.nobody:
+                    resp.cachekey = None # The body is not all in the result.
+                    write(compressor.compress(data) +
+                          compressor.flush(zlib.Z_SYNC_FLUSH))
+            return compress_write
+
+        result = self.application(environ, compress_start_response)
+        if resp.started and resp.coding is None:
+            return result # Untouched, so a server may still use sendfile.
+        return self._body(result, resp)
+
+    def _headers(self, environ, status, headers, coding, resp):
+        """Decide on compressing the response, and adjust the headers."""
+        ctype = length = etag = vary = None
+        for name, value in headers:
+            key = name.lower()
+            if key == "content-type":
+                ctype = value
+            elif key == "content-length":
+                length = value
+            elif key == "etag":
+                etag = value
+            elif key == "vary":
+                vary = value
+            elif key == "content-encoding":
+                return headers
+            elif key == "cache-control" and "no-transform" in value.lower():
+                return headers
+        if status.startswith("304"):
+            # The client may have asked about the compressed variant.
+            if etag is not None and environ.get("compression.inm") == coding:
+                headers = _replace(headers, "etag", _variant(etag, coding))
+            return headers
+        if ctype is None or not is_compressible(ctype):
+            return headers
+        if vary is None:
+            headers = headers + [("Vary", "Accept-Encoding")]
+        elif "accept-encoding" not in vary.lower() and vary.strip() != "*":
+            headers = [(n, v + ", Accept-Encoding" if n.lower() == "vary"
+                        else v) for n, v in headers]
+        if coding is None or not status.startswith("200"):
+            return headers
+        if length is not None and length.isdigit() and int(length) < self.minsize:
+            return headers
+        resp.coding = coding
+        headers = [(n, v) for n, v in headers
+                   if n.lower() not in ("content-length", "etag")]
+        headers.append(("Content-Encoding", coding))
+        if etag is not None:
+            headers.append(("ETag", _variant(etag, coding)))
+            if (not etag.startswith("W/") and
+                    environ.get("REQUEST_METHOD") == "GET"):
+                resp.cachekey = (environ.get("SCRIPT_NAME", "") +
+                                 environ.get("PATH_INFO", ""),
+                                 environ.get("QUERY_STRING", ""), etag, coding)
+                resp.cached = self._cache_get(resp.cachekey)
+                if resp.cached is not None:
+                    headers.append(("Content-Length", str(len(resp.cached))))
+        return headers
+
+    def _compressor(self, coding):
+        return zlib.compressobj(self.level, zlib.DEFLATED, CODINGS[coding])
+
+    def _body(self, result, resp):
+        try:
+            it = iter(result)
+            data = None
+            if not resp.started: # It may be called with the first item.
+                for data in it:
+                    break
+            if resp.coding is None:
+                if data is not None:
+                    yield data
+                    yield from it
+                return
+            if resp.cached is not None:
+                yield resp.cached
+                return
+            if resp.nobody:
+                return
+            compressor = resp.compressor
+            saved = [] if resp.cachekey is not None else None
+            size = 0
+            # Each item is flushed, so it is sent without delay.
+            if data:
+                out = (compressor.compress(data) +
+                       compressor.flush(zlib.Z_SYNC_FLUSH))
+                if saved is not None:
+                    saved.append(out)
+                    size += len(out)
+                yield out
+            for data in it:
+                if not data:
+                    continue
+                out = (compressor.compress(data) +
+                       compressor.flush(zlib.Z_SYNC_FLUSH))
+                if saved is not None:
+                    saved.append(out)
+                    size += len(out)
+                    if size > self.maxentry:
+                        saved = None
+                yield out
+            out = compressor.flush()
+            if saved is not None:
+                saved.append(out)
+                self._cache_put(resp.cachekey, b"".join(saved))
+            yield out
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    def _cache_get(self, key):
+        with self._lock:
+            body = self._cache.get(key)
+            if body is not None:
+                self._cache.move_to_end(key)
+            return body
+
+    def _cache_put(self, key, body):
+        if len(body) > self.maxentry:
+            return
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._cached -= len(old)
+            self._cache[key] = body
+            self._cached += len(body)
+            while self._cached > self.cachesize:
+                key, old = self._cache.popitem(last=False)
+                self._cached -= len(old)
+
+
+def _variant(etag, coding):
+    """The ETag of the compressed variant of an entity."""
+    if etag.endswith('"'):
+        return etag[:-1] + "-" + coding + '"'
+    return etag
+
+
+def _strip_inm(environ, coding):
+    """Make If-None-Match tags of compressed variants refer to the entity
+    the application knows.
+    """
+    inm = environ.get("HTTP_IF_NONE_MATCH")
+    if not inm:
+        return
+    suffix = "-" + coding + '"'
+    if suffix in inm:
+        tags = [t.strip() for t in inm.split(",")]
+        environ["HTTP_IF_NONE_MATCH"] = ", ".join(
+                t[:-len(suffix)] + '"' if t.endswith(suffix) else t
+                for t in tags)
+        environ["compression.inm"] = coding
+
+
+def _replace(headers, key, value):
+    return [(n, value if n.lower() == key else v) for n, v in headers]
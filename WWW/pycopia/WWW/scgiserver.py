@@ -57,7 +57,9 @@ def get_server(config):
 
     return SCGIServer(app, config.SOCKETPATH,
                       umask=config.get("SOCKET_UMASK", 0), pwent=pwent,
-                      debug=config.DEBUG)
+                      debug=config.DEBUG,
+                      workers=config.get("WORKERS", 0),
+                      maxrequests=config.get("MAX_REQUESTS", 0))
 
 
 def check4server(config):
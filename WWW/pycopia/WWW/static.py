@@ -0,0 +1,316 @@
+#!/usr/bin/python3.4
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Serve static files from a directory tree, as a WSGI application.
+
+Files are stat'ed once, and their metadata kept. Where inotify is available
+a file's entry is dropped when the file changes. Elsewhere entries are
+checked again after a while. Conditional requests are answered from the
+cached metadata. Otherwise the length and validators sent are those of the
+opened file. The file itself is returned in a wsgi.file_wrapper, so the
+Pycopia servers send it with sendfile.
+"""
+
+import os
+import stat
+import errno
+import calendar
+import mimetypes
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+from pycopia.inet import httputils
+
+try:
+    from pycopia.OS import inotify
+except ImportError: # not Linux
+    inotify = None
+
+_WATCHMASK = (inotify.IN_MODIFY | inotify.IN_ATTRIB | inotify.IN_CLOSE_WRITE |
+              inotify.IN_MOVE | inotify.IN_CREATE | inotify.IN_DELETE |
+              inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF |
+              inotify.IN_ONLYDIR) if inotify else 0
+
+
+class FileInfo:
+    """Cached metadata of a file."""
+
+    def __init__(self, path, st):
+        self.path = path
+        self.size = st.st_size
+        self.mtime = int(st.st_mtime)
+        self.mtime_ns = st.st_mtime_ns
+        self.etag = '"{:x}-{:x}-{:x}"'.format(st.st_ino, st.st_size,
+                                              st.st_mtime_ns)
+        self.last_modified = str(httputils.HTTPDate.from_float(st.st_mtime))
+        ctype, encoding = mimetypes.guess_type(path)
+        self.content_type = ctype or "application/octet-stream"
+        self.encoding = encoding
+        self.checked = monotonic()
+
+
+class StaticFiles:
+    """WSGI application serving the files under the root directory.
+
+    Requests for files that do not exist, or with methods other than GET
+    and HEAD, are passed on to application if one is given.
+
+    At most maxentries files are kept in the cache. Without inotify a
+    cached file is stat'ed again when its entry is older than recheck
+    seconds.
+    """
+
+    def __init__(self, root, application=None, maxage=3600,
+                 index="index.html", blksize=65536, maxentries=4096,
+                 recheck=2.0):
+        self.root = os.path.abspath(root)
+        self.application = application
+        self.index = index
+        self.blksize = blksize
+        self.maxentries = maxentries
+        self.recheck = recheck
+        self.cache_control = "max-age={}".format(maxage) if maxage else None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._watches = {}  # watch descriptor -> directory
+        self._watched = {}  # directory -> watch descriptor
+        self._notifier = None
+        if inotify is not None:
+            try:
+                self._notifier = inotify.Inotify()
+            except OSError:
+                pass
+
+    def close(self):
+        if self._notifier is not None:
+            self._notifier.close()
+            self._notifier = None
+
+    def __call__(self, environ, start_response):
+        method = environ["REQUEST_METHOD"]
+        info = None
+        if method in ("GET", "HEAD"):
+            info = self.lookup(environ.get("PATH_INFO", "/"))
+        if info is None:
+            if self.application is not None:
+                return self.application(environ, start_response)
+            if method in ("GET", "HEAD"):
+                return _simple(start_response, "404 Not Found")
+            return _simple(start_response, "405 Method Not Allowed",
+                           [("Allow", "GET, HEAD")])
+
+        if _not_modified(environ, info):
+            start_response("304 Not Modified", self._validators(info))
+            return []
+        try:
+            fo = open(info.path, "rb")
+        except OSError:
+            self.forget(info.path)
+            return _simple(start_response, "404 Not Found")
+        # The file may have changed since it was stat'ed. The headers must
+        # describe what is sent.
+        st = os.fstat(fo.fileno())
+        if st.st_size != info.size or st.st_mtime_ns != info.mtime_ns:
+            self.forget(info.path)
+            info = FileInfo(info.path, st)
+
+        headers = self._validators(info)
+        headers.append(("Content-Type", info.content_type))
+        if info.encoding:
+            headers.append(("Content-Encoding", info.encoding))
+        offset, length = 0, info.size
+        status = "200 OK"
+        byterange = _get_range(environ, info)
+        if byterange == (): # unsatisfiable
+            fo.close()
+            return _simple(start_response,
+                           "416 Range Not Satisfiable",
+                           [("Content-Range", "bytes */{}".format(info.size))])
+        if byterange is not None:
+            offset, length = byterange
+            status = "206 Partial Content"
+            headers.append(("Content-Range", "bytes {}-{}/{}".format(
+                            offset, offset + length - 1, info.size)))
+        headers.append(("Content-Length", str(length)))
+        start_response(status, headers)
+        if method == "HEAD":
+            fo.close()
+            return []
+        wrapper = environ.get("wsgi.file_wrapper", httputils.FileWrapper)
+        if wrapper is httputils.FileWrapper or offset or length != info.size:
+            # No more than Content-Length is sent, should the file grow.
+            return httputils.FileWrapper(fo, self.blksize, offset, length)
+        return wrapper(fo, self.blksize)
+
+    def _validators(self, info):
+        headers = [("ETag", info.etag),
+                   ("Last-Modified", info.last_modified),
+                   ("Accept-Ranges", "bytes")]
+        if self.cache_control:
+            headers.append(("Cache-Control", self.cache_control))
+        return headers
+
+    def lookup(self, path_info):
+        """Return the FileInfo for a request path, or None if there is no
+        such file.
+        """
+        # PATH_INFO is decoded as latin-1, file names are usually UTF-8.
+        path_info = path_info.encode("latin1").decode("utf-8",
+                                                      "surrogateescape")
+        parts = [p for p in path_info.split("/") if p and p != "."]
+        if ".." in parts or "\0" in path_info:
+            return None
+        path = os.path.join(self.root, *parts)
+        if path_info.endswith("/") and self.index:
+            path = os.path.join(path, self.index)
+        self._process_events()
+        with self._lock:
+            info = self._cache.get(path)
+            if info is not None:
+                if (self._notifier is not None or
+                        monotonic() - info.checked < self.recheck):
+                    self._cache.move_to_end(path)
+                    return info
+                del self._cache[path]
+        # Watch before stat, so a change in between is not missed.
+        watched = self._watch(os.path.dirname(path))
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if stat.S_ISDIR(st.st_mode) and self.index:
+            watched = self._watch(path)
+            path = os.path.join(path, self.index)
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        info = FileInfo(path, st)
+        if watched:
+            with self._lock:
+                self._cache[path] = info
+                if len(self._cache) > self.maxentries:
+                    self._cache.popitem(last=False)
+        return info
+
+    def forget(self, path):
+        with self._lock:
+            self._cache.pop(path, None)
+
+    def _watch(self, directory):
+        """Watch a directory for changes. Returns False if a file in it
+        should not be cached.
+        """
+        if self._notifier is None or directory in self._watched:
+            return True
+        try:
+            wd = self._notifier.add_watch(directory, _WATCHMASK)
+        except OSError as err:
+            if err.errno == errno.ENOSPC: # Out of watches, use stat instead.
+                self._notifier.close()
+                self._notifier = None
+                return True
+            return False
+        with self._lock:
+            self._watches[wd] = directory
+            self._watched[directory] = wd
+        return True
+
+    def _process_events(self):
+        """Drop the cache entries of changed files."""
+        if self._notifier is None:
+            return
+        events = self._notifier.read()
+        if not events:
+            return
+        with self._lock:
+            cache = self._cache
+            for event in events:
+                if event.mask & inotify.IN_Q_OVERFLOW:
+                    cache.clear()
+                    continue
+                directory = self._watches.get(event.wd)
+                if directory is None:
+                    continue
+                if event.name:
+                    cache.pop(os.path.join(directory, event.name), None)
+                if event.mask & (inotify.IN_IGNORED | inotify.IN_DELETE_SELF |
+                                 inotify.IN_MOVE_SELF):
+                    for path in [p for p in cache
+                                 if os.path.dirname(p) == directory]:
+                        del cache[path]
+                    if event.mask & inotify.IN_IGNORED:
+                        del self._watches[event.wd]
+                        del self._watched[directory]
+
+
+def _simple(start_response, status, headers=None):
+    body = status.encode("ascii") + b"\n"
+    start_response(status, [("Content-Type", "text/plain"),
+                            ("Content-Length", str(len(body)))] +
+                           (headers or []))
+    return [body]
+
+
+def _not_modified(environ, info):
+    """Evaluate the conditional request headers."""
+    inm = environ.get("HTTP_IF_NONE_MATCH")
+    if inm is not None:
+        tags = [t.strip() for t in inm.split(",")]
+        return ("*" in tags or info.etag in tags or
+                "W/" + info.etag in tags)
+    ims = environ.get("HTTP_IF_MODIFIED_SINCE")
+    if ims is not None:
+        try:
+            since = calendar.timegm(httputils.HTTPDate(ims)._value)
+        except (httputils.ValueInvalidError, TypeError, ValueError):
+            return False
+        return info.mtime <= since
+    return False
+
+
+def _get_range(environ, info):
+    """Return the (offset, length) of a single byte range requested, () if
+    it can not be satisfied, or None to send the whole file.
+    """
+    spec = environ.get("HTTP_RANGE")
+    if not spec or not spec.startswith("bytes=") or "," in spec:
+        return None
+    ifrange = environ.get("HTTP_IF_RANGE")
+    if ifrange is not None and ifrange.strip() not in (info.etag,
+                                                       info.last_modified):
+        return None
+    first, sep, last = spec[6:].strip().partition("-")
+    try:
+        if not first: # suffix range
+            length = min(int(last), info.size)
+            if length <= 0:
+                return ()
+            return info.size - length, length
+        first = int(first)
+        last = int(last) if last else info.size - 1
+    except ValueError:
+        return None
+    if not sep:
+        return None
+    if first >= info.size:
+        return ()
+    if first > last:
+        return None
+    return first, min(last, info.size - 1) - first + 1
@@ -0,0 +1,796 @@
+#!/usr/bin/python3.4
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A native HTTP/1.1 server for WSGI applications, for when there is no front
+end web server to talk SCGI or FastCGI to.
+
+One process serves all connections from the asyncio poller. Connections are
+kept alive, and pipelined requests are answered in order. By default the
+application is called in the poller loop, which suits quick applications.
+Given some workers, blocking applications are run in that many threads
+instead.
+
+Usually started by the http_server program.
+"""
+
+import sys
+import os
+import errno
+import signal
+import socket
+import tempfile
+import traceback
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, time
+from urllib.parse import unquote_to_bytes
+
+from pycopia import asyncio
+from pycopia import getopt
+from pycopia import logging
+from pycopia import basicconfig
+from pycopia import module
+from pycopia.OS import procfs
+from pycopia.inet import httputils
+from pycopia.inet import httpparser
+
+SERVER_SOFTWARE = "Pycopia-WSGI/1.0"
+
+DEFAULT_ENVIRON = {
+    'wsgi.version': (1,0),
+    'wsgi.url_scheme': 'http',
+    'wsgi.multithread': False,
+    'wsgi.multiprocess': False,
+    'wsgi.run_once': False,
+    'wsgi.file_wrapper': httputils.FileWrapper,
+    'SCRIPT_NAME': '',
+    'SERVER_SOFTWARE': SERVER_SOFTWARE,
+}
+
+# Headers that go in the environment without the HTTP_ prefix.
+_CGI_HEADERS = {"CONTENT_TYPE", "CONTENT_LENGTH"}
+
+_date_cache = [0, b""]
+
+def _http_date():
+    """Date header line for now, made once a second."""
+    now = int(time())
+    if now != _date_cache[0]:
+        _date_cache[0] = now
+        _date_cache[1] = "Date: {}\r\n".format(
+            httputils.HTTPDate.from_float(now)).encode("ascii")
+    return _date_cache[1]
+
+
+class _RequestParser(httpparser.HTTPParser):
+    """Builds a WSGI environment for each request of a connection."""
+
+    def __init__(self, conn, maxbuffer):
+        super(_RequestParser, self).__init__(httpparser.REQUEST, maxbuffer)
+        self._conn = conn
+        self._environ = None
+        self._input = None
+
+    def on_request(self, method, target, version):
+        env = self._conn.server.environ.copy()
+        env.update(self._conn.environ)
+        if not target.startswith("/"):
+            if "://" in target: # absolute form
+                target = "/" + target.split("://", 1)[1].partition("/")[2]
+            elif target != "*":
+                raise httpparser.HTTPParseError("Bad request target.")
+        path, _, query = target.partition("?")
+        env["REQUEST_METHOD"] = method
+        env["PATH_INFO"] = unquote_to_bytes(path).decode("latin1")
+        env["QUERY_STRING"] = query
+        env["SERVER_PROTOCOL"] = version
+        self._environ = env
+
+    def on_headers(self, headers):
+        env = self._environ
+        for header in headers:
+            key = header._name.upper().replace("-", "_")
+            if key not in _CGI_HEADERS:
+                key = "HTTP_" + key
+            value = header.raw_value()
+            if key in env:
+                value = env[key] + "," + value
+            env[key] = value
+        env["wsgi.input"] = self._input = tempfile.SpooledTemporaryFile(
+                self.maxbuffer)
+        if self.chunked:
+            env.pop("CONTENT_LENGTH", None)
+        if "100-continue" in env.get("HTTP_EXPECT", "").lower():
+            self._conn._continue()
+
+    def on_body(self, data):
+        self._input.write(data)
+
+    def on_message_complete(self):
+        env, self._environ = self._environ, None
+        length = self._input.tell()
+        if length:
+            env["CONTENT_LENGTH"] = str(length)
+        self._input.seek(0)
+        self._input = None
+        if not self.keep_alive:
+            self._conn._closing = True
+        self.pause()
+        self._conn._request = env
+
+
+class HTTPConnection(asyncio.AsyncWorkerHandler):
+    """An HTTP client connection, handled in the poller loop.
+
+    Only one request at a time is handled. While it is, the socket is not
+    read, so a client that pipelines requests can not make the server
+    buffer more than one read of them.
+    """
+
+    def __init__(self, sock, addr, server):
+        self.server = server
+        super(HTTPConnection, self).__init__(sock, addr)
+
+    def initialize(self):
+        sock = self._sock
+        sock.setblocking(False)
+        if sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            host, port = sock.getsockname()[:2]
+            self.environ = {"SERVER_NAME": host, "SERVER_PORT": str(port),
+                            "REMOTE_ADDR": self._rem_address[0],
+                            "REMOTE_PORT": str(self._rem_address[1])}
+        else:
+            self.environ = {"SERVER_NAME": "localhost", "SERVER_PORT": "",
+                            "REMOTE_ADDR": ""}
+        self._parser = _RequestParser(self, self.server.maxbuffer)
+        self._request = None # WSGI environment of a request to handle.
+        self._input = None # Request body of the response being sent.
+        self._response = None # Iterator of response data to send.
+        self._out = None # Data being sent.
+        self._file = None # File descriptor, offset and count to send.
+        self._busy = False
+        self._closing = False
+        self._chunked = False
+        self._nobody = False
+
+    def close(self):
+        if self._sock is not None:
+            self.server._forget(self)
+            self._file = None
+            response, self._response = self._response, None
+            if response is not None:
+                response.close()
+            self._close_input()
+            if self._parser._input is not None: # A request body cut off.
+                self._parser._input.close()
+        super(HTTPConnection, self).close()
+
+    def readable(self):
+        return (self._state == asyncio.CONNECTED and not self._busy and
+                self._request is None)
+
+    def writable(self):
+        return (self._state == asyncio.CONNECTED and
+                (bool(self._out) or self._file is not None or
+                 self._response is not None))
+
+    def priority(self):
+        return False
+
+    def hangup_handler(self):
+        self.close()
+
+    def error_handler(self):
+        self.close()
+
+    def exception_handler(self, ex, val, tb):
+        traceback.print_exception(ex, val, tb, None, sys.stderr)
+        self.close()
+
+    def read_handler(self):
+        try:
+            data = self._sock.recv(self.server.recvsize)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.close()
+            return
+        if not data:
+            self.close()
+            return
+        self.server._touch(self)
+        try:
+            self._parser.feed(data)
+        except httpparser.HTTPParseError as err:
+            self._error(err.status, str(err))
+            return
+        if self._request is not None:
+            self._serve()
+
+    def write_handler(self):
+        if self._pump() and self._next():
+            self._serve()
+
+    def _serve(self):
+        """Handle parsed requests, in order, until one has to wait."""
+        while self._request is not None:
+            environ, self._request = self._request, None
+            self._input = environ["wsgi.input"]
+            self._busy = True
+            self.server._forget(self)
+            if self.server.workers:
+                asyncio.poller.unregister(self)
+                self._sock.settimeout(self.server.keepalive)
+                self.server._submit(self._run_in_thread, environ)
+                return
+            self._response = self._respond(environ)
+            if not self._pump():
+                self._update()
+                return
+            if not self._next():
+                return
+        self._update()
+
+    def _update(self):
+        """Have the poller wait for what the connection now waits for."""
+        if self._sock is None: # closed
+            return
+        if asyncio.poller.is_registered(self):
+            asyncio.poller.modify(self)
+        else:
+            asyncio.poller.register(self)
+
+    def _close_input(self):
+        inp, self._input = self._input, None
+        if inp is not None:
+            inp.close()
+
+    def _next(self):
+        """A response is done. Close, or go on to the next request.
+        Returns False if the connection was closed.
+        """
+        self._busy = False
+        self._response = None
+        self._close_input()
+        if self._closing:
+            self.close()
+            return False
+        self.server._touch(self)
+        try:
+            self._parser.resume()
+        except httpparser.HTTPParseError as err:
+            self._error(err.status, str(err))
+            return False
+        return True
+
+    def _pump(self):
+        """Send response data until the socket is full. Returns True when
+        the response has all been sent.
+        """
+        while True:
+            if self._out:
+                try:
+                    n = self._sock.send(self._out)
+                except (BlockingIOError, InterruptedError):
+                    return False
+                except OSError:
+                    self.close()
+                    return False
+                self._out = self._out[n:]
+                if self._out:
+                    return False
+            if self._file is not None:
+                fd, offset, count = self._file
+                try:
+                    n = os.sendfile(self._sock.fileno(), fd, offset, count)
+                except (BlockingIOError, InterruptedError):
+                    return False
+                except OSError:
+                    self.close()
+                    return False
+                if n == 0: # The file was cut short.
+                    self.close()
+                    return False
+                if n < count:
+                    self._file = [fd, offset + n, count - n]
+                    continue
+                self._file = None
+            if self._response is None:
+                return True
+            try:
+                data = next(self._response)
+            except StopIteration:
+                self._response = None
+                return True
+            if type(data) is tuple: # A file to send.
+                wrapper, offset, count = data
+                self._file = [wrapper.filelike.fileno(), offset, count]
+            else:
+                self._out = memoryview(data)
+
+    def _run_in_thread(self, environ):
+        try:
+            for data in self._respond(environ):
+                if type(data) is tuple:
+                    wrapper, offset, count = data
+                    self._sock.sendfile(wrapper.filelike, offset, count)
+                else:
+                    self._sock.sendall(data)
+        except OSError:
+            self._closing = True
+        except:
+            traceback.print_exc(None, sys.stderr)
+            self._closing = True
+        self.server._finished(self)
+
+    def _thread_done(self):
+        """Take the connection back from a worker thread."""
+        if self._sock is None:
+            return
+        self._sock.setblocking(False)
+        if self._next():
+            self._serve()
+
+    def _continue(self):
+        try:
+            self._sock.send(b"HTTP/1.1 100 Continue\r\n\r\n")
+        except OSError:
+            pass
+
+    def _error(self, status, message):
+        """Answer a request that could not be parsed, and close."""
+        body = message.encode("latin1") + b"\r\n"
+        self._out = (
+            "HTTP/1.1 {} {}\r\nContent-Type: text/plain\r\n"
+            "Content-Length: {}\r\nConnection: close\r\n".format(
+                status, httputils.STATUSCODES.get(status, ""), len(body)
+            ).encode("latin1") + _http_date() + b"\r\n" + body)
+        self._request = None
+        self._busy = True
+        self._closing = True
+        self.server._forget(self)
+        if self._pump():
+            self.close()
+        else: # The rest is sent when the socket is writable.
+            self._update()
+
+    def _respond(self, environ):
+        """Call the application, and generate the response to send. A file
+        to send with sendfile is given as a (wrapper, offset, count) tuple.
+        """
+        headers_set = []
+        headers_sent = []
+        pending = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None:
+                try:
+                    if headers_sent:
+                        raise exc_info[1].with_traceback(exc_info[2])
+                finally:
+                    exc_info = None
+            elif headers_set:
+                raise AssertionError("start_response called twice.")
+            headers_set[:] = [status, headers]
+            return pending.append
+
+        try:
+            result = self.server.app(environ, start_response)
+        except:
+            traceback.print_exc(None, environ["wsgi.errors"])
+            self._closing = True
+            yield self._head("500 Internal Server Error", [], environ, 0)
+            return
+        try:
+            if (isinstance(result, httputils.FileWrapper) and headers_set and
+                    not pending):
+                filerange = result.sendfile_range()
+                if filerange is not None:
+                    headers_sent.append(True)
+                    yield self._head(headers_set[0], headers_set[1], environ,
+                                     filerange[1])
+                    if not self._nobody and filerange[1]:
+                        yield (result,) + filerange
+                    return
+            chunked = False
+            # A single item is the whole body, unless write() was used too.
+            single = (not pending and isinstance(result, (list, tuple)) and
+                      len(result) == 1)
+            for data in _chain(pending, result):
+                if not data:
+                    continue
+                if not headers_sent:
+                    length = len(data) if single else None
+                    head = self._head(headers_set[0], headers_set[1],
+                                      environ, length)
+                    headers_sent.append(True)
+                    chunked = self._chunked
+                    if self._nobody:
+                        yield head
+                        continue
+                    if chunked:
+                        yield head + _chunk(data)
+                    else:
+                        yield head + data
+                elif self._nobody:
+                    continue
+                elif chunked:
+                    yield _chunk(data)
+                else:
+                    yield data
+            if not headers_sent:
+                yield self._head(headers_set[0], headers_set[1], environ, 0)
+            elif chunked:
+                yield b"0\r\n\r\n"
+        except:
+            traceback.print_exc(None, environ["wsgi.errors"])
+            self._closing = True
+            if not headers_sent:
+                yield self._head("500 Internal Server Error", [], environ, 0)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    def _head(self, status, headers, environ, length):
+        """Status line and headers. The length is that of the whole body,
+        if known.
+        """
+        lines = ["HTTP/1.1 ", status, "\r\n"]
+        has_length = has_date = has_server = False
+        self._chunked = False
+        for name, value in headers:
+            key = name.lower()
+            if key == "content-length":
+                has_length = True
+            elif key == "transfer-encoding" or key == "connection":
+                continue # These are up to the server.
+            elif key == "date":
+                has_date = True
+            elif key == "server":
+                has_server = True
+            lines.extend((name, ": ", value, "\r\n"))
+        code = status[:3]
+        nocontent = code in ("204", "304") or code[0] == "1"
+        self._nobody = nocontent or environ["REQUEST_METHOD"] == "HEAD"
+        if has_length:
+            pass
+        elif length is not None:
+            if not nocontent:
+                lines.append("Content-Length: {}\r\n".format(length))
+        elif not self._nobody:
+            if environ["SERVER_PROTOCOL"] == "HTTP/1.1":
+                lines.append("Transfer-Encoding: chunked\r\n")
+                self._chunked = True
+            else:
+                self._closing = True # Body ends with the connection.
+        if not has_server:
+            lines.append("Server: " + SERVER_SOFTWARE + "\r\n")
+        if self._closing:
+            lines.append("Connection: close\r\n")
+        elif environ["SERVER_PROTOCOL"] == "HTTP/1.0":
+            lines.append("Connection: keep-alive\r\n")
+        head = "".join(lines).encode("latin1")
+        if not has_date:
+            head += _http_date()
+        return head + b"\r\n"
+
+
+def _chunk(data):
+    return b"%x\r\n" % len(data) + data + b"\r\n"
+
+
+def _chain(pending, result):
+    """Data given to write(), ahead of each item of the result."""
+    for data in result:
+        while pending:
+            yield pending.pop(0)
+        yield data
+    while pending:
+        yield pending.pop(0)
+
+
+class _Listener(asyncio.AsyncServerHandler):
+
+    def __init__(self, sock, server):
+        self.server = server
+        super(_Listener, self).__init__(sock, HTTPConnection)
+
+    def priority(self):
+        return False
+
+    def read_handler(self):
+        """Accept all pending connections."""
+        while True:
+            try:
+                sock, addr = self._sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if e.errno == errno.ECONNABORTED:
+                    continue
+                if e.errno in (errno.EMFILE, errno.ENFILE):
+                    # Make room by dropping the longest idle connection.
+                    if self.server._drop_idle():
+                        continue
+                    return
+                raise
+            conn = HTTPConnection(sock, addr, self.server)
+            asyncio.poller.register(conn)
+            self.server._touch(conn)
+
+
+class HTTPServer:
+    """Serve a WSGI application over HTTP.
+
+    The address is a (host, port) tuple, or a list of them. A connection
+    left idle for keepalive seconds is closed. Request lines and headers
+    are limited to maxbuffer bytes, and request bodies larger than that
+    are kept in a temporary file.
+    """
+
+    def __init__(self, app, address=("", 8080), workers=0, keepalive=75.0,
+                 maxbuffer=65536, backlog=1024, debug=False):
+        self.app = app
+        self.address = address
+        self.workers = workers
+        self.keepalive = keepalive
+        self.maxbuffer = maxbuffer
+        self.recvsize = min(maxbuffer, 65536)
+        self.backlog = backlog
+        self.debug = debug
+        self.environ = dict(DEFAULT_ENVIRON)
+        self.environ["wsgi.multithread"] = bool(workers)
+        self.environ["wsgi.errors"] = sys.stderr
+        # Connections waiting for a request, least recently active first.
+        self._idle = OrderedDict()
+        self._done = deque()
+        self._pool = None
+        self._wakeup_w = None
+        self._keepGoing = False
+
+    def _setupSocket(self, address):
+        host, port = address
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen(self.backlog)
+        return sock
+
+    def _touch(self, conn):
+        self._idle[conn] = monotonic()
+        self._idle.move_to_end(conn)
+
+    def _forget(self, conn):
+        self._idle.pop(conn, None)
+
+    def _drop_idle(self):
+        try:
+            conn, _ = self._idle.popitem(last=False)
+        except KeyError:
+            return False
+        conn.close()
+        return True
+
+    def _sweep(self):
+        """Close connections that have been idle too long."""
+        idle = self._idle
+        deadline = monotonic() - self.keepalive
+        while idle:
+            conn, lastactive = next(iter(idle.items()))
+            if lastactive > deadline:
+                break
+            conn.close()
+
+    def _submit(self, func, arg):
+        self._pool.submit(func, arg)
+
+    def _finished(self, conn):
+        """Called from a worker thread when a connection is done with."""
+        self._done.append(conn)
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _wakeup(self, fd):
+        try:
+            while os.read(fd, 512):
+                pass
+        except BlockingIOError:
+            pass
+        while self._done:
+            self._done.popleft()._thread_done()
+
+    def _stop_handler(self, signum, frame):
+        self._keepGoing = False
+
+    def run(self, timeout=5.0):
+        """The main loop. Runs until SIGINT or SIGTERM."""
+        addresses = self.address
+        if not isinstance(addresses, list):
+            addresses = [addresses]
+        listeners = [_Listener(self._setupSocket(addr), self)
+                     for addr in addresses]
+        wakeup_r, self._wakeup_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        asyncio.poller.register_fd(wakeup_r, asyncio.EPOLLIN,
+                                   lambda: self._wakeup(wakeup_r))
+        old_wakeup = signal.set_wakeup_fd(self._wakeup_w)
+        old_handlers = [(sig, signal.signal(sig, self._stop_handler))
+                        for sig in (signal.SIGINT, signal.SIGTERM)]
+        sweeper = asyncio.poller.add_timer(self._sweep,
+                                           self.keepalive / 4.0,
+                                           self.keepalive / 4.0)
+        if self.workers:
+            self._pool = ThreadPoolExecutor(self.workers)
+        self._keepGoing = True
+        try:
+            while self._keepGoing:
+                asyncio.poller.poll(timeout)
+        finally:
+            for sig, handler in old_handlers:
+                signal.signal(sig, handler)
+            signal.set_wakeup_fd(old_wakeup)
+            for listener in listeners:
+                listener.close()
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+            asyncio.poller.remove_timer(sweeper)
+            asyncio.poller.unregister_fd(wakeup_r)
+            os.close(wakeup_r)
+            os.close(self._wakeup_w)
+            self._wakeup_w = None
+            self._done.clear()
+            for conn in list(self._idle):
+                conn.close()
+        return 0
+
+
+def get_server(config):
+    """Factory that makes a server from a server configuration."""
+    app = module.get_object(config.APP_LOCATION)
+    if config.DEBUG:
+        logging.loglevel_debug()
+    for mwtuple in config.get("MIDDLEWARE", []):
+        mwobj = module.get_object(mwtuple[0])
+        app = mwobj(app, *mwtuple[1:])
+    return HTTPServer(app, config.ADDRESS,
+                      workers=config.get("WORKERS", 0),
+                      keepalive=config.get("KEEPALIVE", 75.0),
+                      maxbuffer=config.get("MAXBUFFER", 65536),
+                      debug=config.DEBUG)
+
+
+def check4server(config):
+    if os.path.exists(config.PIDFILE):
+        pid = int(open(config.PIDFILE).read().strip())
+        s = procfs.ProcStat(pid)
+        if s and s.command.find(config.SERVERNAME) >= 0:
+            return pid
+    return 0
+
+
+def kill_server(config):
+    pid = check4server(config)
+    if pid:
+        os.kill(pid, signal.SIGTERM)
+        print("Killed {} ({}).".format(config.SERVERNAME, pid))
+    else:
+        print("{} not running.".format(config.SERVERNAME))
+
+
+def _parse_address(text):
+    host, _, port = text.rpartition(":")
+    return host.strip("[]"), int(port)
+
+
+def run_server(argv):
+    do_daemon = True
+    debug = False
+    killserver = False
+    address = None
+    try:
+        optlist, longopts, args = getopt.getopt(argv[1:], "dnh?kl:f:p:a:")
+    except getopt.GetoptError:
+        print(run_server._doc.format(procname=argv[0]))
+        return
+
+    if len(args) > 0:
+        servername = args[0]
+    else:
+        servername = os.path.basename(argv[0])
+
+    logfilename = "/var/log/{}.log".format(servername)
+    cffilename = "/etc/pycopia/{}.conf".format(servername)
+    pidfile = "/var/run/{}.pid".format(servername)
+
+    for opt, optarg in optlist:
+        if opt == "-n":
+            do_daemon = False
+        elif opt == "-k":
+            killserver = True
+        elif opt == "-d":
+            from pycopia import autodebug  # noqa
+            debug = True
+        elif opt == "-l":
+            logfilename = optarg
+        elif opt == "-f":
+            cffilename = optarg
+        elif opt == "-p":
+            pidfile = optarg
+        elif opt == "-a":
+            address = _parse_address(optarg)
+        elif opt in ("-h", "-?"):
+            print(run_server._doc.format(procname=argv[0]))
+            return 2
+
+    try:
+        config = basicconfig.get_config(cffilename,
+                                        CONFIGFILE=cffilename,
+                                        PIDFILE=pidfile,
+                                        ADDRESS=("", 8080),
+                                        LOGFILENAME=logfilename,
+                                        DEBUG=debug,
+                                        SERVERNAME=servername)
+    except:
+        ex, val, tb = sys.exc_info()
+        logging.warn(
+            "Could not get server config: {} ({})".format(ex.__name__, val))
+        return 1
+    config.update(longopts)
+    if address is not None:
+        config.ADDRESS = address
+
+    if killserver:
+        kill_server(config)
+        return 0
+
+    if check4server(config):
+        logging.warn("Server {!r} already running.".format(servername))
+        return 1
+
+    if do_daemon and not debug:
+        from pycopia import daemonize
+        from pycopia import logfile
+        lf = logfile.ManagedStdio(logfilename)
+        daemonize.daemonize(lf, pidfile=pidfile)
+    else:  # for controller
+        with open(pidfile, "w") as fo:
+            fo.write("{}\n".format(os.getpid()))
+
+    server = get_server(config)
+    return int(server.run())
+
+
+# Add documentation this way since server is run in optimized mode.
+run_server._doc = """Run a Pycopia WSGI web server.
+
+    {procname} [-ndk?] [-l <logfile>] [-f <configfile>] [-p <pidfile>]
+                 [-a <host:port>] <servername>
+
+    <servername> determines the configuration, log names, etc. to use.
+
+    Options:
+         -n = Do NOT become a deamon.
+         -d = Enable debugging. Also does not become a deamon.
+         -k = Kill a running server.
+         -l <filename> = Path name of file to log output to.
+         -f <filename> = Path to config file.
+         -p <pidfile> = Path to PID file.
+         -a <host:port> = Address to listen on (default port 8080).
+    """
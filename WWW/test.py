@@ -4,7 +4,14 @@ Unit tests
 """
 
 import sys
+import os
+import time
+import signal
+import socket
 import unittest
+import http.client
+import tempfile
+import zlib
 import webbrowser
 import simplejson
 from io import StringIO
@@ -25,6 +32,10 @@ from pycopia.WWW import serverconfig
 from pycopia.WWW import urllibplus
 from pycopia.WWW import useragents
 from pycopia.WWW import json
+from pycopia.WWW import wsgiserver
+from pycopia.WWW import static
+from pycopia.WWW.middleware import compression
+from pycopia.inet import httputils
 
 
 XHTMLFILENAME = "/tmp/testXHTML.html"
@@ -260,6 +271,257 @@ Some Text.
         content = simplejson.loads(response.content)
         self.assertEqual(content, 1)
 
+    def test_wsgiserver(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                wsgiserver.HTTPServer(_EchoApp, ("127.0.0.1", 18088),
+                                      keepalive=1.0).run()
+            finally:
+                os._exit(0)
+        time.sleep(0.5)
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", 18088)
+            for i in range(3): # all on one connection
+                conn.request("POST", "/echo?n={}".format(i), body=b"hello")
+                resp = conn.getresponse()
+                self.assertEqual(resp.read(), "POST /echo n={} hello".format(i).encode())
+            conn.request("GET", "/stream")
+            resp = conn.getresponse()
+            self.assertEqual(resp.getheader("Transfer-Encoding"), "chunked")
+            self.assertEqual(resp.read(), b"0123456789")
+            # Data given to write() is part of the body, so the length
+            # isn't that of the one item returned.
+            conn.request("GET", "/write")
+            resp = conn.getresponse()
+            self.assertIsNone(resp.getheader("Content-Length"))
+            self.assertEqual(resp.read(), b"abcdefgh")
+            conn.request("POST", "/echo", body=b"again")
+            self.assertEqual(conn.getresponse().read(), b"POST /echo  again")
+            conn.close()
+            # Pipelined requests, with a chunked body, are answered in order.
+            sock = socket.create_connection(("127.0.0.1", 18088))
+            sock.sendall(b"GET /1 HTTP/1.1\r\nHost: localhost\r\n\r\n"
+                         b"POST /2 HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+                         b"3\r\nabc\r\n0\r\n\r\n"
+                         b"GET /3 HTTP/1.1\r\nConnection: close\r\n\r\n")
+            data = b""
+            while True:
+                more = sock.recv(4096)
+                if not more:
+                    break
+                data += more
+            sock.close()
+            self.assertEqual(data.count(b"HTTP/1.1 200 OK"), 3)
+            self.assertLess(data.index(b"GET /1 "), data.index(b"POST /2  abc"))
+            self.assertLess(data.index(b"POST /2  abc"), data.index(b"GET /3 "))
+            # Idle connections are closed.
+            sock = socket.create_connection(("127.0.0.1", 18088))
+            self.assertEqual(sock.recv(1), b"")
+            sock.close()
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+    def test_wsgiserver_bad_request(self):
+        # A malformed request pipelined after a good one is answered with
+        # 400, in both modes, and the server keeps running.
+        for port, workers in ((18089, 0), (18090, 2)):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    wsgiserver.HTTPServer(_EchoApp, ("127.0.0.1", port),
+                                          workers=workers).run()
+                finally:
+                    os._exit(0)
+            time.sleep(0.5)
+            try:
+                request = b"GET / HTTP/1.1\r\nHost: x\r\n\r\nBOGUS\r\n\r\n"
+                # The client goes away at once.
+                sock = socket.create_connection(("127.0.0.1", port))
+                sock.sendall(request)
+                sock.close()
+                time.sleep(0.2)
+                # The client waits for the answers.
+                sock = socket.create_connection(("127.0.0.1", port))
+                sock.sendall(request)
+                data = b""
+                while True:
+                    more = sock.recv(4096)
+                    if not more:
+                        break
+                    data += more
+                sock.close()
+                self.assertTrue(data.startswith(b"HTTP/1.1 200 OK"))
+                self.assertIn(b"HTTP/1.1 400 Bad Request", data)
+                self.assertEqual(os.waitpid(pid, os.WNOHANG), (0, 0))
+            finally:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+
+    def test_static(self):
+        root = tempfile.mkdtemp()
+        path = os.path.join(root, "results.log")
+        with open(path, "w") as fo:
+            fo.write("0123456789")
+        app = static.StaticFiles(root)
+        responses = []
+        def start_response(status, headers):
+            responses.append((status, dict(headers)))
+        def get(**environ):
+            environ.setdefault("REQUEST_METHOD", "GET")
+            environ.setdefault("PATH_INFO", "/results.log")
+            result = app(environ, start_response)
+            body = b"".join(result)
+            if hasattr(result, "close"):
+                result.close()
+            return responses[-1][0], responses[-1][1], body, result
+        result = app({"REQUEST_METHOD": "GET", "PATH_INFO": "/results.log"},
+                     start_response)
+        self.assertIsInstance(result, httputils.FileWrapper)
+        self.assertEqual(result.sendfile_range(), (0, 10))
+        # The file grows after the response is made.
+        with open(path, "a") as fo:
+            fo.write("abc")
+        self.assertEqual(result.sendfile_range(), (0, 10))
+        self.assertEqual(b"".join(result), b"0123456789")
+        result.close()
+        # The file grows after it was stat'ed, and before it is opened.
+        status, headers, body, result = get()
+        self.assertEqual((headers["Content-Length"], body),
+                         ("13", b"0123456789abc"))
+        with open(path, "w") as fo:
+            fo.write("0123456789")
+        status, headers, body, result = get()
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(body, b"0123456789")
+        self.assertEqual(headers["Content-Length"], "10")
+        etag = headers["ETag"]
+        status, headers, body, result = get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((status, body), ("304 Not Modified", b""))
+        status, headers, body, result = get(
+                HTTP_IF_MODIFIED_SINCE=headers["Last-Modified"])
+        self.assertEqual(status, "304 Not Modified")
+        status, headers, body, result = get(HTTP_RANGE="bytes=2-4")
+        self.assertEqual((status, body), ("206 Partial Content", b"234"))
+        self.assertEqual(headers["Content-Range"], "bytes 2-4/10")
+        self.assertEqual(get(HTTP_RANGE="bytes=20-")[0],
+                         "416 Range Not Satisfiable")
+        self.assertEqual(get(PATH_INFO="/../results.log")[0], "404 Not Found")
+        self.assertEqual(get(REQUEST_METHOD="PUT")[0], "405 Method Not Allowed")
+        # A changed file is noticed.
+        with open(path, "w") as fo:
+            fo.write("changed")
+        if app._notifier is None:
+            time.sleep(app.recheck)
+        status, headers, body, result = get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((status, body), ("200 OK", b"changed"))
+        self.assertNotEqual(headers["ETag"], etag)
+        app.close()
+        os.unlink(path)
+        os.rmdir(root)
+
+    def test_compression(self):
+        accept = httputils.AcceptEncoding("deflate;q=0.5, gzip, br;q=0")
+        self.assertEqual(accept.select(["br", "deflate"]), "deflate")
+        self.assertEqual(accept.select(["gzip", "deflate"]), "gzip")
+        self.assertIsNone(httputils.AcceptEncoding("identity").select(["gzip"]))
+        page = b"<tr><td>test case</td><td>PASSED</td></tr>\n" * 1000
+        calls = []
+        def report(environ, start_response):
+            calls.append(environ.get("HTTP_IF_NONE_MATCH"))
+            if environ.get("HTTP_IF_NONE_MATCH") == '"v1"':
+                start_response("304 Not Modified", [("ETag", '"v1"')])
+                return []
+            start_response("200 OK", [("Content-Type", "text/html"),
+                                      ("Content-Length", str(len(page))),
+                                      ("ETag", '"v1"')])
+            return [page[:20000], page[20000:]]
+        app = compression.CompressionMiddleware(report)
+        def get(**environ):
+            environ.setdefault("REQUEST_METHOD", "GET")
+            responses = []
+            result = app(environ, lambda status, headers, exc_info=None:
+                         responses.append((status, dict(headers))))
+            body = b"".join(result)
+            return responses[-1][0], responses[-1][1], body
+        status, headers, body = get(HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertEqual(headers["ETag"], '"v1-gzip"')
+        self.assertNotIn("Content-Length", headers)
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), page)
+        self.assertLess(len(body), len(page) // 20)
+        # The compressed body is cached.
+        status, headers, cached = get(HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual((cached, headers["Content-Length"]),
+                         (body, str(len(body))))
+        # Conditional requests for the compressed variant.
+        status, headers, empty = get(HTTP_ACCEPT_ENCODING="gzip",
+                                     HTTP_IF_NONE_MATCH='"v1-gzip"')
+        self.assertEqual((status, headers["ETag"]),
+                         ("304 Not Modified", '"v1-gzip"'))
+        self.assertEqual(calls[-1], '"v1"')
+        status, headers, body = get(HTTP_ACCEPT_ENCODING="deflate")
+        self.assertEqual(zlib.decompress(body), page)
+        status, headers, body = get()
+        self.assertNotIn("Content-Encoding", headers)
+        self.assertEqual(body, page)
+        # A HEAD request neither uses nor fills the cache.
+        def head_report(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/html"),
+                                      ("ETag", '"v2"')])
+            if environ["REQUEST_METHOD"] == "HEAD":
+                return []
+            return [page]
+        app = compression.CompressionMiddleware(head_report)
+        status, headers, body = get(REQUEST_METHOD="HEAD",
+                                    HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual((headers["Content-Encoding"], body), ("gzip", b""))
+        status, headers, body = get(HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), page)
+        # Streamed items are flushed as they come.
+        def stream(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            for i in range(3):
+                yield "line {}\n".format(i).encode("ascii")
+        app = compression.CompressionMiddleware(stream, minsize=0)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        result = app({"REQUEST_METHOD": "GET", "HTTP_ACCEPT_ENCODING": "gzip"},
+                     lambda status, headers, exc_info=None: None)
+        self.assertEqual(decompressor.decompress(next(result)), b"line 0\n")
+        self.assertEqual(decompressor.decompress(next(result)), b"line 1\n")
+        result.close()
+        # An error response replacing a compressed one is sent as it is.
+        def failing(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/html")])
+            try:
+                raise ValueError("no report")
+            except ValueError:
+                start_response("500 Internal Server Error",
+                               [("Content-Type", "text/plain")], sys.exc_info())
+            return [b"no report"]
+        app = compression.CompressionMiddleware(failing, minsize=0)
+        status, headers, body = get(HTTP_ACCEPT_ENCODING="gzip")
+        self.assertNotIn("Content-Encoding", headers)
+        self.assertEqual((status[:3], body), ("500", b"no report"))
+
+
+def _EchoApp(environ, start_response):
+    if environ["PATH_INFO"] == "/stream":
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return (str(i).encode("ascii") for i in range(10))
+    if environ["PATH_INFO"] == "/write":
+        write = start_response("200 OK", [("Content-Type", "text/plain")])
+        write(b"abc")
+        return [b"defgh"]
+    body = environ["wsgi.input"].read()
+    data = "{} {} {} ".format(environ["REQUEST_METHOD"], environ["PATH_INFO"],
+                              environ["QUERY_STRING"]).encode("ascii") + body
+    start_response("200 OK", [("Content-Type", "text/plain"),
+                              ("Content-Length", str(len(data)))])
+    return [data]
+
 
 def GetMockEnviron(handler):
     environ = {}
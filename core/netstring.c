@@ -15,11 +15,94 @@
  *
  */
 
+#define PY_SSIZE_T_CLEAN
+
 #include <stddef.h>
+#include <errno.h>
+#include <poll.h>
 #include <sys/socket.h>
 
 #include "Python.h"
 
+/* Longest length prefix we accept, not counting the colon. */
+#define MAXDIGITS 20
+
+
+/* Parse the length prefix at the start of buf. Returns 1 and sets hdrlen
+ * (including the colon) and slen if it is complete, 0 if more data is
+ * needed, and -1 with an exception set if it is malformed.
+ */
+static int
+parse_prefix(const char *buf, Py_ssize_t len, Py_ssize_t *hdrlen,
+             Py_ssize_t *slen)
+{
+    Py_ssize_t i;
+    Py_ssize_t n = 0;
+
+    for (i = 0; i < len && i <= MAXDIGITS; i++) {
+        char c = buf[i];
+        if (c >= '0' && c <= '9') {
+            if (n > (PY_SSIZE_T_MAX - 9) / 10) {
+                PyErr_SetString(PyExc_OverflowError,
+                                "netstring length is too large.");
+                return -1;
+            }
+            n = n * 10 + (c - '0');
+        } else if (c == ':' && i > 0) {
+            *hdrlen = i + 1;
+            *slen = n;
+            return 1;
+        } else {
+            PyErr_SetString(PyExc_ValueError, "netstring malformed length.");
+            return -1;
+        }
+    }
+    if (i > MAXDIGITS) {
+        PyErr_SetString(PyExc_ValueError, "netstring malformed length.");
+        return -1;
+    }
+    return 0;
+}
+
+
+/* Read exactly len bytes from a socket, waiting if it is non-blocking. */
+static int
+recv_all(int sockfd, char *buf, Py_ssize_t len)
+{
+    ssize_t rcvlen;
+    struct pollfd pfd;
+
+    while (len > 0) {
+        Py_BEGIN_ALLOW_THREADS
+        rcvlen = recv(sockfd, (void *) buf, (size_t) len, MSG_WAITALL);
+        Py_END_ALLOW_THREADS
+        if (rcvlen < 0) {
+            if (errno == EINTR) {
+                if (PyErr_CheckSignals() < 0)
+                    return -1;
+                continue;
+            }
+            if (errno == EAGAIN || errno == EWOULDBLOCK) {
+                pfd.fd = sockfd;
+                pfd.events = POLLIN;
+                Py_BEGIN_ALLOW_THREADS
+                poll(&pfd, 1, -1);
+                Py_END_ALLOW_THREADS
+                continue;
+            }
+            PyErr_SetFromErrno(PyExc_IOError);
+            return -1;
+        }
+        if (rcvlen == 0) {
+            PyErr_SetString(PyExc_EOFError, "netstring truncated by end of stream.");
+            return -1;
+        }
+        buf += rcvlen;
+        len -= rcvlen;
+    }
+    return 0;
+}
+
 
 PyDoc_STRVAR(netstring_encode_doc,
 "encode(b)\n\
@@ -29,38 +112,86 @@ Return a bytes object that encodeds the given byte string.");
 static PyObject *
 netstring_encode(PyObject *self, PyObject *args)
 {
-    PyObject *src = NULL;
-    char *srcbuf;
-    Py_ssize_t srclen;
+    Py_buffer src;
     PyObject *dst = NULL;
     char *dstbuf;
     int o;
 
-    if (PyArg_UnpackTuple(args, "src", 1, 1, &src)) {
-        if (PyBytes_Check(src)) {
-            srclen = PyBytes_GET_SIZE(src);
-            srcbuf = PyBytes_AS_STRING(src);
-            dst = PyBytes_FromStringAndSize(NULL, srclen+23);
-            if (!dst)
-                return NULL;
-            dstbuf = PyBytes_AS_STRING(dst);
-            o = sprintf(dstbuf, "%lu:", (unsigned long) srclen);
-            memcpy((void *) dstbuf + o, (void *) srcbuf, (size_t) srclen);
-            o += srclen;
-            dstbuf[o++] = ',';
-            if (o != srclen+23 && _PyBytes_Resize(&dst, o) < 0) {
-                Py_XDECREF(dst);
-                return NULL;
-            }
-        } else {
-            PyErr_SetString(PyExc_TypeError, "netstring.encode needs a bytes object.");
-            return NULL;
-        }
+    if (!PyArg_ParseTuple(args, "y*:encode", &src))
+        return NULL;
+    dst = PyBytes_FromStringAndSize(NULL, src.len + MAXDIGITS + 3);
+    if (dst) {
+        dstbuf = PyBytes_AS_STRING(dst);
+        o = sprintf(dstbuf, "%zd:", src.len);
+        memcpy((void *) dstbuf + o, src.buf, (size_t) src.len);
+        o += src.len;
+        dstbuf[o++] = ',';
+        if (_PyBytes_Resize(&dst, o) < 0)
+            dst = NULL;
     }
+    PyBuffer_Release(&src);
     return dst;
 }
 
 
+PyDoc_STRVAR(netstring_encode_into_doc,
+"encode_into(buffer, offset, b)\n\
+\n\
+Encode the byte string b into the writable buffer (e.g. a bytearray)\n\
+at offset. Return the offset just past the encoded netstring, so several\n\
+may be packed into one preallocated buffer. Raises ValueError if the\n\
+buffer is too small.");
+
+static PyObject *
+netstring_encode_into(PyObject *self, PyObject *args)
+{
+    Py_buffer dst;
+    Py_buffer src;
+    Py_ssize_t offset;
+    char prefix[MAXDIGITS + 2];
+    char *dstbuf;
+    int o;
+    PyObject *rv = NULL;
+
+    if (!PyArg_ParseTuple(args, "w*ny*:encode_into", &dst, &offset, &src))
+        return NULL;
+    o = sprintf(prefix, "%zd:", src.len);
+    if (offset < 0 || offset > dst.len || dst.len - offset < o + src.len + 1) {
+        PyErr_SetString(PyExc_ValueError, "netstring.encode_into buffer too small.");
+    } else {
+        dstbuf = (char *) dst.buf + offset;
+        memcpy((void *) dstbuf, (void *) prefix, (size_t) o);
+        memmove((void *) (dstbuf + o), src.buf, (size_t) src.len);
+        dstbuf[o + src.len] = ',';
+        rv = PyLong_FromSsize_t(offset + o + src.len + 1);
+    }
+    PyBuffer_Release(&src);
+    PyBuffer_Release(&dst);
+    return rv;
+}
+
+
+PyDoc_STRVAR(netstring_encoded_length_doc,
+"encoded_length(n)\n\
+\n\
+Return the size of the netstring encoding of a byte string of length n.");
+
+static PyObject *
+netstring_encoded_length(PyObject *self, PyObject *args)
+{
+    Py_ssize_t n;
+    char prefix[MAXDIGITS + 2];
+
+    if (!PyArg_ParseTuple(args, "n:encoded_length", &n))
+        return NULL;
+    if (n < 0) {
+        PyErr_SetString(PyExc_ValueError, "negative length.");
+        return NULL;
+    }
+    return PyLong_FromSsize_t(sprintf(prefix, "%zd:", n) + n + 1);
+}
+
+
 PyDoc_STRVAR(netstring_decode_doc,
 "decode(b)\n\
 \n\
@@ -69,57 +200,79 @@ Decode a netstring (as bytes) return byte string.");
 static PyObject *
 netstring_decode(PyObject *self, PyObject *args)
 {
-    PyObject *src = NULL;
-    char *srcbuf;
-    Py_ssize_t srclen;
+    Py_buffer src;
     PyObject *dst = NULL;
-    char *dstbuf;
-    unsigned long slen;
+    const char *srcbuf;
+    Py_ssize_t hdrlen, slen;
     int o;
 
-    if (PyArg_UnpackTuple(args, "src", 1, 1, &src)) {
-        if (PyBytes_Check(src)) {
-            srcbuf = PyBytes_AS_STRING(src);
-            srclen = PyBytes_GET_SIZE(src);
-            o = sscanf(srcbuf, "%21lu:",&slen);
-            if (o == EOF) {
-                return PyErr_SetFromErrno(PyExc_OSError);
-            }
-            if (o < 1) {
-                PyErr_SetString(PyExc_ValueError, "netstring.decode malformed length.");
-                return NULL;
-            }
-            srcbuf = strchr(srcbuf, ':');
-            if (srcbuf == NULL) {
-                PyErr_SetString(PyExc_ValueError, "netstring.decode malformed prefix.");
-                return NULL;
-            }
-            if (slen > srclen) {
-                PyErr_SetString(PyExc_OverflowError, "source string is too large");
-                return NULL;
-            }
-            if (srcbuf[slen+1] != ',') {
-                PyErr_SetString(PyExc_ValueError, "netstring.decode malformed end.");
-                return NULL;
-            }
-            dst = PyBytes_FromStringAndSize(NULL, slen);
-            if (!dst)
-                return NULL;
-            dstbuf = PyBytes_AS_STRING(dst);
-            memcpy((void *) dstbuf, (void *) ++srcbuf, (size_t) slen);
-            return dst;
-        } else {
-            PyErr_SetString(PyExc_TypeError, "netstring.decode needs a bytes object.");
-            return NULL;
-        }
+    if (!PyArg_ParseTuple(args, "y*:decode", &src))
+        return NULL;
+    srcbuf = (const char *) src.buf;
+    o = parse_prefix(srcbuf, src.len, &hdrlen, &slen);
+    if (o == 0 || (o > 0 && src.len - hdrlen <= slen)) {
+        PyErr_SetString(PyExc_ValueError, "netstring.decode truncated.");
+    } else if (o > 0) {
+        if (srcbuf[hdrlen + slen] != ',')
+            PyErr_SetString(PyExc_ValueError, "netstring.decode malformed end.");
+        else
+            dst = PyBytes_FromStringAndSize(srcbuf + hdrlen, slen);
     }
-    return NULL;
+    PyBuffer_Release(&src);
+    return dst;
 }
 
+
+PyDoc_STRVAR(netstring_decode_offsets_doc,
+"decode_offsets(buffer, offset=0)\n\
+\n\
+Incrementally decode the netstring starting at offset in a buffer\n\
+(bytes, bytearray, memoryview). Return a (start, end) tuple locating the\n\
+payload in the buffer, without copying it, or None if the buffer does not\n\
+yet hold the complete netstring. The next netstring begins at end + 1.");
+
+static PyObject *
+netstring_decode_offsets(PyObject *self, PyObject *args)
+{
+    Py_buffer src;
+    Py_ssize_t offset = 0;
+    Py_ssize_t hdrlen, slen, start;
+    const char *srcbuf;
+    PyObject *rv = NULL;
+    int o;
+
+    if (!PyArg_ParseTuple(args, "y*|n:decode_offsets", &src, &offset))
+        return NULL;
+    if (offset < 0 || offset > src.len) {
+        PyErr_SetString(PyExc_IndexError, "offset out of range.");
+        goto done;
+    }
+    srcbuf = (const char *) src.buf + offset;
+    o = parse_prefix(srcbuf, src.len - offset, &hdrlen, &slen);
+    if (o < 0)
+        goto done;
+    if (o == 0 || src.len - offset - hdrlen <= slen) {
+        Py_INCREF(Py_None);
+        rv = Py_None;
+        goto done;
+    }
+    if (srcbuf[hdrlen + slen] != ',') {
+        PyErr_SetString(PyExc_ValueError, "netstring malformed end.");
+        goto done;
+    }
+    start = offset + hdrlen;
+    rv = Py_BuildValue("(nn)", start, start + slen);
+ done:
+    PyBuffer_Release(&src);
+    return rv;
+}
+
+
 PyDoc_STRVAR(netstring_decode_stream_doc,
 "decode_stream(socket)\n\
 \n\
-Decode a netstring read from a socket, return decoded bytes,");
+Decode a netstring read from a socket, return decoded bytes,\n\
+Nothing past the end of the netstring is consumed from the socket.");
 
 static PyObject *
 netstring_decode_stream(PyObject *self, PyObject *args)
@@ -127,60 +280,124 @@ netstring_decode_stream(PyObject *self, PyObject *args)
     PyObject *stream = NULL;
     PyObject *dst = NULL;
     int sockfd = -1;
-    char buf[22];
+    char buf[MAXDIGITS + 2];
     char *bp;
     ssize_t rcvlen;
-    unsigned long slen;
-    int o;
+    Py_ssize_t hdrlen = 0, slen = 0;
+    int o = 0;
 
-    if (PyArg_UnpackTuple(args, "stream", 1, 1, &stream)) {
-        if ((sockfd = PyObject_AsFileDescriptor(stream)) < 0) {
-            return NULL;
-        }
+    if (!PyArg_UnpackTuple(args, "stream", 1, 1, &stream))
+        return NULL;
+    if ((sockfd = PyObject_AsFileDescriptor(stream)) < 0)
+        return NULL;
+    // Peek at the length header, so it can be consumed exactly.
+    do {
         Py_BEGIN_ALLOW_THREADS
-        rcvlen = recv(sockfd, (void *) buf, 22, MSG_PEEK);
+        rcvlen = recv(sockfd, (void *) buf, sizeof(buf), MSG_PEEK);
         Py_END_ALLOW_THREADS
-        if (rcvlen < 0) {
-            return PyErr_SetFromErrno(PyExc_IOError);
-        }
-        o = sscanf(buf, "%21lu:",&slen);
-        if (o == EOF) {
-            return PyErr_SetFromErrno(PyExc_OSError);
-        }
-        if (o < 1) {
-            PyErr_SetString(PyExc_ValueError, "netstring.decode_stream malformed length.");
-            return NULL;
-        }
-        bp = strchr(buf, ':');
-        if (bp == NULL) {
-            PyErr_SetString(PyExc_ValueError, "netstring.decode_stream malformed prefix.");
-            return NULL;
-        }
-        bp++;
+    } while (rcvlen < 0 && errno == EINTR && PyErr_CheckSignals() == 0);
+    if (rcvlen < 0 && PyErr_Occurred())
+        return NULL;
+    if (rcvlen > 0)
+        o = parse_prefix(buf, rcvlen, &hdrlen, &slen);
+    if (o < 0)
+        return NULL;
+    if (o > 0) {
         // discard length header
-        Py_BEGIN_ALLOW_THREADS
-        recv(sockfd, (void *) buf, bp-buf, 0);
-        Py_END_ALLOW_THREADS
-        // Read string into new bytes object.
-        dst = PyBytes_FromStringAndSize(NULL, slen);
-        if (!dst)
+        if (recv_all(sockfd, buf, hdrlen) < 0)
             return NULL;
-        bp = PyBytes_AS_STRING(dst);
-        Py_BEGIN_ALLOW_THREADS
-        rcvlen = recv(sockfd, (void *) bp, slen, 0);
-        Py_END_ALLOW_THREADS
-        if (rcvlen < 0) {
-            return PyErr_SetFromErrno(PyExc_IOError);
-        }
-        recv(sockfd, (void *) buf, 1, 0);
-        if (buf[0] != ',') {
-                PyErr_SetString(PyExc_ValueError, "netstring.decode malformed end.");
+    } else {
+        // Short or failed peek, read the header a byte at a time.
+        for (rcvlen = 0; o == 0; rcvlen++) {
+            if (recv_all(sockfd, buf + rcvlen, 1) < 0)
+                return NULL;
+            o = parse_prefix(buf, rcvlen + 1, &hdrlen, &slen);
+            if (o < 0)
                 return NULL;
         }
-        return dst;
-    } else {
+    }
+    // Read string, and trailing comma, into new bytes object.
+    dst = PyBytes_FromStringAndSize(NULL, slen + 1);
+    if (!dst)
+        return NULL;
+    bp = PyBytes_AS_STRING(dst);
+    if (recv_all(sockfd, bp, slen + 1) < 0) {
+        Py_DECREF(dst);
+        return NULL;
+    }
+    if (bp[slen] != ',') {
+        Py_DECREF(dst);
+        PyErr_SetString(PyExc_ValueError, "netstring.decode malformed end.");
         return NULL;
     }
+    if (_PyBytes_Resize(&dst, slen) < 0)
+        return NULL;
+    return dst;
+}
+
+
+PyDoc_STRVAR(netstring_decode_pairs_doc,
+"decode_pairs(buffer, mapping=None)\n\
+\n\
+Decode NUL separated name and value pairs, such as SCGI headers, from the\n\
+buffer into mapping, or a new dict. Names and values are decoded as\n\
+latin-1 straight from the buffer. Return the mapping.");
+
+static PyObject *
+netstring_decode_pairs(PyObject *self, PyObject *args)
+{
+    Py_buffer src;
+    PyObject *mapping = NULL;
+    PyObject *key, *value;
+    const char *p, *end, *nul;
+    int rc;
+
+    if (!PyArg_ParseTuple(args, "y*|O:decode_pairs", &src, &mapping))
+        return NULL;
+    if (mapping == NULL || mapping == Py_None) {
+        mapping = PyDict_New();
+        if (mapping == NULL)
+            goto fail;
+    } else {
+        Py_INCREF(mapping);
+    }
+    p = (const char *) src.buf;
+    end = p + src.len;
+    while (p < end && *p) {
+        nul = memchr(p, '\0', end - p);
+        if (nul == NULL || nul + 1 >= end)
+            goto malformed;
+        key = PyUnicode_DecodeLatin1(p, nul - p, NULL);
+        if (key == NULL)
+            goto fail;
+        p = nul + 1;
+        nul = memchr(p, '\0', end - p);
+        if (nul == NULL) {
+            Py_DECREF(key);
+            goto malformed;
+        }
+        value = PyUnicode_DecodeLatin1(p, nul - p, NULL);
+        if (value == NULL) {
+            Py_DECREF(key);
+            goto fail;
+        }
+        if (PyDict_CheckExact(mapping))
+            rc = PyDict_SetItem(mapping, key, value);
+        else
+            rc = PyObject_SetItem(mapping, key, value);
+        Py_DECREF(key);
+        Py_DECREF(value);
+        if (rc < 0)
+            goto fail;
+        p = nul + 1;
+    }
+    PyBuffer_Release(&src);
+    return mapping;
+ malformed:
+    PyErr_SetString(PyExc_ValueError, "netstring.decode_pairs malformed pairs.");
+ fail:
+    Py_XDECREF(mapping);
+    PyBuffer_Release(&src);
     return NULL;
 }
 
@@ -190,8 +407,12 @@ netstring_decode_stream(PyObject *self, PyObject *args)
 
 static PyMethodDef netstring_methods[] = {
     {"encode",             netstring_encode, METH_VARARGS, netstring_encode_doc},
+    {"encode_into",        netstring_encode_into, METH_VARARGS, netstring_encode_into_doc},
+    {"encoded_length",     netstring_encoded_length, METH_VARARGS, netstring_encoded_length_doc},
     {"decode",             netstring_decode, METH_VARARGS, netstring_decode_doc},
+    {"decode_offsets",     netstring_decode_offsets, METH_VARARGS, netstring_decode_offsets_doc},
     {"decode_stream",      netstring_decode_stream, METH_VARARGS, netstring_decode_stream_doc},
+    {"decode_pairs",       netstring_decode_pairs, METH_VARARGS, netstring_decode_pairs_doc},
     {NULL, NULL, 0, NULL}           /* sentinel */
 };
 
@@ -0,0 +1,122 @@
+#!/usr/bin/python3.4
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Interface to the Linux inotify file system event API.
+
+"""
+
+import os
+import struct
+import ctypes
+import ctypes.util
+from collections import namedtuple
+
+# from <sys/inotify.h>
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+
+IN_CLOSE = IN_CLOSE_WRITE | IN_CLOSE_NOWRITE
+IN_MOVE = IN_MOVED_FROM | IN_MOVED_TO
+IN_ALL_EVENTS = 0x00000fff
+
+# Events sent by the kernel.
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+# Special flags.
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_MASK_ADD = 0x20000000
+IN_ISDIR = 0x40000000
+IN_ONESHOT = 0x80000000
+
+# Flags for Inotify()
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+_EVENT = struct.Struct("iIII")
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+_libc.inotify_init1.argtypes = [ctypes.c_int]
+_libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32]
+_libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+
+Event = namedtuple("Event", "wd mask cookie name")
+
+
+def _check(rv):
+    if rv < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return rv
+
+
+class Inotify:
+    """An inotify instance. By default it does not block, so read() returns
+    an empty list when there are no events. It may also be registered with
+    a poller, by its fileno().
+    """
+    def __init__(self, flags=IN_NONBLOCK | IN_CLOEXEC):
+        self._fd = _check(_libc.inotify_init1(flags))
+
+    def __del__(self):
+        self.close()
+
+    def fileno(self):
+        return self._fd
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def add_watch(self, path, mask=IN_ALL_EVENTS):
+        """Watch path for events in mask. Returns the watch descriptor."""
+        return _check(_libc.inotify_add_watch(self._fd, os.fsencode(path),
+                                              mask))
+
+    def rm_watch(self, wd):
+        _check(_libc.inotify_rm_watch(self._fd, wd))
+
+    def read(self, size=65536):
+        """Return a list of the pending events."""
+        try:
+            buf = os.read(self._fd, size)
+        except (BlockingIOError, InterruptedError):
+            return []
+        events = []
+        pos = 0
+        while pos < len(buf):
+            wd, mask, cookie, namelen = _EVENT.unpack_from(buf, pos)
+            pos += _EVENT.size
+            name = os.fsdecode(buf[pos:pos+namelen].rstrip(b"\0"))
+            pos += namelen
+            events.append(Event(wd, mask, cookie, name))
+        return events
@@ -16,14 +16,21 @@
 """
 A library for scheduling callback functions using timers and realtime signals.
 
+The FDScheduler variant uses a single timerfd, serviced by the asyncio
+poller, instead of one realtime signal per timer.
 """
 
-__all__ = ['TimeoutError', 'SchedulerError', 'Scheduler', 'get_scheduler',
-           'del_scheduler', 'timeout', 'iotimeout', 'add', 'repeat']
+__all__ = ['TimeoutError', 'SchedulerError', 'Scheduler', 'FDScheduler',
+           'get_scheduler', 'del_scheduler', 'timeout', 'iotimeout', 'add',
+           'repeat']
 
+import sys
 import signal
+from functools import partial
+from time import monotonic
 
 from pycopia import timers
+from pycopia import asyncio
 
 # expose here some timers functions.
 alarm = timers.alarm
@@ -95,6 +102,9 @@ class Scheduler:
             except SchedulerError:
                 pass
 
+    def close(self):
+        self.stop()
+
     def sleep(self, delay):
         """sleep(<secs>)
         Pause the current thread of execution for <secs> seconds. Use this
@@ -148,22 +158,111 @@ class Scheduler:
         self._timed_out = 1
 
 
+class FDScheduler(Scheduler):
+    """A Scheduler that keeps any number of timers in a heap and uses a
+    single timerfd, armed for the nearest deadline, to wake up the poller.
+
+    Callbacks are run from the poll loop rather than from signal handlers, so
+    something must be polling: either your own poller loop, or the sleep()
+    method here. The timeout() and iotimeout() methods are inherited and use
+    their own two signals, as before.
+    """
+    def __init__(self, poller=None):
+        self._poller = poller or asyncio.poller
+        self._queue = asyncio.TimerQueue()
+        self._armed = None
+        self._fdtimer = timers.FDTimer(timers.CLOCK_MONOTONIC, nonblocking=1)
+        self._poller.register_fd(self._fdtimer.fileno(), asyncio.EPOLLIN,
+                                 self._expire)
+
+    def __bool__(self):
+        return bool(self._queue)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def add(self, callback, delay, interval=0, args=None, kwargs=None):
+        """Add a callback with delay and interval.
+        """
+        if kwargs:
+            callback = partial(callback, **kwargs)
+        handle = self._queue.add(callback, delay, interval, args or ())
+        self._arm()
+        return handle
+
+    def remove(self, handle):
+        """remove(handle)
+        Removes the event from the event queue. The handle is the value
+        returned by the add method."""
+        if not self._queue.remove(handle):
+            raise SchedulerError("Bad handle to remove")
+        # The timerfd is left armed, an early wakeup just re-arms it.
+
+    def stop(self):
+        """Stop and remove all timers."""
+        self._queue.clear()
+        if self._fdtimer is not None:
+            self._fdtimer.settime(0.0)
+        self._armed = None
+
+    def close(self):
+        if self._fdtimer is not None:
+            self.stop()
+            self._poller.unregister_fd(self._fdtimer.fileno())
+            self._fdtimer.close()
+            self._fdtimer = None
+
+    def sleep(self, delay):
+        """sleep(<secs>)
+        Poll for <secs> seconds, running any timers, and other poller
+        events, that come due meanwhile."""
+        deadline = monotonic() + delay
+        while 1:
+            remaining = deadline - monotonic()
+            if remaining <= 0.0:
+                break
+            self._poller.poll(remaining)
+
+    def _arm(self):
+        deadline = self._queue.next_deadline()
+        if deadline == self._armed:
+            return
+        if deadline is None:
+            self._fdtimer.settime(0.0)
+        else:
+            self._fdtimer.settime(deadline, 0.0, absolute=1)
+        self._armed = deadline
+
+    def _expire(self):
+        try:
+            self._fdtimer.read()
+        except OSError:  # EAGAIN, a spurious or stale wakeup.
+            pass
+        self._armed = None
+        self._queue.run(self._exception_handler)
+        self._arm()
+
+    def _exception_handler(self, ex, val, tb):
+        print("Scheduler callback exception: %s (%s)" % (ex, val),
+              file=sys.stderr)
+
+
 scheduler = None
 
 
 # alarm schedulers are singleton instances. Only use this factory function to
-# get it.
-def get_scheduler():
+# get it. The first call decides if it is the signal or timerfd type.
+def get_scheduler(timerfd=False):
     global scheduler
     if scheduler is None:
-        scheduler = Scheduler()
+        scheduler = FDScheduler() if timerfd else Scheduler()
     return scheduler
 
 
 def del_scheduler():
     global scheduler
     if scheduler is not None:
-        scheduler.stop()
+        scheduler.close()
         scheduler = None
 
 
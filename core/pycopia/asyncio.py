@@ -19,6 +19,8 @@
 
 import sys, os
 import select, signal, fcntl, struct
+import heapq
+from time import monotonic
 # the only signal module function that is exposed here. The rest are wrapped by
 # Poll.
 pause = signal.pause
@@ -69,6 +71,135 @@ except AttributeError:
 FIONREAD = TIOCINQ = SIOCINQ = 0x541B
 TIOCOUTQ = SIOCOUTQ = 0x5411
 
+
+class TimerQueue(object):
+    """A heap of one-shot and periodic timers on the monotonic clock.
+
+    Timers are identified by an integer handle returned from add(). Removed
+    timers are cancelled in place and dropped lazily when they reach the top
+    of the heap, so both add() and remove() are O(log n) or better.
+    """
+    # heap entry fields
+    _DEADLINE, _HANDLE, _CALLBACK, _ARGS, _INTERVAL = list(range(5))
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._handle = 0
+        self._cancelled = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __bool__(self):
+        return bool(self._entries)
+
+    def __contains__(self, handle):
+        return handle in self._entries
+
+    def add(self, callback, delay, interval=0.0, args=()):
+        """Call callback(*args) after delay seconds, and then every interval
+        seconds if interval is non-zero. Returns a handle for remove().
+        """
+        self._handle += 1
+        entry = [monotonic() + float(delay), self._handle, callback,
+                 tuple(args), float(interval)]
+        self._entries[self._handle] = entry
+        heapq.heappush(self._heap, entry)
+        return self._handle
+
+    def remove(self, handle):
+        """Cancel the timer. Returns True if it was still pending."""
+        try:
+            entry = self._entries.pop(handle)
+        except KeyError:
+            return False
+        entry[self._CALLBACK] = None
+        if entry[self._INTERVAL] < 0.0:  # expired, but not yet run.
+            return True
+        self._cancelled += 1
+        # Don't let cancelled entries dominate the heap.
+        if self._cancelled > 64 and self._cancelled > len(self._heap) // 2:
+            self._heap = [e for e in self._heap if e[self._CALLBACK] is not None]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+        return True
+
+    def clear(self):
+        # Cancel them too, as some may be in a batch being run.
+        for entry in self._entries.values():
+            entry[self._CALLBACK] = None
+        self._heap = []
+        self._entries.clear()
+        self._cancelled = 0
+
+    def _prune(self):
+        heap = self._heap
+        while heap and heap[0][self._CALLBACK] is None:
+            heapq.heappop(heap)
+            self._cancelled -= 1
+
+    def next_deadline(self):
+        """Monotonic time of the nearest pending timer, or None."""
+        self._prune()
+        if self._heap:
+            return self._heap[0][self._DEADLINE]
+        return None
+
+    def get_timeout(self, timeout=-1.0):
+        """Return the given poll timeout (seconds, negative means forever)
+        shortened, if necessary, so that the nearest timer is not missed.
+        """
+        deadline = self.next_deadline()
+        if deadline is None:
+            return timeout
+        delay = max(deadline - monotonic(), 0.0)
+        if timeout is None or timeout < 0 or delay < timeout:
+            return delay
+        return timeout
+
+    def run(self, exception_handler=None):
+        """Run all expired timers as one batch. Periodic timers are
+        re-scheduled before any callback is run. Returns number run.
+        """
+        heap = self._heap
+        now = monotonic()
+        expired = []
+        while heap and heap[0][self._DEADLINE] <= now:
+            entry = heapq.heappop(heap)
+            callback = entry[self._CALLBACK]
+            if callback is None:
+                self._cancelled -= 1
+                continue
+            expired.append(entry)
+            interval = entry[self._INTERVAL]
+            if interval > 0.0:
+                # keep to the original schedule, unless we fell behind.
+                deadline = entry[self._DEADLINE] + interval
+                entry[self._DEADLINE] = deadline if deadline > now else now + interval
+                heapq.heappush(heap, entry)
+            else:
+                entry[self._INTERVAL] = -1.0  # marks as off the heap
+        count = 0
+        for entry in expired:
+            callback = entry[self._CALLBACK]
+            if callback is None:  # removed by an earlier callback in batch
+                continue
+            if entry[self._INTERVAL] < 0.0:
+                self._entries.pop(entry[self._HANDLE], None)
+            count += 1
+            try:
+                callback(*entry[self._ARGS])
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                if exception_handler is None:
+                    raise
+                ex, val, tb = sys.exc_info()
+                exception_handler(ex, val, tb)
+        return count
+
+
 class Poll(object):
     """Object oriented interface to epoll.
 
@@ -79,6 +210,7 @@ class Poll(object):
         self._fd_callbacks = {}
         self._idle_callbacks = {}
         self._idle_handle = 0
+        self._timers = TimerQueue()
         self.pollster = select.epoll()
         self.closed = False
         fd = self.pollster.fileno()
@@ -90,7 +222,7 @@ class Poll(object):
         return "Polling descriptors: %r" % (list(self.smap.keys()),)
 
     def __bool__(self):
-        return bool(self.smap) or bool(self._fd_callbacks)
+        return bool(self.smap) or bool(self._fd_callbacks) or bool(self._timers)
 
     def __iter__(self):
         return list(self.smap.values())
@@ -131,21 +263,14 @@ class Poll(object):
         return fd in self._fd_callbacks
 
     def unregister_fd(self, fd):
+        callback = self._fd_callbacks.pop(fd, None)
         try:
             del self.smap[fd]
         except KeyError:
-            pass
-        else:
-            self.pollster.unregister(fd)
-            return True
-        try:
-            del self._fd_callbacks[fd]
-        except KeyError:
-            pass
-        else:
-            self.pollster.unregister(fd)
-            return True
-        return False
+            if callback is None:
+                return False
+        self.pollster.unregister(fd)
+        return True
 
     def register_idle(self, callback):
         self._idle_handle += 1
@@ -163,10 +288,23 @@ class Poll(object):
         for callback in list(self._idle_callbacks.values()):
             callback()
 
+    def add_timer(self, callback, delay, interval=0.0, args=()):
+        """Call callback(*args) from the poll loop after delay seconds, and
+        then every interval seconds if interval is given. Returns a handle
+        that may be passed to remove_timer().
+        """
+        return self._timers.add(callback, delay, interval, args)
+
+    def remove_timer(self, handle):
+        return self._timers.remove(handle)
+
+    def has_timers(self):
+        return bool(self._timers)
+
     def poll(self, timeout=-1.0):
         while 1:
             try:
-                rl = self.pollster.poll(timeout)
+                rl = self.pollster.poll(self._timers.get_timeout(timeout))
             except IOError as why:
                 if why.errno == EINTR:
                     self._run_idle()
@@ -207,9 +345,11 @@ class Poll(object):
             except:
                 ex, val, tb = sys.exc_info()
                 hobj.exception_handler(ex, val, tb)
+        if self._timers:
+            self._timers.run(self.exception_handler)
 
     def loop(self, timeout=5.0, callback=NULL):
-        while self.smap:
+        while self.smap or self._timers:
             self.poll(timeout)
             self._run_idle()
             callback(self)
@@ -223,6 +363,7 @@ class Poll(object):
                 self.unregister_fd(key)
         self._fd_callbacks = {}
         self._idle_callbacks = {}
+        self._timers.clear()
 
     clear = unregister_all
 
@@ -379,6 +520,34 @@ def set_asyncio(fd_or_obj):
     fcntl.fcntl(fd, fcntl.F_SETOWN, os.getpid())
 
 
+def wait_readable(fd_or_obj, timeout=None):
+    """Wait until a file descriptor is readable (or at EOF), for at most
+    timeout seconds. Returns True if readable, False on timeout.
+
+    Uses a private poll object and no signals, so it is safe to call from any
+    thread.
+    """
+    if type(fd_or_obj) is int:
+        fd = fd_or_obj
+    else:
+        fd = fd_or_obj.fileno()
+    p = select.poll()
+    p.register(fd, select.POLLIN | select.POLLPRI)
+    if timeout is None or timeout < 0:
+        deadline = None
+    else:
+        deadline = monotonic() + timeout
+    while 1:
+        if deadline is None:
+            ms = -1
+        else:
+            ms = max(int((deadline - monotonic()) * 1000.0 + 0.5), 0)
+        try:
+            return bool(p.poll(ms))
+        except InterruptedError:
+            continue
+
+
 def register_asyncio(obj):
     set_asyncio(obj)
     poller.register(obj)
@@ -417,7 +586,7 @@ class AsyncServerHandler(PollerInterface):
 
     @property
     def closed(self):
-        return bool(self._sock)
+        return self._sock is None
 
     def readable(self):
         return True
@@ -441,7 +610,7 @@ class AsyncWorkerHandler(PollerInterface):
         self._sock = sock
         self._rem_address = addr
         self._state = CONNECTED
-        self._buf = ""
+        self._buf = b""
         self.initialize()
 
     def fileno(self):
@@ -468,7 +637,7 @@ class AsyncWorkerHandler(PollerInterface):
         """How many bytes are still in the kernel's input buffer?"""
         return struct.unpack("I", fcntl.ioctl(self._sock.fileno(), SIOCINQ, '\0\0\0\0'))[0]
 
-    def outq(sock):
+    def outq(self):
         """How many bytes are still in the kernel's output buffer?"""
         return struct.unpack("I", fcntl.ioctl(self._sock.fileno(), SIOCOUTQ, '\0\0\0\0'))[0]
 
@@ -514,7 +683,7 @@ class AsyncClientHandler(PollerInterface):
         self._sock = sock
         self._rem_address = addr
         self._state = CONNECTED
-        self._buf = ""
+        self._buf = b""
         self.initialize()
         poller.register(self)
 
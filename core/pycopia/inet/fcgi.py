@@ -59,19 +59,29 @@ import fcntl
 import select
 import errno
 import traceback
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import socket
 from pycopia.aid import NULL
+from pycopia import asyncio
 
 socket.SHUT_WR = 1
 
 import resource
 MAXCONNS = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
 
+# Python 3.7 and later, on most platforms. Spilled input is read with pread
+# and copied otherwise.
+_preadv = getattr(os, "preadv", None)
+
 # Constants from the spec.
 FCGI_LISTENSOCK_FILENO = 0
 
 FCGI_HEADER_LEN = 8
+FCGI_MAX_CONTENT_LEN = 65535
 
 FCGI_VERSION_1 = 1
 
@@ -143,84 +153,136 @@ def close_on_exec(fd):
 class InputStream:
     """
     File-like object representing FastCGI input streams (FCGI_STDIN and
-    FCGI_DATA). Supports the minimum methods required by WSGI spec.
+    FCGI_DATA). Supports the minimum methods required by WSGI spec, and
+    readinto().
+
+    Data is kept in a bytearray with a read offset, and read data is only
+    dropped once there is enough of it. Once more than the server's
+    inputStreamSpillThreshold bytes are waiting to be read, they are moved
+    to an unnamed temporary file instead, along with the rest of the stream.
     """
     def __init__(self, conn):
         self._conn = conn
 
         # See Server.
         self._shrinkThreshold = conn.server.inputStreamShrinkThreshold
+        self._spillThreshold = conn.server.inputStreamSpillThreshold
 
-        self._buf = ''
-        self._bufList = []
+        self._buf = bytearray()
         self._pos = 0  # Current read position.
-        self._avail = 0  # Number of bytes currently available.
+        self._file = None  # Spill file, if used.
+        self._fileRead = 0  # Read and write positions in it.
+        self._fileWrite = 0
 
         self._eof = False  # True when server has sent EOF notification.
 
-    def _shrinkBuffer(self):
-        """Gets rid of already read data (since we can't rewind)."""
-        if self._pos >= self._shrinkThreshold:
-            self._buf = self._buf[self._pos:]
-            self._avail -= self._pos
+    def _waitForData(self):
+        """Waits for more data to become available."""
+        self._conn.process_input()
+
+    def _available(self):
+        if self._file is None:
+            return len(self._buf) - self._pos
+        return self._fileWrite - self._fileRead
+
+    def _wait(self, n):
+        """Waits until n bytes, or the rest of the stream, may be read.
+        Returns the number of bytes available.
+        """
+        avail = self._available()
+        while avail < n and not self._eof:
+            self._waitForData()
+            avail = self._available()
+        return avail
+
+    def _take(self, n):
+        """Return the next n (available) bytes."""
+        if self._file is not None:
+            data = os.pread(self._file.fileno(), n, self._fileRead)
+            self._fileRead += len(data)
+            return data
+        pos = self._pos
+        with memoryview(self._buf) as view:
+            data = view[pos:pos+n].tobytes()
+        self._consume(n)
+        return data
+
+    def _consume(self, n):
+        self._pos += n
+        # Drop read data once it is most of a large buffer, so the cost of
+        # moving the rest is amortized.
+        if self._pos == len(self._buf):
+            del self._buf[:]
+            self._pos = 0
+        elif self._pos >= self._shrinkThreshold and \
+                self._pos * 2 >= len(self._buf):
+            del self._buf[:self._pos]
             self._pos = 0
 
     def read(self, n=-1):
-        if self._pos == self._avail and self._eof:
-            return ''
-        while True:
-            if n < 0 or (self._avail - self._pos) < n:
-                # Not enough data available.
-                if self._eof:
-                    # And there's no more coming.
-                    newPos = self._avail
-                    break
+        if n is None or n < 0:
+            n = sys.maxsize
+        return self._take(min(n, self._wait(n)))
+
+    def readinto(self, b):
+        """Read up to len(b) bytes into b. Returns the number of bytes read,
+        which is zero only at the end of the stream.
+        """
+        with memoryview(b) as dest, dest.cast("B") as dest:
+            n = min(len(dest), self._wait(1))
+            if not n:
+                return 0
+            if self._file is not None:
+                fd = self._file.fileno()
+                if _preadv is not None:
+                    n = _preadv(fd, [dest[:n]], self._fileRead)
                 else:
-                    # Wait for more data.
-                    self._conn.process_input()
-                    continue
-            else:
-                newPos = self._pos + n
-                break
-        # Merge buffer list, if necessary.
-        if self._bufList:
-            self._buf += ''.join(self._bufList)
-            self._bufList = []
-        r = self._buf[self._pos:newPos]
-        self._pos = newPos
-        self._shrinkBuffer()
-        return r
+                    data = os.pread(fd, n, self._fileRead)
+                    n = len(data)
+                    dest[:n] = data
+                self._fileRead += n
+                return n
+            pos = self._pos
+            with memoryview(self._buf) as view:
+                dest[:n] = view[pos:pos+n]
+        self._consume(n)
+        return n
 
     def readline(self, length=None):
-        if self._pos == self._avail and self._eof:
-            return ''
-        while True:
-            # Unfortunately, we need to merge the buffer list early.
-            if self._bufList:
-                self._buf += ''.join(self._bufList)
-                self._bufList = []
-            # Find newline.
-            i = self._buf.find('\n', self._pos)
-            if i < 0:
-                # Not found?
-                if self._eof:
-                    # No more data coming.
-                    newPos = self._avail
-                    break
-                else:
-                    # Wait for more to come.
-                    self._conn.process_input()
-                    continue
-            else:
-                newPos = i + 1
+        if length is None or length < 0:
+            length = sys.maxsize
+        scan = self._pos
+        while self._file is None:
+            buf = self._buf
+            limit = min(len(buf), self._pos + length)
+            # Find newline in the new data.
+            i = buf.find(b'\n', scan, limit)
+            if i >= 0:
+                return self._take(i + 1 - self._pos)
+            if limit - self._pos == length or self._eof:
+                return self._take(limit - self._pos)
+            # Wait for more to come.
+            scan = limit
+            self._waitForData()
+        return self._readlineFile(length)
+
+    def _readlineFile(self, length):
+        chunks = []
+        while length:
+            avail = self._wait(1)
+            if not avail:
                 break
-        if length is not None:
-            if self._pos + length < newPos:
-                newPos = self._pos + length
-        r = self._buf[self._pos:newPos]
-        self._pos = newPos
-        self._shrinkBuffer()
-        return r
+            data = os.pread(self._file.fileno(), min(avail, length, 8192),
+                            self._fileRead)
+            i = data.find(b'\n')
+            if i >= 0:
+                data = data[:i+1]
+            self._fileRead += len(data)
+            length -= len(data)
+            chunks.append(data)
+            if i >= 0:
+                break
+        return b''.join(chunks)
 
     def readlines(self, sizehint=0):
         total = 0
@@ -246,38 +308,104 @@ class InputStream:
     def add_data(self, data):
         if not data:
             self._eof = True
-        else:
-            self._bufList.append(data)
-            self._avail += len(data)
+            return
+        if self._file is None:
+            if len(self._buf) - self._pos + len(data) <= self._spillThreshold:
+                self._buf += data
+                return
+            self._spill()
+        self._fileAppend(data)
+
+    def _spill(self):
+        """Moves the unread data to a new temporary file, for the rest of the
+        stream."""
+        self._file = tempfile.TemporaryFile()
+        with memoryview(self._buf) as view:
+            self._fileAppend(view[self._pos:])
+        self._buf = bytearray()
+        self._pos = 0
+
+    def _fileAppend(self, data):
+        fd = self._file.fileno()
+        with memoryview(data) as view:
+            while view:
+                n = os.pwrite(fd, view, self._fileWrite)
+                self._fileWrite += n
+                view = view[n:]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._fileRead = self._fileWrite = 0
+        self._buf = bytearray()
+        self._pos = 0
+        self._eof = True
+
+
+class MultiplexedInputStream(InputStream):
+    """
+    InputStream for a MultiplexedConnection. The request reading it runs
+    in a worker thread, while the connection's thread adds the data.
+    """
+    def __init__(self, conn):
+        super().__init__(conn)
+        self._lock = threading.Condition()
+
+    def _waitForData(self):
+        # Wait for the connection to add more data.
+        self._lock.wait()
+
+    def read(self, n=-1):
+        with self._lock:
+            return super().read(n)
+
+    def readinto(self, b):
+        with self._lock:
+            return super().readinto(b)
+
+    def readline(self, length=None):
+        with self._lock:
+            return super().readline(length)
+
+    def add_data(self, data):
+        with self._lock:
+            super().add_data(data)
+            self._lock.notify()
+
+    def close(self):
+        with self._lock:
+            super().close()
 
 
 class OutputStream:
     """
-    FastCGI output stream (FCGI_STDOUT/FCGI_STDERR). By default, calls to
-    write() or writelines() immediately result in Records being sent back
-    to the server. Buffering should be done in a higher level!
+    FastCGI output stream (FCGI_STDOUT/FCGI_STDERR). By default, writes are
+    coalesced, and a Record is sent back to the server each time a full one
+    (of the server's maxwrite size) is collected. The rest is sent by
+    flush() or close(). If buffered, everything is held until flush().
     """
     def __init__(self, conn, req, type, buffered=False):
         self._conn = conn
         self._req = req
         self._type = type
         self._buffered = buffered
-        self._bufList = []  # Used if buffered is True
+        self._buf = bytearray()
+        # Largest record content, kept a multiple of 8 so needs no padding.
+        self._recordSize = min(req.server.maxwrite - FCGI_HEADER_LEN,
+                               FCGI_MAX_CONTENT_LEN) & ~7
         self.dataWritten = False
         self.closed = False
 
     def _write(self, data):
-        length = len(data)
-        while length:
-            toWrite = min(length, self._req.server.maxwrite - FCGI_HEADER_LEN)
-
-            rec = Record(self._type, self._req.requestId)
-            rec.contentLength = toWrite
-            rec.contentData = data[:toWrite]
-            self._conn.writeRecord(rec)
-
-            data = data[toWrite:]
-            length -= toWrite
+        recordSize = self._recordSize
+        with memoryview(data) as view:
+            for start in range(0, len(view), recordSize):
+                rec = Record(self._type, self._req.requestId)
+                rec.contentData = view[start:start+recordSize]
+                rec.contentLength = len(rec.contentData)
+                self._conn.writeRecord(rec)
+                rec.contentData.release()
 
     def write(self, data):
         assert not self.closed
@@ -285,12 +413,29 @@ class OutputStream:
         if not data:
             return
 
+        if isinstance(data, str):  # wsgi.errors is a text stream.
+            data = data.encode("utf-8")
+
         self.dataWritten = True
 
-        if self._buffered:
-            self._bufList.append(data)
-        else:
-            self._write(data)
+        buf = self._buf
+        recordSize = self._recordSize
+        if self._buffered or len(buf) + len(data) < recordSize:
+            buf += data
+            return
+        with memoryview(data) as view:
+            if buf:
+                # Fill up the pending record, and send it.
+                fill = recordSize - len(buf)
+                buf += view[:fill]
+                self._write(buf)
+                del buf[:]
+                view = view[fill:]
+            # Send whole records straight from data, and keep the rest.
+            whole = len(view) - len(view) % recordSize
+            if whole:
+                self._write(view[:whole])
+            buf += view[whole:]
 
     def writelines(self, lines):
         assert not self.closed
@@ -299,11 +444,9 @@ class OutputStream:
             self.write(line)
 
     def flush(self):
-        # Only need to flush if this OutputStream is actually buffered.
-        if self._buffered:
-            data = ''.join(self._bufList)
-            self._bufList = []
-            self._write(data)
+        if self._buf:
+            self._write(self._buf)
+            del self._buf[:]
 
     # Though available, the following should NOT be called by WSGI apps.
     def close(self):
@@ -361,26 +504,26 @@ def decode_pair(s, pos=0):
     """
     Decodes a name/value pair.
 
-    The number of bytes decoded as well as the name/value pair
-    are returned.
+    The number of bytes decoded as well as the name/value pair, as latin-1
+    decoded strings, are returned.
     """
-    nameLength = ord(s[pos])
+    nameLength = s[pos]
     if nameLength & 128:
         nameLength = struct.unpack('!L', s[pos:pos+4])[0] & 0x7fffffff
         pos += 4
     else:
         pos += 1
 
-    valueLength = ord(s[pos])
+    valueLength = s[pos]
     if valueLength & 128:
         valueLength = struct.unpack('!L', s[pos:pos+4])[0] & 0x7fffffff
         pos += 4
     else:
         pos += 1
 
-    name = s[pos:pos+nameLength]
+    name = s[pos:pos+nameLength].decode("latin1")
     pos += nameLength
-    value = s[pos:pos+valueLength]
+    value = s[pos:pos+valueLength].decode("latin1")
     pos += valueLength
 
     return (pos, (name, value))
@@ -390,17 +533,19 @@ def encode_pair(name, value):
     """
     Encodes a name/value pair.
 
-    The encoded string is returned.
+    The encoded bytes are returned.
     """
+    name = name.encode("latin1")
+    value = value.encode("latin1")
     nameLength = len(name)
     if nameLength < 128:
-        s = chr(nameLength)
+        s = bytes((nameLength,))
     else:
         s = struct.pack('!L', nameLength | 0x80000000)
 
     valueLength = len(value)
     if valueLength < 128:
-        s += chr(valueLength)
+        s += bytes((valueLength,))
     else:
         s += struct.pack('!L', valueLength | 0x80000000)
 
@@ -419,7 +564,7 @@ class Record:
         self.requestId = requestId
         self.contentLength = 0
         self.paddingLength = 0
-        self.contentData = ''
+        self.contentData = b''
 
     def _recvall(sock, length):
         """
@@ -445,7 +590,7 @@ class Record:
             dataLen = len(data)
             recvLen += dataLen
             length -= dataLen
-        return ''.join(dataList), recvLen
+        return b''.join(dataList), recvLen
     _recvall = staticmethod(_recvall)
 
     def read(self, sock):
@@ -477,22 +622,26 @@ class Record:
             except:
                 raise EOFError
 
-    def _sendall(sock, data):
+    def _sendall(sock, buffers):
         """
-        Writes data to a socket and does not return until all the data is sent.
+        Writes the list of buffers to a socket, gathered into as few calls as
+        possible, and does not return until all the data is sent.
         """
-        length = len(data)
-        while length:
+        while buffers:
             try:
-                sent = sock.send(data)
+                sent = sock.sendmsg(buffers)
             except OSError as e:
                 if e.errno == errno.EAGAIN:
                     select.select([], [sock], [])
                     continue
                 else:
                     raise
-            data = data[sent:]
-            length -= sent
+            # Drop what was sent, usually everything.
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                del buffers[0]
+            if sent:
+                buffers[0] = memoryview(buffers[0])[sent:]
     _sendall = staticmethod(_sendall)
 
     def write(self, sock):
@@ -502,11 +651,15 @@ class Record:
         header = struct.pack(FCGI_Header, self.version, self.type,
                              self.requestId, self.contentLength,
                              self.paddingLength)
-        self._sendall(sock, header)
+        buffers = [header]
         if self.contentLength:
-            self._sendall(sock, self.contentData)
+            buffers.append(self.contentData)
         if self.paddingLength:
-            self._sendall(sock, '\x00'*self.paddingLength)
+            buffers.append(_PADDING[self.paddingLength])
+        self._sendall(sock, buffers)
+
+
+_PADDING = [b'\x00' * n for n in range(8)]
 
 
 class Request:
@@ -527,6 +680,8 @@ class Request:
         self.stdout = OutputStream(conn, self, FCGI_STDOUT)
         self.stderr = OutputStream(conn, self, FCGI_STDERR, buffered=True)
         self.data = inputStreamClass(conn)
+        self.started = False
+        self.released = False
 
     def run(self):
         """Runs the handler, flushes the streams, and ends the request."""
@@ -557,6 +712,8 @@ class Request:
     def _flush(self):
         self.stdout.close()
         self.stderr.close()
+        self.stdin.close()
+        self.data.close()
 
 
 class Connection:
@@ -601,8 +758,8 @@ class Connection:
                 self.process_input()
             except EOFError:
                 break
-            except (select.error, OSError) as e:
-                if e[0] == errno.EBADF:  # Socket was closed by Request.
+            except OSError as e:
+                if e.errno == errno.EBADF:  # Socket was closed by Request.
                     break
                 raise
         self._cleanupSocket()
@@ -661,11 +818,7 @@ class Connection:
         the connection, the socket is closed, thereby ending this
         Connection (run() returns).
         """
-        rec = Record(FCGI_END_REQUEST, req.requestId)
-        rec.contentData = struct.pack(FCGI_EndRequestBody, appStatus,
-                                      protocolStatus)
-        rec.contentLength = FCGI_EndRequestBody_LEN
-        self.writeRecord(rec)
+        self._write_end_request(req, appStatus, protocolStatus)
 
         if remove:
             del self._requests[req.requestId]
@@ -677,6 +830,13 @@ class Connection:
             self._cleanupSocket()
             self._keepGoing = False
 
+    def _write_end_request(self, req, appStatus, protocolStatus):
+        rec = Record(FCGI_END_REQUEST, req.requestId)
+        rec.contentData = struct.pack(FCGI_EndRequestBody, appStatus,
+                                      protocolStatus)
+        rec.contentLength = FCGI_EndRequestBody_LEN
+        self.writeRecord(rec)
+
     def _do_get_values(self, inrec):
         """Handle an FCGI_GET_VALUES request from the web server."""
         outrec = Record(FCGI_GET_VALUES_RESULT)
@@ -729,7 +889,12 @@ class Connection:
                     pos, (name, value) = decode_pair(inrec.contentData, pos)
                     req.params[name] = value
             else:
-                req.run()
+                req.started = True
+                self._start_request(req)
+
+    def _start_request(self, req):
+        """Runs the request, in this process."""
+        req.run()
 
     def _do_stdin(self, inrec):
         """Handle the FCGI_STDIN stream."""
@@ -751,6 +916,117 @@ class Connection:
         self.writeRecord(outrec)
 
 
+class MultiplexedConnection(Connection):
+    """
+    A Connection that accepts many concurrent requests from the web server,
+    multiplexed over its socket. Each request runs in the server's worker
+    pool, while this Connection's thread keeps reading records and feeding
+    the requests' input streams.
+    """
+    _multiplexed = True
+    _inputStreamClass = MultiplexedInputStream
+
+    def __init__(self, sock, addr, server):
+        super().__init__(sock, addr, server)
+        # Guards the request map. No I/O is done while it is held.
+        self._lock = threading.Condition()
+        # Keeps records from different requests from intermingling.
+        self._wlock = threading.Lock()
+        # Written to by a worker to tell the reading thread to close.
+        self._wakeup = os.pipe()
+        self._keepGoing = True
+
+    def process_input(self):
+        # The reading thread owns the socket. Workers only ask it to close.
+        r, w, e = select.select([self._sock, self._wakeup[0]], [], [])
+        if self._keepGoing:
+            super().process_input()
+
+    def _stop(self):
+        """Called with the lock held, when the web server no longer needs
+        the connection.
+        """
+        if self._keepGoing:
+            self._keepGoing = False
+            os.write(self._wakeup[1], b"x")
+
+    def _cleanupSocket(self):
+        with self._lock:
+            # Input is over. Drop the requests that never started, and let
+            # the rest see end of input, then wait for them to finish.
+            for req in list(self._requests.values()):
+                req.aborted = True
+                if req.started:
+                    req.stdin.add_data(b'')
+                    req.data.add_data(b'')
+                else:
+                    del self._requests[req.requestId]
+                    self._release(req)
+            while self._requests:
+                self._lock.wait()
+        super()._cleanupSocket()
+        for fd in self._wakeup:
+            os.close(fd)
+
+    def writeRecord(self, rec):
+        with self._wlock:
+            rec.write(self._sock)
+
+    def end_request(self, req, appStatus=0,
+                    protocolStatus=FCGI_REQUEST_COMPLETE, remove=True):
+        if remove:
+            # Free the worker before the web server can send another request.
+            self._release(req)
+        self._write_end_request(req, appStatus, protocolStatus)
+        with self._lock:
+            # The web server may already have reused the request ID.
+            if remove and self._requests.get(req.requestId) is req:
+                del self._requests[req.requestId]
+            if not (req.flags & FCGI_KEEP_CONN) and not self._requests:
+                self._stop()
+            self._lock.notify_all()
+
+    def _start_request(self, req):
+        self.server._submit_request(self._run_request, req)
+
+    def _run_request(self, req):
+        try:
+            req.run()
+        except OSError:  # Web server went away.
+            with self._lock:
+                if self._requests.get(req.requestId) is req:
+                    del self._requests[req.requestId]
+                self._lock.notify_all()
+        finally:
+            self._release(req)
+
+    def _release(self, req):
+        """Give back the worker a request was admitted with, once."""
+        if not req.released:
+            req.released = True
+            self.server._release_request()
+
+    def _do_begin_request(self, inrec):
+        with self._lock:
+            admitted = self.server._admit_request()
+            if admitted:
+                super()._do_begin_request(inrec)
+        if not admitted:
+            role, flags = struct.unpack(FCGI_BeginRequestBody,
+                                        inrec.contentData)
+            req = Request(self, self._inputStreamClass)
+            req.requestId, req.role, req.flags = inrec.requestId, role, flags
+            self.end_request(req, 0, FCGI_OVERLOADED, remove=False)
+
+    def _do_abort_request(self, inrec):
+        with self._lock:
+            super()._do_abort_request(inrec)
+
+    def _do_params(self, inrec):
+        with self._lock:
+            super()._do_params(inrec)
+
+
 class ProcessManager:
     def __init__(self):
         signal.signal(signal.SIGCHLD, signal.SIG_IGN)
@@ -759,7 +1035,10 @@ class ProcessManager:
         pid = os.fork()
         if pid == 0:
             sys.excepthook = sys.__excepthook__
-            func()
+            try:
+                func()
+            finally:
+                os._exit(0)
 
 
 def DefaultErrorHandler(exc_info, stream):
@@ -779,15 +1058,24 @@ class FCGIServer:
 
     Waits for connections from the web server, processing each
     request.
+
+    By default each connection is handled in a forked child, one request
+    at a time. If multiplexed is true, each connection is handled by a
+    thread in this process instead, and may carry many concurrent requests,
+    or be kept open for more (FCGI_KEEP_CONN). The requests run in a pool
+    of maxrequests worker threads. Requests beyond that are refused with
+    FCGI_OVERLOADED.
     """
-    # Limits the size of the InputStream's string buffer to this size + the
-    # server's maximum Record size. Since the InputStream is not seekable,
-    # we throw away already-read data once this certain amount has been read.
+    # Since the InputStream is not seekable, we throw away already-read data
+    # once at least this certain amount has been read.
     inputStreamShrinkThreshold = 102400 - 8192
+    # Request bodies with more than this many bytes waiting to be read are
+    # moved to a temporary file.
+    inputStreamSpillThreshold = 1024 * 1024
 
     def __init__(self, application, errorhandler=None,
                  environ=None, maxwrite=8192, bindAddress=None, umask=None,
-                 idle=NULL, debug=False):
+                 idle=NULL, debug=False, multiplexed=False, maxrequests=20):
         """
 
         environ, if present, must be a dictionary-like object. Its
@@ -795,8 +1083,9 @@ class FCGIServer:
         for passing application-specific variables.
 
         maxwrite is the maximum number of bytes (per Record) to write
-        to the server. I've noticed mod_fastcgi has a relatively small
-        receive buffer (8K or so).
+        to the server. Small writes are coalesced up to this size. Records
+        can't be larger than 64K. I've noticed mod_fastcgi has a relatively
+        small receive buffer (8K or so), so use 8192 with it.
 
         bindAddress, if present, must either be a string or a 2-tuple. If
         present, run() will open its own listening socket. You would use
@@ -805,8 +1094,14 @@ class FCGIServer:
         your app) If a string, it will be interpreted as a filename and a UNIX
         socket will be opened. If a tuple, the first element, a string,
         is the interface name/IP to bind to, and the second element (an int)
-        is the port number.
+        is the port number. It may also be a list of these, to listen on
+        all of them.
 
+        idle, if given, is called every timeout seconds (see run()) from
+        the server loop.
+
+        multiplexed enables threaded, multiplexed connections, with at most
+        maxrequests concurrent requests in all.
         """
         signal.signal(signal.SIGCHLD, signal.SIG_IGN)
         self.application = application  # the WSGI application
@@ -818,14 +1113,23 @@ class FCGIServer:
         self._bindAddress = bindAddress
         self._umask = umask
         self._debug = debug
+        self.multiplexed = multiplexed
+        self.maxrequests = maxrequests
+        self._pool = None
+        self._slots = None
         self.capability = {
             FCGI_MAX_CONNS: MAXCONNS,
-            FCGI_MAX_REQS: MAXCONNS,
-            FCGI_MPXS_CONNS: 0
+            FCGI_MAX_REQS: maxrequests if multiplexed else MAXCONNS,
+            FCGI_MPXS_CONNS: int(multiplexed),
             }
 
-    def _setupSocket(self):
-        if self._bindAddress is None:  # Run as a normal FastCGI?
+    def _setupSockets(self):
+        if isinstance(self._bindAddress, list):
+            return [self._setupSocket(addr) for addr in self._bindAddress]
+        return [self._setupSocket(self._bindAddress)]
+
+    def _setupSocket(self, address):
+        if address is None:  # Run as a normal FastCGI?
 
             sock = socket.fromfd(FCGI_LISTENSOCK_FILENO, socket.AF_INET,
                                  socket.SOCK_STREAM)
@@ -837,36 +1141,38 @@ class FCGIServer:
         else:
             # Run as a server
             oldUmask = None
-            if isinstance(self._bindAddress, str):
+            if isinstance(address, str):
                 # Unix socket
                 sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
                 try:
-                    os.unlink(self._bindAddress)
+                    os.unlink(address)
                 except OSError:
                     pass
                 if self._umask is not None:
                     oldUmask = os.umask(self._umask)
             else:
                 # INET socket
-                assert type(self._bindAddress) is tuple
-                assert len(self._bindAddress) == 2
+                assert type(address) is tuple
+                assert len(address) == 2
                 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             close_on_exec(sock.fileno())
-            sock.bind(self._bindAddress)
+            sock.bind(address)
             sock.listen(socket.SOMAXCONN)
 
             if oldUmask is not None:
                 os.umask(oldUmask)
+        sock.setblocking(False)
         return sock
 
     def _cleanupSocket(self, sock):
-        """Closes the main socket."""
+        """Closes a listening socket."""
+        if self._bindAddress is not None and sock.family == socket.AF_UNIX:
+            try:
+                os.unlink(sock.getsockname())
+            except:
+                pass
         sock.close()
-        try:
-            os.unlink(self._bindAddress)
-        except:
-            pass
 
     def _installSignalHandlers(self):
         self._oldSIGs = [(x, signal.getsignal(x)) for x in
@@ -886,55 +1192,105 @@ class FCGIServer:
     def _intHandler(self, signum, frame):
         self._keepGoing = False
 
+    def _admit_request(self):
+        """Reserve a worker for a new multiplexed request, if one is free."""
+        return self._slots.acquire(blocking=False)
+
+    def _release_request(self):
+        self._slots.release()
+
+    def _submit_request(self, func, req):
+        self._pool.submit(func, req)
+
     def run(self, timeout=1.0):
         """
         The main loop. Exits on SIGHUP, SIGINT, SIGTERM. Returns True if
-        SIGHUP was received, False otherwise.
+        SIGHUP was received, False otherwise. The idle callback, if any, is
+        called every timeout seconds.
         """
         web_server_addrs = os.environ.get('FCGI_WEB_SERVER_ADDRS')
         if web_server_addrs is not None:
             web_server_addrs = [x.strip() for x in web_server_addrs.split(',')]
+        self._webServerAddrs = web_server_addrs
 
-        sock = self._setupSocket()
+        socks = self._setupSockets()
 
         self._keepGoing = True
         self._hupReceived = False
 
+        poller = asyncio.Poll()
+        for sock in socks:
+            poller.register_fd(sock.fileno(), asyncio.EPOLLIN,
+                               partial(self._accept, sock))
+        # Signals write to this pipe, to wake up the poller.
+        wakeup_r, wakeup_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        poller.register_fd(wakeup_r, asyncio.EPOLLIN,
+                           partial(self._wakeup, wakeup_r))
+        old_wakeup = signal.set_wakeup_fd(wakeup_w)
+        if self._idle_cb is not NULL:
+            poller.add_timer(self._idle_cb, timeout, timeout)
+
         # Install signal handlers.
         self._installSignalHandlers()
 
+        if self.multiplexed:
+            self._slots = threading.BoundedSemaphore(self.maxrequests)
+            self._pool = ThreadPoolExecutor(self.maxrequests)
+
+        try:
+            while self._keepGoing:
+                poller.poll()
+        finally:
+            # Restore signal handlers.
+            self._restoreSignalHandlers()
+            signal.set_wakeup_fd(old_wakeup)
+            poller.unregister_all()
+            poller.close()
+            os.close(wakeup_r)
+            os.close(wakeup_w)
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+            for sock in socks:
+                self._cleanupSocket(sock)
+        return self._hupReceived
+
+    def _wakeup(self, fd):
+        try:
+            while os.read(fd, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _accept(self, sock):
+        """Accept all pending connections on a listening socket."""
+        web_server_addrs = self._webServerAddrs
         while self._keepGoing:
             try:
-                r, w, e = select.select([sock], [], [], timeout)
-            except select.error as e:
-                if e[0] == errno.EINTR:
+                clientSock, addr = sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if e.errno == errno.ECONNABORTED:
                     continue
                 raise
 
-            if r:
-                try:
-                    clientSock, addr = sock.accept()
-                except OSError as e:
-                    if e.errno in (errno.EINTR, errno.EAGAIN):
-                        continue
-                    raise
-
-                if (web_server_addrs and
-                        (len(addr) != 2 or addr[0] not in web_server_addrs)):
-                    clientSock.close()
-                    continue
-
-                conn = Connection(clientSock, addr, self)
-                if self._debug:
-                    conn.run()  # bypass process manager
-                else:
-                    self._procmanager(conn.run)
-
-            self._idle_cb()
-        # Restore signal handlers.
-        self._restoreSignalHandlers()
-        self._cleanupSocket(sock)
-        return self._hupReceived
+            if (web_server_addrs and
+                    (len(addr) != 2 or addr[0] not in web_server_addrs)):
+                clientSock.close()
+                continue
+
+            clientSock.setblocking(True)
+            if self.multiplexed:
+                conn = MultiplexedConnection(clientSock, addr, self)
+                threading.Thread(target=conn.run, daemon=True).start()
+                continue
+            conn = Connection(clientSock, addr, self)
+            if self._debug:
+                conn.run()  # bypass process manager
+            else:
+                self._procmanager(conn.run)
+                clientSock.close()
 
     def _exit(self, reload=False):
         """
@@ -959,9 +1315,9 @@ class FCGIServer:
         else:
             stderr = TeeOutputStream((sys.stderr, req.stderr))
         environ['wsgi.errors'] = stderr
-        environ['wsgi.multithread'] = False
-        environ['wsgi.run_once'] = True
-        environ['wsgi.multiprocess'] = not self._debug
+        environ['wsgi.multithread'] = self.multiplexed
+        environ['wsgi.run_once'] = not self.multiplexed
+        environ['wsgi.multiprocess'] = not (self._debug or self.multiplexed)
 
         if environ.get('HTTPS', 'off') in ('on', '1'):
             environ['wsgi.url_scheme'] = 'https'
@@ -974,17 +1330,18 @@ class FCGIServer:
         headers_sent = []
 
         def write(data):
-            assert type(data) is str, 'write() argument must be string'
+            assert type(data) is bytes, 'write() argument must be bytes'
             assert headers_set, 'write() before start_response()'
 
             if not headers_sent:
                 status, responseHeaders = headers_sent[:] = headers_set
-                req.stdout.write('Status: %s\r\n' % status)
+                req.stdout.write(('Status: %s\r\n' % status).encode("latin1"))
                 for header in responseHeaders:
-                    req.stdout.write('%s: %s\r\n' % header)
-                req.stdout.write('\r\n')
-                req.stdout.flush()
+                    req.stdout.write(('%s: %s\r\n' % header).encode("latin1"))
+                req.stdout.write(b'\r\n')
             req.stdout.write(data)
+            # Coalesced with the headers, but not held for later blocks.
+            req.stdout.flush()
 
         def start_response(status, response_headers, exc_info=None):
             if exc_info:
@@ -1016,7 +1373,7 @@ class FCGIServer:
                     if data:
                         write(data)
                 if not headers_sent:
-                    write('')  # in case body was empty
+                    write(b'')  # in case body was empty
             finally:
                 if hasattr(iterable, 'close'):
                     iterable.close()
@@ -0,0 +1,353 @@
+#!/usr/bin/python3.4
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Incremental HTTP/1.1 message parser.
+
+Bytes are pushed in with feed(), in chunks of any size, as they arrive from
+a socket. The parser calls event methods, which a subclass overrides, as it
+recognizes the parts of each message:
+
+    on_request(method, target, version)   -- a request line.
+    on_response(version, status, reason)  -- a status line.
+    on_headers(headers)                   -- the header block, as Headers.
+    on_body(data)                         -- a piece of the body.
+    on_trailers(headers)                  -- trailers of a chunked body.
+    on_message_complete()                 -- the end of a message.
+
+Chunked transfer-coding is decoded, and pipelined messages are parsed one
+after the other. Only start lines, header blocks and chunk size lines are
+ever buffered, and they are limited to maxbuffer bytes. Body data is passed
+on as it arrives, so no message is held whole in memory.
+"""
+
+from pycopia.inet import httputils
+
+REQUEST = 0
+RESPONSE = 1
+
+# Parser states
+_START = 0        # Looking for a start line and header block.
+_BODY = 1         # In a body of known length.
+_EOF_BODY = 2     # In a body that ends with the connection.
+_CHUNK_SIZE = 3   # Looking for a chunk size line.
+_CHUNK_DATA = 4   # In chunk data.
+_CHUNK_END = 5    # Looking for the CRLF after chunk data.
+_TRAILERS = 6     # Looking for the trailer block.
+
+_TOKENCHARS = frozenset(b"!#$%&'*+-.^_`|~0123456789"
+                        b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
+_HEXDIGITS = frozenset(b"0123456789abcdefABCDEF")
+
+
+class HTTPParseError(Exception):
+    """Raised for a malformed message. The status attribute is the HTTP
+    status a server should answer with.
+    """
+    def __init__(self, message, status=400):
+        super(HTTPParseError, self).__init__(message)
+        self.status = status
+
+
+class HTTPParser:
+    """Push parser for HTTP/1.1 requests (kind REQUEST) or responses (kind
+    RESPONSE).
+
+    Subclass and override the on_* methods. An on_headers() that returns
+    True marks the message as having no body, as for a response to HEAD.
+    After on_headers() the version, keep_alive and chunked attributes
+    describe the message.
+
+    An event method may call pause(). Parsing stops after that event and
+    the rest of the data is kept until resume() is called. A server uses
+    this to handle pipelined requests one at a time.
+    """
+
+    def __init__(self, kind=REQUEST, maxbuffer=65536):
+        self.kind = kind
+        self.maxbuffer = maxbuffer
+        self._buf = b""
+        self._scan = 0
+        self._state = _START
+        self._remaining = 0
+        self._paused = False
+        self.version = None
+        self.keep_alive = True
+        self.chunked = False
+
+    # Event methods, for subclasses to override.
+
+    def on_request(self, method, target, version):
+        pass
+
+    def on_response(self, version, status, reason):
+        pass
+
+    def on_headers(self, headers):
+        pass
+
+    def on_body(self, data):
+        pass
+
+    def on_trailers(self, headers):
+        pass
+
+    def on_message_complete(self):
+        pass
+
+    # Public interface
+
+    @property
+    def in_message(self):
+        """True when part of a message has been parsed, or is buffered."""
+        return self._state != _START or bool(self._buf)
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        """Continue parsing data kept back by pause()."""
+        self._paused = False
+        if self._buf:
+            data, self._buf = self._buf, b""
+            self._process(data)
+
+    def feed(self, data):
+        """Parse more bytes of the stream."""
+        if self._buf:
+            data = self._buf + data
+            self._buf = b""
+        elif type(data) is not bytes:
+            data = bytes(data)
+        if self._paused:
+            self._buf = data
+        else:
+            self._process(data)
+
+    def feed_eof(self):
+        """Tell the parser the stream has ended. A body read until the
+        connection closes is complete then. Raises HTTPParseError if the
+        stream stopped inside a message.
+        """
+        if self._state == _EOF_BODY:
+            self._message_complete()
+        elif self._state != _START or self._buf.strip(b"\r\n"):
+            raise HTTPParseError("Incomplete message.")
+
+    # Parsing
+
+    def _process(self, data):
+        pos = 0
+        end = len(data)
+        while pos < end:
+            if self._paused:
+                self._buf = data[pos:]
+                return
+            state = self._state
+            if state == _BODY or state == _CHUNK_DATA:
+                n = min(self._remaining, end - pos)
+                if pos == 0 and n == end:
+                    self.on_body(data)
+                else:
+                    self.on_body(data[pos:pos+n])
+                pos += n
+                self._remaining -= n
+                if not self._remaining:
+                    if state == _CHUNK_DATA:
+                        self._state = _CHUNK_END
+                    else:
+                        self._message_complete()
+            elif state == _EOF_BODY:
+                self.on_body(data[pos:] if pos else data)
+                pos = end
+            elif state == _START:
+                # Ignore empty lines ahead of a message (RFC 7230, 3.5).
+                while data.startswith(b"\r\n", pos):
+                    pos += 2
+                if pos >= end or (data[pos] == 13 and pos + 1 == end):
+                    break
+                i = self._find_blank(data, pos, end)
+                if i < 0:
+                    break
+                self._headers_complete(data[pos:i])
+                pos = i + 4
+            elif state == _TRAILERS:
+                if data.startswith(b"\r\n", pos):
+                    pos += 2
+                    self._message_complete()
+                    continue
+                i = self._find_blank(data, pos, end)
+                if i < 0:
+                    break
+                self.on_trailers(self._parse_headers(data[pos:i].split(b"\r\n")))
+                pos = i + 4
+                self._message_complete()
+            else: # _CHUNK_SIZE or _CHUNK_END
+                i = data.find(b"\r\n", pos)
+                if i < 0:
+                    if end - pos > self.maxbuffer:
+                        raise HTTPParseError("Chunk size line too long.")
+                    break
+                line = data[pos:i]
+                pos = i + 2
+                if state == _CHUNK_END:
+                    if line:
+                        raise HTTPParseError("Bad chunk terminator.")
+                    self._state = _CHUNK_SIZE
+                else:
+                    self._chunk_size(line)
+        if pos < end:
+            self._buf = data[pos:]
+
+    def _find_blank(self, data, pos, end):
+        """Find the blank line ending a block that starts at pos, resuming
+        the search where the last one left off.
+        """
+        i = data.find(b"\r\n\r\n", max(pos, pos + self._scan - 3))
+        if i < 0:
+            if end - pos > self.maxbuffer:
+                raise HTTPParseError("Header block too large.", 431)
+            self._scan = end - pos
+        else:
+            self._scan = 0
+        return i
+
+    def _headers_complete(self, block):
+        lines = block.split(b"\r\n")
+        if self.kind == REQUEST:
+            method, target, version = self._request_line(lines[0])
+        else:
+            version, status, reason = self._status_line(lines[0])
+        headers = self._parse_headers(lines[1:])
+        if self.kind == REQUEST:
+            hasbody = self._framing(headers)
+            self.on_request(method, target, version)
+        else:
+            hasbody = self._framing(headers,
+                    status >= 200 and status != 204 and status != 304)
+            self.on_response(version, status, reason)
+        if self.on_headers(headers) or not hasbody:
+            self._message_complete()
+
+    def _request_line(self, line):
+        parts = line.split(b" ")
+        if len(parts) != 3:
+            raise HTTPParseError("Bad request line: %r" % (line,))
+        method, target, version = parts
+        if not method or not _TOKENCHARS.issuperset(method):
+            raise HTTPParseError("Bad method: %r" % (method,))
+        if not target:
+            raise HTTPParseError("Empty request target.")
+        return (method.decode("ascii"), target.decode("latin1"),
+                self._version(version))
+
+    def _status_line(self, line):
+        version, _, rest = line.partition(b" ")
+        status, _, reason = rest.partition(b" ")
+        if len(status) != 3 or not status.isdigit():
+            raise HTTPParseError("Bad status line: %r" % (line,))
+        return self._version(version), int(status), reason.decode("latin1")
+
+    def _version(self, version):
+        if (len(version) != 8 or not version.startswith(b"HTTP/") or
+                version[6] != 46 or not version[5:6].isdigit() or
+                not version[7:8].isdigit()):
+            raise HTTPParseError("Bad HTTP version: %r" % (version,))
+        self.version = (version[5] - 48, version[7] - 48)
+        if self.version[0] != 1:
+            raise HTTPParseError("Unsupported HTTP version.", 505)
+        return version.decode("ascii")
+
+    def _parse_headers(self, lines):
+        headers = httputils.Headers()
+        last = None
+        for line in lines:
+            if line[:1] in (b" ", b"\t"):
+                # Obsolete line folding, replaced by a space.
+                if last is None:
+                    raise HTTPParseError("Continuation line with no header.")
+                last += b" " + line.strip()
+                continue
+            if last is not None:
+                headers.append(self._header(last))
+            last = line
+        if last is not None:
+            headers.append(self._header(last))
+        return headers
+
+    def _header(self, line):
+        name, sep, value = line.partition(b":")
+        if not sep or not name or not _TOKENCHARS.issuperset(name):
+            raise HTTPParseError("Bad header line: %r" % (line,))
+        return httputils.get_header(line.rstrip(b" \t"))
+
+    def _framing(self, headers, mayhavebody=True):
+        """Set up for reading the body, as the headers describe it (RFC
+        7230, 3.3.3). Return True if the message has a body.
+        """
+        self.chunked = False
+        self._remaining = 0
+        conn = headers.get("Connection")
+        conn = str(conn.value).lower() if conn is not None else ""
+        if self.version >= (1, 1):
+            self.keep_alive = "close" not in conn
+        else:
+            self.keep_alive = "keep-alive" in conn
+        if not mayhavebody:
+            return False
+        te = headers.getall("Transfer-Encoding")
+        if te:
+            codings = ",".join(str(h.value) for h in te).lower().split(",")
+            codings = [c.strip() for c in codings if c.strip()]
+            if codings and codings[-1] == "chunked":
+                self.chunked = True
+                self._state = _CHUNK_SIZE
+            elif self.kind == REQUEST:
+                raise HTTPParseError("Unsupported transfer coding.", 501)
+            else:
+                self._state = _EOF_BODY
+                self.keep_alive = False
+            return True
+        cl = headers.getall("Content-Length")
+        if cl:
+            values = set(str(h.value).strip() for h in cl)
+            value = values.pop()
+            if values or not value.isdigit():
+                raise HTTPParseError("Bad Content-Length.")
+            self._remaining = int(value)
+            self._state = _BODY
+            return self._remaining > 0
+        if self.kind == RESPONSE:
+            # Read until the connection closes.
+            self._state = _EOF_BODY
+            self.keep_alive = False
+            return True
+        return False
+
+    def _chunk_size(self, line):
+        size = line.split(b";", 1)[0].strip()
+        if not size or len(size) > 16 or not _HEXDIGITS.issuperset(size):
+            raise HTTPParseError("Bad chunk size: %r" % (line,))
+        size = int(size, 16)
+        if size:
+            self._remaining = size
+            self._state = _CHUNK_DATA
+        else:
+            self._state = _TRAILERS
+
+    def _message_complete(self):
+        self._state = _START
+        self._remaining = 0
+        self.on_message_complete()
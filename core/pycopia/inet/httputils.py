@@ -17,9 +17,14 @@
 Helpers and utilities for HTTP. Contains a set of classes for constructing and
 verifying HTTP headers according to the syntax rules. See RFC 2616.
 """
+import sys
+import os
 import re
+import stat
 import base64
+import heapq
 import calendar
+from bisect import bisect_left
 from functools import total_ordering
 
 from pycopia import ascii
@@ -259,19 +264,41 @@ class Media(list):
 ### base class for all header objects
 
 class HTTPHeader(object):
-    """HTTPHeader. Abstract base class for all HTTP headers. """
+    """HTTPHeader. Abstract base class for all HTTP headers.
+
+    A value given as text (str, or bytes as received) is only parsed when
+    the value is first used.
+    """
     HEADER = None
+    _raw = None
     def __init__(self, _value=None, **kwargs):
         self.initialize(**kwargs)
         self._name = self.HEADER
         if _value:
-            if isinstance(_value, str):
-                self.value = self.parse_value(_value)
+            if isinstance(_value, (str, bytes)):
+                self._raw = _value
             else:
                 self.value = _value # some object
         else:
             self.value = ""
 
+    def _parse_raw(self):
+        raw, self._raw = self._raw, None
+        if isinstance(raw, bytes):
+            raw = raw.decode("latin1")
+        self.value = self.parse_value(raw)
+
+    def _get_value(self):
+        if self._raw is not None:
+            self._parse_raw()
+        return self._value
+
+    def _set_value(self, value):
+        self._raw = None
+        self._value = value
+
+    value = property(_get_value, _set_value)
+
     def initialize(self, **kwargs):
         """Override this to set the value attribute based on the keyword
         arguments."""
@@ -286,6 +313,15 @@ class HTTPHeader(object):
     def value_string(self):
         return str(self.value)
 
+    def raw_value(self):
+        """The value as text, as it was received if not yet parsed."""
+        raw = self._raw
+        if raw is None:
+            return self.value_string()
+        if isinstance(raw, bytes):
+            raw = raw.decode("latin1")
+        return raw.strip()
+
     def asWSGI(self):
         return self._name, str(self.value).encode("ascii")
 
@@ -345,6 +381,17 @@ class HTTPHeaderWithParameters(HTTPHeader):
     def initialize(self, **kwargs):
         self.parameters = kwargs
 
+    # Parameters are also parsed from the raw value.
+    def _get_parameters(self):
+        if self._raw is not None:
+            self._parse_raw()
+        return self._parameters
+
+    def _set_parameters(self, parameters):
+        self._parameters = parameters
+
+    parameters = property(_get_parameters, _set_parameters)
+
     def asWSGI(self):
         return self._name, self._val_string().encode("ascii")
 
@@ -373,15 +420,15 @@ class HTTPHeaderWithParameters(HTTPHeader):
 ### General headers
 
 class CacheControl(HTTPHeaderWithParameters):
-    HEADER = b"Cache-Control"
+    HEADER = "Cache-Control"
 
 
 class Connection(HTTPHeader):
-    HEADER = b"Connection"
+    HEADER = "Connection"
 
 
 class Date(HTTPHeader):
-    HEADER = b"Date"
+    HEADER = "Date"
 
     def parse_value(self, value):
         return HTTPDate(value)
@@ -392,23 +439,26 @@ class Date(HTTPHeader):
 
 
 class Pragma(HTTPHeader):
-    HEADER = b"Pragma"
+    HEADER = "Pragma"
 
 
 class Trailer(HTTPHeader):
-    HEADER = b"Trailer"
+    HEADER = "Trailer"
 
 class TransferEncoding(HTTPHeaderWithParameters):
-    HEADER = b"Transer-Encoding"
+    HEADER = "Transfer-Encoding"
 
     def initialize(self, **kwargs):
         self.parameters = kwargs
         self._tencodings = []
 
     def _get_value(self):
+        if self._raw is not None:
+            self._parse_raw()
         return ", ".join(self._tencodings)
 
     def _set_value(self, value):
+        self._raw = None
         self._tencodings = [t for t in [t.strip() for t in value.split(",")] if t]
 
     value = property(_get_value, _set_value)
@@ -430,71 +480,71 @@ class TransferEncoding(HTTPHeaderWithParameters):
 
 
 class Upgrade(HTTPHeader):
-    HEADER = b"Upgrade"
+    HEADER = "Upgrade"
 
 
 class Via(HTTPHeader):
-    HEADER = b"Via"
+    HEADER = "Via"
 
 
 class Warning(HTTPHeader):
-    HEADER = b"Warning"
+    HEADER = "Warning"
 
 
 ### Entity headers
 
 class Allow(HTTPHeader):
-    HEADER = b"Allow"
+    HEADER = "Allow"
 
 
 class ContentEncoding(HTTPHeader):
-    HEADER = b"Content-Encoding"
+    HEADER = "Content-Encoding"
 
 
 class ContentLanguage(HTTPHeader):
-    HEADER = b"Content-Language"
+    HEADER = "Content-Language"
 
 
 class ContentLength(HTTPHeader):
-    HEADER = b"Content-Length"
+    HEADER = "Content-Length"
 
 
 class ContentLocation(HTTPHeader):
-    HEADER = b"Content-Location"
+    HEADER = "Content-Location"
 
 
 class ContentMD5(HTTPHeader):
-    HEADER = b"Content-MD5"
+    HEADER = "Content-MD5"
 
 
 class ContentRange(HTTPHeader):
-    HEADER = b"Content-Range"
+    HEADER = "Content-Range"
 
 
 class ContentDisposition(HTTPHeaderWithParameters):
-    HEADER = b"Content-Disposition"
+    HEADER = "Content-Disposition"
 
 
 class ContentType(HTTPHeaderWithParameters):
-    HEADER = b"Content-Type"
+    HEADER = "Content-Type"
 
 
 class ETag(HTTPHeader):
-    HEADER = b"ETag"
+    HEADER = "ETag"
 
 
 class Expires(HTTPHeader):
-    HEADER = b"Expires"
+    HEADER = "Expires"
 
 
 class LastModified(HTTPHeader):
-    HEADER = b"Last-Modified"
+    HEADER = "Last-Modified"
 
 
 ### Request headers
 
 class Accept(HTTPHeader):
-    HEADER = b"Accept"
+    HEADER = "Accept"
     def initialize(self, media=None):
         if media:
             v = [o for o in media if isinstance(o, MediaRange)]
@@ -537,71 +587,120 @@ class Accept(HTTPHeader):
 
 
 class AcceptCharset(HTTPHeader):
-    HEADER = b"Accept-Charset"
+    HEADER = "Accept-Charset"
 
 
 class AcceptEncoding(HTTPHeader):
-    HEADER = b"Accept-Encoding"
+    HEADER = "Accept-Encoding"
+
+    def parse_value(self, data):
+        """List of (coding, q) tuples, in the order given."""
+        rv = []
+        for part in data.split(","):
+            coding, _, params = part.partition(";")
+            coding = coding.strip().lower()
+            if not coding:
+                continue
+            q = 1.0
+            for param in params.split(";"):
+                name, _, val = param.partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        q = float(val)
+                    except ValueError:
+                        q = 0.0
+            rv.append((coding, q))
+        return rv
+
+    def __str__(self):
+        return "%s: %s" % (self._name, self.value_string())
+
+    def value_string(self):
+        return ", ".join([c if q == 1.0 else "%s;q=%s" % (c, q)
+                          for c, q in self.value])
+
+    def quality(self, coding):
+        """The q value the client gives a content coding (RFC 7231, 5.3.4)."""
+        star = None
+        for name, q in self.value:
+            if name == coding:
+                return q
+            if name == "*":
+                star = q
+        if star is not None:
+            return star
+        return 1.0 if coding == "identity" else 0.0
+
+    def select(self, supported):
+        """Select the most acceptable of the supported codings, the first
+        one of equal quality. Returns None if none is acceptable.
+        """
+        best, bestq = None, 0.0
+        for coding in supported:
+            q = self.quality(coding)
+            if q > bestq:
+                best, bestq = coding, q
+        return best
 
 
 class AcceptLanguage(HTTPHeader):
-    HEADER = b"Accept-Language"
+    HEADER = "Accept-Language"
 
 
 class Expect(HTTPHeaderWithParameters):
-    HEADER = b"Expect"
+    HEADER = "Expect"
 
 
 class From(HTTPHeader):
-    HEADER = b"From"
+    HEADER = "From"
 
 
 class Host(HTTPHeader):
-    HEADER = b"Host"
+    HEADER = "Host"
 
 
 class IfModifiedSince(HTTPHeader):
-    HEADER = b"If-Modified-Since"
+    HEADER = "If-Modified-Since"
 
 
 class IfMatch(HTTPHeader):
-    HEADER = b"If-Match"
+    HEADER = "If-Match"
 
 
 class IfNoneMatch(HTTPHeader):
-    HEADER = b"If-None-Match"
+    HEADER = "If-None-Match"
 
 
 class IfRange(HTTPHeader):
-    HEADER = b"If-Range"
+    HEADER = "If-Range"
 
 
 class IfUnmodifiedSince(HTTPHeader):
-    HEADER = b"If-Unmodified-Since"
+    HEADER = "If-Unmodified-Since"
 
 
 class MaxForwards(HTTPHeader):
-    HEADER = b"Max-Forwards"
+    HEADER = "Max-Forwards"
 
 
 class ProxyAuthorization(HTTPHeader):
-    HEADER = b"Proxy-Authorization"
+    HEADER = "Proxy-Authorization"
 
 
 class Range(HTTPHeader):
-    HEADER = b"Range"
+    HEADER = "Range"
 
 
 class Referer(HTTPHeader):
-    HEADER = b"Referer"
+    HEADER = "Referer"
 
 
 class TE(HTTPHeader):
-    HEADER = b"TE"
+    HEADER = "TE"
 
 
 class Authorization(HTTPHeader):
-    HEADER = b"Authorization"
+    HEADER = "Authorization"
     def __str__(self):
         val = self.encode()
         return "%s: %s" % (self._name, val)
@@ -645,7 +744,7 @@ class UserAgent(HTTPHeader):
     """see: <http://www.mozilla.org/build/revised-user-agent-strings.html>
     default value: "Mozilla/5.0 (X11; U; Linux i686; en-US)"
     """
-    HEADER = b"User-Agent"
+    HEADER = "User-Agent"
     def initialize(self, product=None, comment=None):
         self.data = []
         if product:
@@ -667,47 +766,47 @@ class UserAgent(HTTPHeader):
 
 ### Response headers
 class AcceptRanges(HTTPHeader):
-    HEADER = b"Accept-Ranges"
+    HEADER = "Accept-Ranges"
 
 class Age(HTTPHeader):
-    HEADER = b"Age"
+    HEADER = "Age"
 
 
 class ETag(HTTPHeader):
-    HEADER = b"ETag"
+    HEADER = "ETag"
 
 
 class Location(HTTPHeader):
-    HEADER = b"Location"
+    HEADER = "Location"
 
 
 class ProxyAuthenticate(HTTPHeader):
-    HEADER = b"Proxy-Authenticate"
+    HEADER = "Proxy-Authenticate"
 
 
 class Public(HTTPHeader):
-    HEADER = b"Public"
+    HEADER = "Public"
 
 
 class RetryAfter(HTTPHeader):
-    HEADER = b"Retry-After"
+    HEADER = "Retry-After"
 
 
 class Server(HTTPHeader):
-    HEADER = b"Server"
+    HEADER = "Server"
 
 
 class Vary(HTTPHeader):
-    HEADER = b"Vary"
+    HEADER = "Vary"
 
 
 class WWWAuthenticate(HTTPHeader):
-    HEADER = b"WWW-Authenticate"
+    HEADER = "WWW-Authenticate"
 
 # cookies!  Slightly different impementation from the stock Cookie module.
 
 class SetCookie(HTTPHeaderWithParameters):
-    HEADER = b"Set-Cookie"
+    HEADER = "Set-Cookie"
 
     def parse_value(self, text):
         return parse_setcookie(text)
@@ -720,7 +819,7 @@ class SetCookie(HTTPHeaderWithParameters):
 
 
 class SetCookie2(HTTPHeaderWithParameters):
-    HEADER = b"Set-Cookie2"
+    HEADER = "Set-Cookie2"
 
     def parse_value(self, text):
         return parse_setcookie(text)
@@ -734,7 +833,7 @@ class SetCookie2(HTTPHeaderWithParameters):
 
 class Cookie(HTTPHeader):
     """A Cookie class. This actually holds a collection of RawCookies."""
-    HEADER = b"Cookie"
+    HEADER = "Cookie"
 
     def __str__(self):
         return "%s: %s" % (self._name, self.value_string())
@@ -749,17 +848,36 @@ class Cookie(HTTPHeader):
 ## cookie handling
 
 class CookieJar(object):
-    """A collection of cookies. May be used in a client or server context."""
+    """A collection of cookies. May be used in a client or server context.
+
+    Cookies are indexed by reversed domain ("com.example.www") and path, so
+    the cookies for a request are found with a few lookups, one for each
+    domain suffix and path prefix of the URL. Expiry times are kept in a
+    heap, and expired cookies dropped as requests are made.
+
+    Cookies may be saved, with save(), in a compact format grouped by
+    domain. Reading such a file only scans the domain groups. The cookies
+    of a domain are parsed when a request is first made to it.
+    """
     def __init__(self, filename=None, defaultdomain=None):
         self._defaultdomain = defaultdomain
-        self._cookies = {}
+        self._cookies = {}  # (name, path, domain) -> RawCookie
+        self._index = {}    # domain key -> {path -> {(name, domain) -> RawCookie}}
+        self._pending = {}  # domain key -> (data, start, end) of a saved group
+        self._expiry = []   # heap of (expires, seq, cookie key, RawCookie)
+        self._seq = 0
+        self._deleted = []
         if filename:
             self.from_file(filename)
-        self._deleted = []
 
     def from_file(self, filename):
-        text = open(filename).read()
-        for line in text.splitlines():
+        """Read a file saved with save(), or a Netscape cookie file."""
+        with open(filename, "rb") as fo:
+            data = fo.read()
+        if data.startswith(_JARMAGIC):
+            self._read_groups(data)
+            return
+        for line in data.decode("utf-8", "surrogateescape").splitlines():
             line = line.strip()
             if not line:
                 continue
@@ -767,43 +885,68 @@ class CookieJar(object):
                 continue
             self.parse_mozilla_line(line)
 
+    def save(self, filename):
+        """Write the cookies to filename in the compact format, grouped by
+        domain. Groups that were never loaded are copied as they are.
+        """
+        groups = {}
+        for key, bypath in self._index.items():
+            lines = []
+            for cookies in bypath.values():
+                for cookie in cookies.values():
+                    lines.append(_jar_line(cookie))
+            if lines:
+                groups[key] = "".join(lines).encode("utf-8", "surrogateescape")
+        for key, (data, start, end) in self._pending.items():
+            groups[key] = data[start:end]
+        with open(filename, "wb") as fo:
+            fo.write(_JARMAGIC)
+            for key in sorted(groups):
+                body = groups[key]
+                fo.write(("@%s\t%d\n" % (key, len(body))).encode("utf-8"))
+                fo.write(body)
+
     def add_cookie(self, name, value, comment=None, domain=None,
             max_age=None, path=None, secure=0, version=1, expires=None, httponly=False):
         if value:
             new = RawCookie(name, value, comment=comment, domain=domain,
                   max_age=max_age, path=path, secure=secure, version=version,
                   expires=expires, httponly=httponly)
-            self._cookies[(new.name, new.path, new.domain)] = new
+            self._store(new)
         else:
             self.delete_cookie(name, path, domain)
 
     def delete_cookie(self, name, path='/', domain=None):
-        dom = domain or self._defaultdomain
-        try:
-            c = self._cookies[(name, path, dom)]
-        except KeyError:
-            pass
-        else:
-            del self._cookies[(name, path, dom)]
+        dom = domain or self._defaultdomain or "local"
+        key = _domain_key(dom)[0]
+        if key in self._pending:
+            self._load_group(key)
+        c = self._remove((name, path or "/", dom))
+        if c is not None:
             c.max_age = 0
             self._deleted.append(c)
 
     def parse_SetCookie(self, text, url=None):
         c = get_header(text).value
         if url:
-            c.domain = url.host[url.host.find("."):]
+            dot = url.host.find(".")
+            c.domain = url.host[dot:] if dot >= 0 else "local"
             if not c.path:
                 c.path = url.path
-        self._cookies[(c.name, c.path, c.domain)] = c
+        if c.max_age is not None and c.expires is None:
+            c.expires = timelib.time() + c.max_age
+        self._store(c)
 
     def parse_mozilla_line(self, line):
         domain, domain_specified, path, secure, expires, name, value = line.split("\t")
         domain_specified = (domain_specified == "TRUE")
+        if domain_specified and not domain.startswith("."):
+            domain = "." + domain
         secure = (secure == "TRUE")
         value = value.rstrip()
         new = RawCookie(name, value, domain=domain, expires=expires,
                         path=path, secure=secure)
-        self._cookies[(new.name, new.path, new.domain)] = new
+        self._store(new)
 
     # libcurl can give us one of these lists.
     def parse_mozilla_lines(self, l):
@@ -812,7 +955,7 @@ class CookieJar(object):
 
     def __str__(self):
         s = []
-        for cookie in list(self._cookies.values()):
+        for cookie in self.cookies:
             s.append(cookie.as_mozilla_line())
         return "\n".join(s)
 
@@ -824,6 +967,9 @@ class CookieJar(object):
 
     def clear(self):
         self._cookies.clear()
+        self._index.clear()
+        self._pending.clear()
+        self._expiry = []
 
     def get_cookie(self, url):
         cl = self._extract_cookies(url)
@@ -835,7 +981,7 @@ class CookieJar(object):
     def get_setcookies(self, headers=None):
         if headers is None:
             headers = Headers()
-        for c in list(self._cookies.values()):
+        for c in self.cookies:
             headers.append(SetCookie(c))
         while self._deleted:
             c = self._deleted.pop()
@@ -848,25 +994,185 @@ class CookieJar(object):
         return [o.as_mozilla_line() for o in cl]
 
     def __iter__(self):
-        return iter(list(self._cookies.values()))
+        return iter(self.cookies)
+
+    def __len__(self):
+        self._load_all()
+        return len(self._cookies)
 
     def _extract_cookies(self, url):
+        self.purge()
+        host = (url.host or "").lower()
+        if "." not in host: # RFC 2965 effective host name
+            host += ".local"
+        prefixes = _path_prefixes(url.path or "/")
+        secure = url.scheme.endswith("s")
+        labels = host.split(".")
+        labels.reverse()
+        last = len(labels) - 1
         rv = []
-        desthost = url.host
-        path = url.path
-        for c in list(self._cookies.values()):
-            if desthost.rfind(c.domain) >= 0: # tail match
-                if path.find(c.path) >= 0: # path match
-                    if c.secure: # secure cookie on secure channel
-                        if url.scheme.endswith("s"):
-                            rv.append(c)
-                    else:
-                        rv.append(c)
+        key = None
+        for i, label in enumerate(labels):
+            key = label if key is None else key + "." + label
+            if key in self._pending:
+                self._load_group(key)
+            bypath = self._index.get(key)
+            if bypath is None:
+                continue
+            for path in prefixes:
+                cookies = bypath.get(path)
+                if not cookies:
+                    continue
+                for (name, domain), c in cookies.items():
+                    if c.secure and not secure: # secure cookie on secure channel
+                        continue
+                    if i < last and _domain_key(domain)[1]: # host only
+                        continue
+                    rv.append(c)
         # most specific first,
-        rv.sort()
+        rv.sort(key=lambda c: len(c.path or "/"), reverse=True)
         return rv
 
-    cookies = property(lambda s: list(s._cookies.values()))
+    def purge(self, now=None):
+        """Drop the cookies that have expired."""
+        if now is None:
+            now = timelib.time()
+        heap = self._expiry
+        while heap and heap[0][0] <= now:
+            expires, seq, key, cookie = heapq.heappop(heap)
+            if self._cookies.get(key) is cookie:
+                self._remove(key)
+
+    def _store(self, cookie):
+        domain = cookie.domain
+        dkey = _domain_key(domain)[0]
+        if dkey in self._pending: # Saved cookies are replaced, not kept.
+            self._load_group(dkey)
+        path = cookie.path or "/"
+        key = (cookie.name, path, domain)
+        self._remove(key)
+        self._cookies[key] = cookie
+        self._index.setdefault(dkey, {}).setdefault(
+                path, {})[(cookie.name, domain)] = cookie
+        if cookie.expires:
+            self._seq += 1
+            heapq.heappush(self._expiry, (cookie.expires, self._seq, key, cookie))
+            # Replaced and deleted cookies stay in the heap until they come
+            # to the top. Rebuild it if they take up most of it.
+            if len(self._expiry) > 2 * len(self._cookies) + 64:
+                self._expiry = [e for e in self._expiry
+                                if self._cookies.get(e[2]) is e[3]]
+                heapq.heapify(self._expiry)
+
+    def _remove(self, key):
+        cookie = self._cookies.pop(key, None)
+        if cookie is None:
+            return None
+        name, path, domain = key
+        dkey = _domain_key(domain)[0]
+        bypath = self._index[dkey]
+        cookies = bypath[path]
+        del cookies[(name, domain)]
+        if not cookies:
+            del bypath[path]
+            if not bypath:
+                del self._index[dkey]
+        return cookie
+
+    def _read_groups(self, data):
+        """Note where the domain groups of a saved jar are, without parsing
+        the cookies in them.
+        """
+        pos = len(_JARMAGIC)
+        end = len(data)
+        while pos < end:
+            eol = data.index(b"\n", pos)
+            key, size = data[pos+1:eol].split(b"\t")
+            key = key.decode("utf-8")
+            start = eol + 1
+            pos = start + int(size)
+            if key in self._pending or key in self._index:
+                # Merge with cookies already here, the file replacing them.
+                if key in self._pending:
+                    self._load_group(key)
+                self._parse_group(key, data[start:pos])
+            else:
+                self._pending[key] = (data, start, pos)
+
+    def _load_group(self, key):
+        data, start, end = self._pending.pop(key)
+        self._parse_group(key, data[start:end])
+
+    def _parse_group(self, key, body):
+        labels = key.split(".")
+        labels.reverse()
+        host = ".".join(labels)
+        now = timelib.time()
+        for line in body.decode("utf-8", "surrogateescape").split("\n"):
+            if not line:
+                continue
+            flags, path, expires, name, value = line.split("\t", 4)
+            flags = int(flags)
+            expires = float(expires) if expires else None
+            if expires and expires <= now:
+                continue
+            if host == "local":
+                domain = None # RawCookie default
+            elif flags & _HOSTONLY:
+                domain = host
+            else:
+                domain = "." + host
+            self._store(RawCookie(name, value, domain=domain, expires=expires,
+                                  path=path or None, secure=flags & _SECURE,
+                                  httponly=flags & _HTTPONLY))
+
+    def _load_all(self):
+        for key in list(self._pending):
+            self._load_group(key)
+
+    @property
+    def cookies(self):
+        self._load_all()
+        return list(self._cookies.values())
+
+
+# Compact cookie jar file. After the magic line, each domain group is a
+# line "@<domain key>\t<size>\n" followed by size bytes of cookie lines,
+# "<flags>\t<path>\t<expires>\t<name>\t<value>\n".
+_JARMAGIC = b"# Pycopia cookie jar 1\n"
+_SECURE = 1
+_HTTPONLY = 2
+_HOSTONLY = 4
+
+
+def _domain_key(domain):
+    """Return the index key of a cookie domain, its labels reversed, and
+    whether the cookie is for that host only.
+    """
+    hostonly = not domain.startswith(".") and domain != "local"
+    labels = domain.lower().lstrip(".").split(".")
+    labels.reverse()
+    return ".".join(labels), hostonly
+
+
+def _path_prefixes(path):
+    """The cookie paths that match a request path (RFC 6265, 5.1.4)."""
+    prefixes = {"/", path}
+    i = path.find("/", 1)
+    while i > 0:
+        prefixes.add(path[:i])
+        prefixes.add(path[:i+1])
+        i = path.find("/", i + 1)
+    return prefixes
+
+
+def _jar_line(cookie):
+    flags = ((_SECURE if cookie.secure else 0) |
+             (_HTTPONLY if cookie.httponly else 0) |
+             (_HOSTONLY if _domain_key(cookie.domain)[1] else 0))
+    expires = "%d" % cookie.expires if cookie.expires else ""
+    return "%d\t%s\t%s\t%s\t%s\n" % (flags, cookie.path or "", expires,
+                                     cookie.name, cookie.value)
 
 
 @total_ordering
@@ -1107,9 +1413,18 @@ class Headers(list):
     """Holder for a collection of headers. Should only contain HTTPHeader
     objects.
     Optionally initialize with a list of tuples (WSGI style headers).
+
+    Headers are kept in order, and also indexed by upper-cased name, so
+    they may be looked up or deleted by header object or name (str or
+    bytes), in any case, without a scan.
     """
     def __init__(self, arg=None):
         super(Headers, self).__init__()
+        # Each header gets a sequence number, increasing in list order, so
+        # its position can be found by bisecting _seqs.
+        self._index = {} # upper-cased name -> [(sequence number, header)]
+        self._seqs = []
+        self._next = 0
         if isinstance(arg, list):
            for name, value in arg:
                 self.append(make_header(name, value))
@@ -1127,37 +1442,109 @@ class Headers(list):
         The curl library likes this."""
         return [str(o) for o in self]
 
+    def __reduce__(self):
+        # Copies and pickles rebuild the index as headers are appended.
+        return self.__class__, (), None, iter(self)
+
+    def _reindex(self):
+        self._index = index = {}
+        for seq, obj in enumerate(self):
+            index.setdefault(_header_key(obj), []).append((seq, obj))
+        self._seqs = list(range(len(self)))
+        self._next = len(self)
+
+    def _find(self, key):
+        try:
+            return self._index[_header_key(key)][0][1]
+        except KeyError:
+            raise IndexError("Header %r not found in list." % (key,))
+
     def __getitem__(self, index):
-        if isinstance(index, HTTPHeader):
-            try:
-                i = self.index(index)
-            except ValueError:
-                raise IndexError("Header %r not found in list." % (index,))
-            return list.__getitem__(self, i)
+        if isinstance(index, (HTTPHeader, str, bytes)):
+            return self._find(index)
         else:
             return list.__getitem__(self, index)
 
     def __delitem__(self, index):
-        if isinstance(index, HTTPHeader):
+        if isinstance(index, (HTTPHeader, str, bytes)):
+            key = _header_key(index)
             try:
-                i = self.index(index)
-            except ValueError:
+                objs = self._index[key]
+            except KeyError:
                 raise IndexError("Header %r not found in list." % (index,))
-            return list.__delitem__(self, i)
+            seq, obj = objs.pop(0)
+            if not objs:
+                del self._index[key]
+            i = bisect_left(self._seqs, seq)
+            list.__delitem__(self, i)
+            del self._seqs[i]
         else:
-            return list.__getitem__(self, index)
+            list.__delitem__(self, index)
+            self._reindex()
+
+    def __setitem__(self, index, obj):
+        list.__setitem__(self, index, obj)
+        self._reindex()
+
+    def __contains__(self, key):
+        if isinstance(key, (HTTPHeader, str, bytes)):
+            return _header_key(key) in self._index
+        return list.__contains__(self, key)
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def get(self, key, default=None):
+        """Return the first header named key, or default."""
+        try:
+            return self._index[_header_key(key)][0][1]
+        except KeyError:
+            return default
 
     def getall(self, key):
         """Return all occurences of `key` in a list."""
-        rv = []
-        i = -1
-        while 1:
-            try:
-                i = self.index(key, i + 1)
-            except ValueError:
-                return rv
-            else:
-                rv.append(list.__getitem__(self, i))
+        return [obj for seq, obj in self._index.get(_header_key(key), ())]
+
+    def append(self, obj):
+        list.append(self, obj)
+        seq = self._next
+        self._next += 1
+        self._seqs.append(seq)
+        self._index.setdefault(_header_key(obj), []).append((seq, obj))
+
+    def extend(self, objs):
+        for obj in objs:
+            self.append(obj)
+
+    def insert(self, index, obj):
+        list.insert(self, index, obj)
+        self._reindex()
+
+    def remove(self, key):
+        if isinstance(key, (HTTPHeader, str, bytes)):
+            del self[key]
+        else:
+            list.remove(self, key)
+            self._reindex()
+
+    def pop(self, index=-1):
+        obj = list.pop(self, index)
+        self._reindex()
+        return obj
+
+    def clear(self):
+        list.clear(self)
+        self._index = {}
+        self._seqs = []
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self._reindex()
+
+    def reverse(self):
+        list.reverse(self)
+        self._reindex()
 
     def add_header(self, obj, value=None):
         if isinstance(obj, str):
@@ -1173,6 +1560,14 @@ class Headers(list):
             raise ValueError("Invalid header: %r" % (obj,))
 
 
+def _header_key(obj):
+    """Index key of a header object or name."""
+    if isinstance(obj, HTTPHeader):
+        obj = obj._name
+    if isinstance(obj, bytes):
+        obj = obj.decode("latin1")
+    return obj.upper()
+
 
 # These quoting routines conform to the RFC2109 specification, which in
 # turn references the character definitions from RFC2068.  They provide
@@ -1318,47 +1713,103 @@ def httpunquote(str):
 # some convenient functions
 
 _HEADERMAP = {}
+# Header names, as seen (str or bytes, any case), mapped to the header
+# class, or None, and the interned name.
+_NAMECACHE = {}
+_NAMECACHE_MAX = 1024
+
 def _init():
     global _HEADERMAP
     for obj in list(globals().values()):
         if type(obj) is type and issubclass(obj, HTTPHeader):
             if obj.HEADER:
                 _HEADERMAP[obj.HEADER.upper()] = obj
+                _NAMECACHE[obj.HEADER] = (obj, obj.HEADER)
+                _NAMECACHE[obj.HEADER.encode("ascii")] = (obj, obj.HEADER)
 _init()
 
+def _lookup_name(name):
+    """Return the header class (or None) and str name for a header name."""
+    try:
+        return _NAMECACHE[name]
+    except KeyError:
+        pass
+    strname = name.decode("latin1") if isinstance(name, bytes) else name
+    entry = _HEADERMAP.get(strname.upper()), sys.intern(strname)
+    if len(_NAMECACHE) < _NAMECACHE_MAX:  # Don't grow without bound.
+        _NAMECACHE[name] = entry
+    return entry
+
 def get_header(line):
     """Factory for getting proper header object from text line."""
     if isinstance(line, bytes):
-        parts = line.split(b":", 1)
-        name = parts[0].strip()
-        try:
-            value = parts[1]
-        except IndexError:
-            value = ""
-        try:
-            cls = _HEADERMAP[name.upper()]
-            obj = cls(_value=value)
-            return obj
-        except KeyError:
-            obj = HTTPHeader(_value=value)
-            obj._name = name
-            return obj
+        name, _, value = line.partition(b":")
+    elif isinstance(line, str):
+        name, _, value = line.partition(":")
     elif isinstance(line, HTTPHeader):
         return line
     else:
         raise ValueError(
             "Need string or HTTPHeader instance, not {!r}.".format(type(line)))
+    cls, name = _lookup_name(name.strip())
+    if cls is None:
+        obj = HTTPHeader(_value=value)
+        obj._name = name
+        return obj
+    return cls(_value=value)
 
 
 def make_header(name, _value=None, **kwargs):
-    try:
-        cls = _HEADERMAP[name.upper()]
-        obj = cls(_value, **kwargs)
-        return obj
-    except KeyError:
+    cls, name = _lookup_name(name)
+    if cls is None:
         obj = HTTPHeader(_value, **kwargs)
         obj._name = name
         return obj
+    return cls(_value, **kwargs)
+
+
+class FileWrapper:
+    """The wsgi.file_wrapper of the Pycopia servers.
+
+    Iterates over a file in blocks of blksize, from offset for length bytes
+    if given. The servers send a regular file returned this way with
+    sendfile instead.
+    """
+    def __init__(self, filelike, blksize=65536, offset=0, length=None):
+        self.filelike = filelike
+        self.blksize = blksize
+        self.offset = offset
+        self.length = length
+        if hasattr(filelike, "close"):
+            self.close = filelike.close
+
+    def sendfile_range(self):
+        """Return the (offset, count) to send, or None if the file can not
+        be sent with sendfile.
+        """
+        try:
+            st = os.fstat(self.filelike.fileno())
+        except (AttributeError, OSError, ValueError):
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        if self.length is None:
+            return self.offset, max(st.st_size - self.offset, 0)
+        return self.offset, self.length
+
+    def __iter__(self):
+        fo = self.filelike
+        if self.offset:
+            fo.seek(self.offset)
+        remaining = self.length
+        while remaining is None or remaining > 0:
+            data = fo.read(self.blksize if remaining is None else
+                           min(self.blksize, remaining))
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            yield data
 
 
 ### form parsing
@@ -19,13 +19,16 @@ An SCGI to WSGI gateway.
 
 import sys
 import os
+import time
 import socket
 import signal
 import syslog
 import selectors
+import traceback
 
 from pycopia.OS.procutils import run_as
 from pycopia import netstring
+from pycopia.inet import httputils
 
 
 class Logger:
@@ -48,15 +51,28 @@ class Logger:
 
 
 class SCGIServer:
+    """Serve a WSGI application over SCGI on a UNIX socket.
+
+    By default a child is forked for each request. If workers is given,
+    that many long-lived worker processes are forked up front instead, each
+    one accepting connections on the shared socket. A worker exits after
+    maxrequests requests, if given, and is replaced. A SIGHUP to the server
+    replaces all workers gracefully, letting them finish the request at
+    hand. SIGTERM stops the server the same way.
+    """
 
     def __init__(self, application, socketpath, pwent=None,
-                 umask=None, debug=False):
+                 umask=None, debug=False, workers=0, maxrequests=0):
         signal.signal(signal.SIGCHLD, signal.SIG_IGN)
         self._app = application
         self._umask = umask
         self._path = socketpath
         self._sock = None
         self._pwent = pwent
+        self._nworkers = workers
+        self._maxrequests = maxrequests
+        self._workers = set()
+        self._stopping = False
 
     def __del__(self):
         self.close()
@@ -84,6 +100,8 @@ class SCGIServer:
             self._sock = None
 
     def run(self):
+        if self._nworkers:
+            return self._run_prefork()
         reactor = selectors.DefaultSelector()
         sock = self.open()
         reactor.register(sock, selectors.EVENT_READ)
@@ -104,6 +122,92 @@ class SCGIServer:
                 else:
                     conn.close()
 
+    def _run_prefork(self):
+        sock = self.open()
+        # Reap the workers here, rather than let the kernel do it.
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, self._reload_handler)
+        signal.signal(signal.SIGTERM, self._stop_handler)
+        self._stopping = False
+        try:
+            while 1:
+                if not self._stopping:
+                    while len(self._workers) < self._nworkers:
+                        self._workers.add(self._start_worker(sock))
+                if not self._workers:
+                    break
+                try:
+                    pid, sts = os.wait()
+                except ChildProcessError:
+                    self._workers.clear()
+                    continue
+                self._workers.discard(pid)
+                if sts and not self._stopping:
+                    time.sleep(1.0)  # don't respawn a failing worker too fast.
+        finally:
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        return 0
+
+    def _signal_workers(self, sig):
+        for pid in list(self._workers):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:  # reaped, but not yet discarded.
+                pass
+
+    def _reload_handler(self, sig, frame):
+        self._signal_workers(signal.SIGHUP)
+
+    def _stop_handler(self, sig, frame):
+        self._stopping = True
+        self._signal_workers(signal.SIGTERM)
+
+    def _worker_stop_handler(self, sig, frame):
+        self._stopping = True
+
+    def _start_worker(self, sock):
+        pid = os.fork()
+        if pid:
+            return pid
+        status = 1
+        try:
+            signal.signal(signal.SIGHUP, self._worker_stop_handler)
+            signal.signal(signal.SIGTERM, self._worker_stop_handler)
+            signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+            self._workers.clear()
+            if self._pwent is not None:
+                run_as(self._pwent)
+            self._worker_loop(sock)
+            status = 0
+        finally:
+            os._exit(status)
+
+    def _worker_loop(self, sock):
+        errors = Logger("scgi", "LOCAL7")
+        reactor = selectors.DefaultSelector()
+        reactor.register(sock, selectors.EVENT_READ)
+        count = 0
+        while not self._stopping:
+            # Wake up now and then to notice a stop signal.
+            if not reactor.select(1.0):
+                continue
+            try:
+                conn, addr = sock.accept()
+            except BlockingIOError:  # another worker got it.
+                continue
+            conn.setblocking(True)
+            try:
+                _handle_request(self._app, conn, PREFORK_ENVIRON)
+            except Exception:
+                errors.write("".join(traceback.format_exc()))
+            finally:
+                conn.close()
+            count += 1
+            if self._maxrequests and count >= self._maxrequests:
+                break
+
 
 CRLF = b"\r\n"
 
@@ -114,19 +218,16 @@ DEFAULT_ENVIRON = {
     'wsgi.run_once': True,
 }
 
+PREFORK_ENVIRON = dict(DEFAULT_ENVIRON)
+PREFORK_ENVIRON['wsgi.run_once'] = False
 
-def _handle_request(app, conn):
-    env = DEFAULT_ENVIRON.copy()
-    rawheaders = netstring.decode_stream(conn)
-    it = iter(rawheaders.split(b"\0"))
-    for key in it:
-        if not key:
-            break
-        value = next(it)
-        env[key.decode("latin1")] = value.decode("latin1")
+
+def _handle_request(app, conn, environ=DEFAULT_ENVIRON):
+    env = netstring.decode_pairs(netstring.decode_stream(conn), environ.copy())
     env['CONTENT_LENGTH'] = int(env["CONTENT_LENGTH"])
     env['wsgi.input'] = conn.makefile("rb", 32758)
     env['wsgi.errors'] = Logger(env["SCRIPT_NAME"], "LOCAL7")
+    env['wsgi.file_wrapper'] = httputils.FileWrapper
     if env.get('HTTPS', 'off') in ('on', '1'):
         env['wsgi.url_scheme'] = 'https'
     else:
@@ -143,11 +244,18 @@ def _handle_request(app, conn):
             conn.sendall("{}: {}\r\n".format(h, v).encode("ascii"))
         conn.sendall(CRLF)
 
-    if env["REQUEST_METHOD"] == "HEAD":
-        app(env, start_response)
-    else:
-        for chunk in app(env, start_response):
-            conn.sendall(chunk)  # app encodes the return
+    result = app(env, start_response)
+    if env["REQUEST_METHOD"] != "HEAD":
+        filerange = None
+        if isinstance(result, httputils.FileWrapper):
+            filerange = result.sendfile_range()
+        if filerange is not None:
+            conn.sendfile(result.filelike, *filerange)
+        else:
+            for chunk in result:
+                conn.sendall(chunk)  # app encodes the return
+    if hasattr(result, "close"):
+        result.close()
     env['wsgi.input'].close()
 
 def test_app(env, start_response):
@@ -263,6 +263,11 @@ class Telnet(object):
             self._qi = 0
         return d
 
+    def pending(self):
+        """Number of bytes of input that read() can return without reading
+        the socket."""
+        return len(self._q) - self._qi
+
     def _fill_rawq(self, n=256):
         if self._irawq >= len(self._rawq):
             self._rawq = ''
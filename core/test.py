@@ -7,8 +7,11 @@ import time
 import sys
 import socket
 import string
+import signal
+import struct
 import threading
 import queue
+import tempfile
 
 now = time.time
 
@@ -34,6 +37,7 @@ from pycopia import smtp_envelope
 from pycopia import sourcegen
 from pycopia import shparser
 from pycopia import table
+from pycopia import urls
 from pycopia import texttools
 from pycopia import passwd
 from pycopia import re_inverse
@@ -41,8 +45,10 @@ from pycopia import re_inverse
 
 from pycopia.inet import ABNF
 from pycopia.inet import fcgi
+from pycopia.inet import httpparser
 from pycopia.inet import httputils
 from pycopia.inet import rfc2822
+from pycopia.inet import scgi
 from pycopia.inet import telnet
 
 from pycopia.ISO import iso3166
@@ -135,6 +141,171 @@ class CoreTests(unittest.TestCase):
         self.assertAlmostEqual(now()-start, 8.0, places=2)
         scheduler.del_scheduler()
 
+    def test_fd_scheduler(self):
+        # Exceptions in callbacks are handled by the scheduler, so record
+        # the times and check them here.
+        fired = []
+        def _record(delay, starttime):
+            fired.append((delay, now() - starttime))
+        sched = scheduler.FDScheduler()
+        handles = [sched.add(_record, 3, args=(3, 0)) for i in range(50000)]
+        for h in handles:
+            sched.remove(h)
+        start = now()
+        sched.add(_record, 2, args=(2, start))
+        sched.add(_record, 4, args=(4, start))
+        print("sleeping for 5 seconds")
+        sched.sleep(5)
+        self.assertAlmostEqual(now()-start, 5.0, places=1)
+        self.assertEqual([delay for delay, elapsed in fired], [2, 4])
+        for delay, elapsed in fired:
+            print("%.3f elapsed for %s sec delay" % (elapsed, delay))
+            self.assertAlmostEqual(elapsed, delay, delta=0.05)
+        self.assertFalse(sched)
+        sched.close()
+
+    def test_poll_timers(self):
+        poller = asyncio.Poll()
+        counters = [0, 0]
+        def _periodic():
+            counters[0] += 1
+        def _oneshot():
+            counters[1] += 1
+        start = time.monotonic()
+        ph = poller.add_timer(_periodic, 0.1, 0.1)
+        cancelled = poller.add_timer(_oneshot, 0.2)
+        poller.add_timer(_oneshot, 0.25)
+        poller.add_timer(poller.remove_timer, 0.55, args=(ph,))
+        self.assertTrue(poller.remove_timer(cancelled))
+        poller.loop()
+        self.assertAlmostEqual(time.monotonic() - start, 0.55, places=1)
+        self.assertEqual(counters, [5, 1])
+        self.assertFalse(poller.has_timers())
+        poller.close()
+
+    def test_timers_cancelled_in_batch(self):
+        # Callbacks may cancel timers that expired in the same batch.
+        timers = asyncio.TimerQueue()
+        fired = []
+        def _remove(handle):
+            fired.append("remove")
+            timers.remove(handle)
+        def _clear():
+            fired.append("clear")
+            timers.clear()
+        removed = timers.add(fired.append, 0.01, args=("removed",))
+        timers.add(_remove, 0, args=(removed,))
+        time.sleep(0.02)
+        self.assertEqual(timers.run(), 1)
+        self.assertEqual(fired, ["remove"])
+        timers.add(_clear, 0)
+        timers.add(fired.append, 0.01, args=("cleared",))
+        timers.add(fired.append, 0.01, 0.01, args=("periodic",))
+        time.sleep(0.02)
+        self.assertEqual(timers.run(), 1)
+        self.assertEqual(fired, ["remove", "clear"])
+        self.assertFalse(timers)
+
+    def test_headers_index(self):
+        headers = httputils.Headers([("Content-Type", "text/plain"),
+                                     ("X-Count", "1"), ("X-Count", "2")])
+        headers.append(httputils.get_header(b"Content-Length: 10"))
+        self.assertEqual(headers["content-type"].value, "text/plain")
+        self.assertEqual(headers[b"CONTENT-LENGTH"].value, "10")
+        self.assertIs(headers[httputils.ContentType()], headers[0])
+        self.assertEqual([h.value for h in headers.getall("x-count")], ["1", "2"])
+        self.assertIn("X-COUNT", headers)
+        del headers["x-count"]
+        self.assertEqual([h.value for h in headers.getall("X-Count")], ["2"])
+        self.assertEqual([name for name, value in headers.asWSGI()],
+                         ["Content-Type", "X-Count", "Content-Length"])
+        headers.insert(0, httputils.make_header("X-Count", "0"))
+        self.assertEqual(headers["X-Count"].value, "0")
+        del headers[0]
+        headers.extend([httputils.make_header("X-Count", "3"),
+                        httputils.make_header("Accept", "*/*")])
+        del headers["content-type"]
+        del headers[b"X-COUNT"]
+        self.assertEqual([str(h) for h in headers],
+                         ["Content-Length: 10", "X-Count: 3", "Accept: */*"])
+        del headers["Accept"]
+        self.assertIsNone(headers.get("Accept"))
+        self.assertRaises(IndexError, headers.__getitem__, "Accept")
+
+    def test_header_parsing(self):
+        lines = _BROWSER_REQUEST.splitlines()
+        def _parse():
+            return [httputils.get_header(line) for line in lines]
+        def _parse_all():
+            return [(h.value, getattr(h, "parameters", None)) for h in _parse()]
+        headers = httputils.Headers()
+        headers.extend(_parse())
+        self.assertEqual(len(headers), 20)
+        self.assertIsInstance(headers["content-type"], httputils.ContentType)
+        # Indexing and lookup by name leave every value unparsed.
+        self.assertTrue(all(h._raw is not None for h in headers))
+        self.assertEqual(headers["Content-Type"].parameters, {"charset": "UTF-8"})
+        self.assertIsNone(headers["Content-Type"]._raw)
+        self.assertIsNotNone(headers["Accept"]._raw)
+        self.assertEqual(headers["Accept"].raw_value()[:16], "application/json")
+        self.assertEqual(headers["Accept"].select(["application/json"]),
+                         "application/json")
+        self.assertEqual(headers["user-agent"].value[:11], "Mozilla/5.0")
+        self.assertEqual(str(headers["X-Requested-With"]),
+                         "X-Requested-With: XMLHttpRequest")
+        lazy = benchmarks.time_it(2000, _parse)
+        full = benchmarks.time_it(2000, _parse_all)
+        print("20 headers: {:.1f} us, {:.1f} us with all values parsed.".format(
+              lazy * 1e6, full * 1e6))
+
+    def test_cookiejar(self):
+        URL = urls.UniversalResourceLocator
+        now = time.time()
+        jar = httputils.CookieJar()
+        jar.parse_mozilla_lines([
+            ".example.com\tTRUE\t/\tFALSE\t0\tsite\t1",
+            "www.example.com\tFALSE\t/app\tFALSE\t0\thost\t2",
+            ".example.com\tTRUE\t/app/v2\tTRUE\t0\tsecure\t3",
+            ".example.com\tTRUE\t/\tFALSE\t%d\tshort\t4" % (now + 1),
+            ".example.org\tTRUE\t/\tFALSE\t0\tother\t5",
+            ])
+        def names(url, jar=jar):
+            return [c.name for c in jar._extract_cookies(URL(url))]
+        self.assertEqual(names("https://www.example.com/app/v2/run"),
+                         ["secure", "host", "site", "short"])
+        self.assertEqual(names("http://www.example.com/app/v2/run"),
+                         ["host", "site", "short"])
+        self.assertEqual(names("http://api.example.com/application"),
+                         ["site", "short"])
+        self.assertEqual(names("http://badexample.com/"), [])
+        jar.purge(now + 2)
+        self.assertEqual(names("http://example.com/"), ["site"])
+        self.assertEqual(len(jar), 4)
+        # Lots of cookies from other sites do not slow the lookup down.
+        for i in range(5000):
+            jar.add_cookie("c%d" % i, "x", domain=".site%d.com" % i, path="/",
+                           expires=now + 3600 + i)
+        self.assertEqual(str(jar.get_cookie(URL("http://www.example.com/app"))),
+                         "Cookie: host=2; site=1")
+        fd, name = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            jar.save(name)
+            loaded = httputils.CookieJar(name)
+            self.assertEqual(len(loaded._pending), 5003)
+            self.assertEqual(names("https://www.example.com/app/v2", loaded),
+                             ["secure", "host", "site"])
+            self.assertEqual(len(loaded._pending), 5001)
+            loaded.add_cookie("site", "6", domain=".example.com", path="/")
+            self.assertEqual(names("https://www.example.com/", loaded), ["site"])
+            self.assertEqual(len(loaded), 5004)
+        finally:
+            os.unlink(name)
+        lookup = benchmarks.time_it(1000, jar.get_cookie,
+                                    URL("https://www.example.com/app/v2/run"))
+        print("Cookie selection from {} cookies: {:.1f} us.".format(
+              len(jar), lookup * 1e6))
+
     def XXXtest_sequencer(self):
         counters = [0, 0, 0, 0, 0]
         starttimes = [None, None, None, None, None]
@@ -182,6 +353,111 @@ class CoreTests(unittest.TestCase):
         self.assertEqual(counters[4], 1)
 
 
+_BROWSER_REQUEST = b"""Host: www.example.com
+User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0
+Accept: application/json, text/javascript, */*; q=0.01
+Accept-Language: en-US,en;q=0.5
+Accept-Encoding: gzip, deflate, br
+Accept-Charset: utf-8
+Content-Type: application/json; charset=UTF-8
+Content-Length: 64
+X-Requested-With: XMLHttpRequest
+Origin: https://www.example.com
+Connection: keep-alive
+Referer: https://www.example.com/testresults/list
+Cookie: session=0123456789abcdef; theme=dark
+Sec-Fetch-Dest: empty
+Sec-Fetch-Mode: cors
+Sec-Fetch-Site: same-origin
+Pragma: no-cache
+Cache-Control: no-cache
+If-Modified-Since: Tue, 15 Nov 1994 08:12:31 GMT
+DNT: 1"""
+
+
+class HTTPParserTests(unittest.TestCase):
+
+    PIPELINE = (b"\r\nPOST /form?x=1 HTTP/1.1\r\nHost: localhost\r\n"
+                b"Content-Length: 5\r\nX-Folded: a\r\n b\r\n\r\nhello"
+                b"POST /upload HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+                b"5;name=value\r\nhello\r\n6\r\n world\r\n0\r\n"
+                b"Content-MD5: 1B2M2Y8AsgTpgAmY7PhCfg==\r\n\r\n"
+                b"GET / HTTP/1.0\r\n\r\n")
+
+    def test_pipelined_requests(self):
+        parser = _HTTPEventRecorder()
+        parser.feed(self.PIPELINE)
+        parser.feed_eof()
+        self.assertEqual(parser.events, [
+            ("request", "POST", "/form?x=1", "HTTP/1.1"),
+            ("headers", ["Host: localhost", "Content-Length: 5", "X-Folded: a b"]),
+            ("body", b"hello"),
+            ("complete", True),
+            ("request", "POST", "/upload", "HTTP/1.1"),
+            ("headers", ["Transfer-Encoding: chunked"]),
+            ("body", b"hello world"),
+            ("trailers", ["Content-MD5: 1B2M2Y8AsgTpgAmY7PhCfg=="]),
+            ("complete", True),
+            ("request", "GET", "/", "HTTP/1.0"),
+            ("headers", []),
+            ("complete", False)])
+        self.assertIsInstance(parser.headers[0]["content-length"],
+                              httputils.ContentLength)
+        # Any split of the stream gives the same events.
+        for size in (1, 2, 3, 7, 64):
+            split = _HTTPEventRecorder()
+            for i in range(0, len(self.PIPELINE), size):
+                split.feed(self.PIPELINE[i:i+size])
+            split.feed_eof()
+            self.assertEqual(split.events, parser.events)
+
+    def test_pause(self):
+        parser = _HTTPEventRecorder()
+        parser.pause_on_complete = True
+        parser.feed(self.PIPELINE)
+        self.assertEqual(parser.events[-1], ("complete", True))
+        self.assertEqual(len(parser.events), 4)
+        parser.resume()
+        self.assertEqual(len(parser.events), 9)
+        parser.resume()
+        self.assertEqual(len(parser.events), 12)
+        self.assertFalse(parser.in_message)
+
+    def test_response(self):
+        parser = _HTTPEventRecorder(httpparser.RESPONSE)
+        parser.feed(b"HTTP/1.1 304 Not Modified\r\nETag: \"abc\"\r\n\r\n"
+                    b"HTTP/1.1 200 OK\r\nServer: test\r\n\r\nall ")
+        parser.feed(b"until close")
+        self.assertEqual(parser.events[2], ("complete", True))
+        parser.feed_eof()
+        self.assertEqual(parser.events[3:], [
+            ("response", "HTTP/1.1", 200, "OK"),
+            ("headers", ["Server: test"]),
+            ("body", b"all until close"),
+            ("complete", False)])
+
+    def test_errors(self):
+        for message, status in [
+                (b"GET / HTTP/2.0\r\n\r\n", 505),
+                (b"GET  / HTTP/1.1\r\n\r\n", 400),
+                (b"GET / HTTP/1.1\r\nHost : localhost\r\n\r\n", 400),
+                (b"POST / HTTP/1.1\r\nContent-Length: 1\r\n"
+                 b"Content-Length: 2\r\n\r\n", 400),
+                (b"POST / HTTP/1.1\r\nTransfer-Encoding: gzip\r\n\r\n", 501),
+                (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+                 b"zz\r\n", 400),
+                (b"GET / HTTP/1.1\r\n" + b"X-Filler: 0123456789\r\n" * 4000,
+                 431)]:
+            parser = httpparser.HTTPParser()
+            with self.assertRaises(httpparser.HTTPParseError) as cm:
+                parser.feed(message)
+            self.assertEqual(cm.exception.status, status)
+        parser = httpparser.HTTPParser()
+        parser.feed(b"GET / HTTP/1.1\r\nHost: loc")
+        self.assertTrue(parser.in_message)
+        self.assertRaises(httpparser.HTTPParseError, parser.feed_eof)
+
+
 class NetstringTests(unittest.TestCase):
 
     SOCKPATH="/tmp/testsock"
@@ -202,6 +478,35 @@ class NetstringTests(unittest.TestCase):
         b2 = b"abcd\0efg"
         self.assertEqual(b2, netstring.decode(netstring.encode(b2)))
 
+    def test_encode_into(self):
+        bs = self.source_bytes
+        buf = bytearray(netstring.encoded_length(len(bs)) + 3)
+        end = netstring.encode_into(buf, 0, bs)
+        end = netstring.encode_into(buf, end, b"")
+        self.assertEqual(end, len(buf))
+        self.assertEqual(bytes(buf), netstring.encode(bs) + b"0:,")
+        self.assertRaises(ValueError, netstring.encode_into, buf, end - 2, b"")
+
+    def test_decode_offsets(self):
+        buf = bytearray(netstring.encode(b"abc") + netstring.encode(b"de"))
+        start, end = netstring.decode_offsets(buf)
+        self.assertEqual(buf[start:end], b"abc")
+        start, end = netstring.decode_offsets(memoryview(buf), end + 1)
+        self.assertEqual(buf[start:end], b"de")
+        self.assertEqual(end + 1, len(buf))
+        self.assertIsNone(netstring.decode_offsets(buf[:-1], 6))
+        self.assertIsNone(netstring.decode_offsets(b"12"))
+        self.assertRaises(ValueError, netstring.decode_offsets, b"x2:ab,")
+        self.assertRaises(ValueError, netstring.decode, b"3:abc;")
+
+    def test_decode_pairs(self):
+        env = netstring.decode_pairs(b"CONTENT_LENGTH\x000\x00SCGI\x001\x00",
+                                     {"wsgi.run_once": True})
+        self.assertEqual(env, {"CONTENT_LENGTH": "0", "SCGI": "1",
+                               "wsgi.run_once": True})
+        self.assertEqual(netstring.decode_pairs(b"K\x00\xe9\x00"), {"K": "\xe9"})
+        self.assertRaises(ValueError, netstring.decode_pairs, b"K\x00V")
+
     def test_socket(self):
         bs = self.source_bytes
         q = queue.Queue()
@@ -218,6 +523,375 @@ class NetstringTests(unittest.TestCase):
         t.join()
         self.assertEqual(netstring.decode(bs_netstring), db)
 
+    def test_decode_stream_interrupted(self):
+        # An exception from a signal handler, while waiting for the length,
+        # is raised to the caller.
+        def _interrupt(sig, frame):
+            raise KeyboardInterrupt
+        a, b = socket.socketpair()
+        old = signal.signal(signal.SIGALRM, _interrupt)
+        try:
+            signal.setitimer(signal.ITIMER_REAL, 0.2)
+            self.assertRaises(KeyboardInterrupt, netstring.decode_stream, a)
+            b.sendall(netstring.encode(b"abc"))
+            self.assertEqual(netstring.decode_stream(a), b"abc")
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, old)
+            a.close()
+            b.close()
+
+class SCGITests(unittest.TestCase):
+
+    SOCKPATH = "/tmp/testscgi.sock"
+
+    def _request(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, 0)
+        sock.settimeout(5.0)
+        sock.connect(self.SOCKPATH)
+        sock.sendall(netstring.encode(b"CONTENT_LENGTH\x000\x00SCGI\x001\x00"
+                                      b"REQUEST_METHOD\x00GET\x00"
+                                      b"SCRIPT_NAME\x00/test\x00"))
+        data = b""
+        while True:
+            more = sock.recv(4096)
+            if not more:
+                break
+            data += more
+        sock.close()
+        pid, run_once = data.partition(b"\r\n\r\n")[2].split()
+        self.assertEqual(run_once, b"False")
+        return int(pid)
+
+    def test_prefork(self):
+        if os.path.exists(self.SOCKPATH):
+            os.unlink(self.SOCKPATH)
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                srv = scgi.SCGIServer(_scgi_app, self.SOCKPATH, workers=2,
+                                      maxrequests=3)
+                status = srv.run()
+            finally:
+                os._exit(status)
+        try:
+            for i in range(50):
+                if os.path.exists(self.SOCKPATH):
+                    break
+                time.sleep(0.1)
+            # Workers are replaced after maxrequests requests.
+            pids = [self._request() for i in range(12)]
+            self.assertGreaterEqual(len(set(pids)), 4)
+            for wpid in set(pids):
+                self.assertLessEqual(pids.count(wpid), 3)
+            # SIGHUP replaces all the workers.
+            before = set(pids[-2:])
+            os.kill(pid, signal.SIGHUP)
+            time.sleep(2.0)
+            after = set(self._request() for i in range(2))
+            self.assertFalse(before & after)
+            # SIGTERM stops the workers, then the server.
+            os.kill(pid, signal.SIGTERM)
+            start = time.time()
+            wpid, sts = os.waitpid(pid, 0)
+            self.assertEqual(sts, 0)
+            self.assertLess(time.time() - start, 3.0)
+            pid = None
+        finally:
+            if pid is not None:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            if os.path.exists(self.SOCKPATH):
+                os.unlink(self.SOCKPATH)
+
+
+def _scgi_app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return ["{} {}".format(os.getpid(), environ["wsgi.run_once"]).encode("ascii")]
+
+
+class FCGITests(unittest.TestCase):
+
+    SOCKPATH = "/tmp/testfcgi.sock"
+
+    def test_multiplexed_load(self):
+        """Many requests, multiplexed over a few kept open connections."""
+        def _app(environ, start_response):
+            time.sleep(0.05)
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [environ["QUERY_STRING"].encode("ascii"),
+                    environ["wsgi.input"].read()]
+        pid = self._start_server(_app, self.SOCKPATH, multiplexed=True,
+                                 maxrequests=16)
+        try:
+            sock = _fcgi_connect(self.SOCKPATH)
+            values = _fcgi_get_values(sock, [fcgi.FCGI_MPXS_CONNS,
+                                             fcgi.FCGI_MAX_REQS])
+            self.assertEqual(values, {fcgi.FCGI_MPXS_CONNS: "1",
+                                      fcgi.FCGI_MAX_REQS: "16"})
+            sock.close()
+            results = queue.Queue()
+            def _client(n):
+                sock = _fcgi_connect(self.SOCKPATH)
+                for batch in range(4):
+                    ids = range(1, 9)
+                    out = _fcgi_requests(sock, {i: "q={}.{}.{}".format(n, batch, i)
+                                                for i in ids})
+                    for i in ids:
+                        results.put(out[i] == "q={}.{}.{}body{}".format(n, batch, i, i))
+                sock.close()
+            start = now()
+            threads = [threading.Thread(target=_client, args=(n,)) for n in range(2)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = now() - start
+            # Without FCGI_KEEP_CONN, the connection is closed once its
+            # requests are done.
+            sock = _fcgi_connect(self.SOCKPATH)
+            sock.settimeout(0.5)
+            out = _fcgi_requests(sock, {1: "q=last", 2: "q=next"}, 0)
+            self.assertEqual(out, {1: "q=lastbody1", 2: "q=nextbody2"})
+            self.assertEqual(sock.recv(1), b"")
+            sock.close()
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        print("64 requests in {:.2f} seconds".format(elapsed))
+        self.assertEqual(results.qsize(), 64)
+        self.assertTrue(all(results.get() for i in range(64)))
+        # Serially this would take 3.2 seconds, 16 at a time 0.2.
+        self.assertLess(elapsed, 1.5)
+
+    def test_listeners(self):
+        """One server on UNIX and TCP sockets, with an idle timer."""
+        def _app(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [environ["QUERY_STRING"].encode("ascii")]
+        tmp = socket.socket()
+        tmp.bind(("127.0.0.1", 0))
+        tcpaddr = tmp.getsockname()
+        tmp.close()
+        idler, idlew = os.pipe()
+        pid = self._start_server(_app, [self.SOCKPATH, tcpaddr],
+                                 idle=lambda: os.write(idlew, b"i"),
+                                 timeout=0.1)
+        os.close(idlew)
+        try:
+            for i in range(3):
+                for connect in (lambda: _fcgi_connect(self.SOCKPATH),
+                                lambda: socket.create_connection(tcpaddr)):
+                    sock = connect()
+                    out = _fcgi_requests(sock, {1: "n={}".format(i)})
+                    sock.close()
+                    self.assertEqual(out, {1: "n={}".format(i)})
+            time.sleep(0.5)
+        finally:
+            start = now()
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        self.assertLess(now() - start, 0.5)  # signal wakes up the server.
+        self.assertGreaterEqual(len(os.read(idler, 100)), 3)
+        os.close(idler)
+        self.assertFalse(os.path.exists(self.SOCKPATH))
+
+    def test_output_coalescing(self):
+        srv = self._make_server(maxwrite=4096+8)
+        sock, peer = socket.socketpair()
+        req = fcgi.Request(fcgi.Connection(sock, None, srv), fcgi.InputStream)
+        req.requestId = 1
+        chunks = [string.ascii_letters[i % 52].encode("ascii") * (i % 7 + 1)
+                  for i in range(2000)]
+        chunks.append(b"x" * 10000)
+        for chunk in chunks:
+            req.stdout.write(chunk)
+        req.stdout.close()
+        sock.close()
+        sizes, data = [], []
+        while True:
+            rec = fcgi.Record()
+            rec.read(peer)
+            if not rec.contentLength:
+                break
+            sizes.append(rec.contentLength)
+            data.append(rec.contentData)
+        peer.close()
+        expected = b"".join(chunks)
+        self.assertEqual(b"".join(data), expected)
+        self.assertEqual(sizes[:-1], [4096] * (len(expected) // 4096))
+
+    def test_output_flushed_per_block(self):
+        srv = self._make_server()
+        sock, peer = socket.socketpair()
+        req = fcgi.Request(fcgi.Connection(sock, None, srv), fcgi.InputStream)
+        req.requestId = 1
+        req.role = fcgi.FCGI_RESPONDER
+        req.params = {"REQUEST_METHOD": "GET"}
+        peer.settimeout(5.0)
+        received = []
+        def receive():
+            rec = fcgi.Record()
+            rec.read(peer)
+            received.append(bytes(rec.contentData))
+        def app(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            for i in range(3):
+                if i:
+                    receive() # The block before was sent without delay.
+                yield str(i).encode("ascii") * 10
+        srv.application = app
+        srv.handler(req)
+        receive()
+        sock.close()
+        peer.close()
+        self.assertEqual(received, [
+            b"Status: 200 OK\r\nContent-Type: text/plain\r\n\r\n" + b"0" * 10,
+            b"1" * 10, b"2" * 10])
+
+    def test_input_stream(self):
+        srv = self._make_server()
+        srv.inputStreamShrinkThreshold = 64
+        srv.inputStreamSpillThreshold = 4096
+        sock, peer = socket.socketpair()
+        conn = fcgi.Connection(sock, None, srv)
+        lines = [("line %d " % i).encode("ascii") * (i % 5) + b"\n" for i in range(500)]
+        body = b"".join(lines)
+        preadv = fcgi._preadv
+        # A spilled stream is read with, and without, os.preadv.
+        try:
+            for spill, fcgi._preadv in ((False, preadv), (True, preadv),
+                                        (True, None)):
+                stream = fcgi.InputStream(conn)
+                size = len(body) if spill else 1000
+                for i in range(0, size, 100):
+                    stream.add_data(body[i:min(i+100, size)])
+                stream.add_data(b"")
+                self.assertEqual(stream._file is not None, spill)
+                got = [stream.readline(), stream.readline(3), stream.read(10)]
+                self.assertEqual(got[0], lines[0])
+                self.assertEqual(got[1], lines[1][:3])
+                b = bytearray(20)
+                self.assertEqual(stream.readinto(b), 20)
+                got.append(bytes(b))
+                got.extend(stream)
+                got = b"".join(got)
+                self.assertEqual(got, body[:size])
+                self.assertEqual(stream.read(), b"")
+                self.assertEqual(stream.readinto(b), 0)
+                stream.close()
+        finally:
+            fcgi._preadv = preadv
+        sock.close()
+        peer.close()
+
+    def _make_server(self, **kwargs):
+        sigchld = signal.getsignal(signal.SIGCHLD)
+        srv = fcgi.FCGIServer(None, **kwargs)
+        signal.signal(signal.SIGCHLD, sigchld)
+        return srv
+
+    def _start_server(self, app, address, timeout=1.0, **kwargs):
+        if os.path.exists(self.SOCKPATH):
+            os.unlink(self.SOCKPATH)
+        pid = os.fork()
+        if pid == 0:
+            srv = fcgi.FCGIServer(app, bindAddress=address, **kwargs)
+            try:
+                srv.run(timeout=timeout)
+            finally:
+                os._exit(0)
+        while not os.path.exists(self.SOCKPATH):
+            time.sleep(0.05)
+        return pid
+
+
+def _fcgi_connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    return sock
+
+
+def _fcgi_record(sock, rtype, reqid, data=b""):
+    rec = fcgi.Record(rtype, reqid)
+    rec.contentData = data
+    rec.contentLength = len(data)
+    rec.write(sock)
+
+
+def _fcgi_get_values(sock, names):
+    _fcgi_record(sock, fcgi.FCGI_GET_VALUES, 0,
+                 b"".join(fcgi.encode_pair(name, "") for name in names))
+    rec = fcgi.Record()
+    rec.read(sock)
+    values, pos = {}, 0
+    while pos < rec.contentLength:
+        pos, (name, value) = fcgi.decode_pair(rec.contentData, pos)
+        values[name] = value
+    return values
+
+
+def _fcgi_requests(sock, queries, flags=fcgi.FCGI_KEEP_CONN):
+    """Send concurrent requests, interleaved, and return the bodies."""
+    body = struct.pack(fcgi.FCGI_BeginRequestBody, fcgi.FCGI_RESPONDER, flags)
+    for reqid in queries:
+        _fcgi_record(sock, fcgi.FCGI_BEGIN_REQUEST, reqid, body)
+    for reqid, query in queries.items():
+        params = (fcgi.encode_pair("QUERY_STRING", query) +
+                  fcgi.encode_pair("REQUEST_METHOD", "POST"))
+        _fcgi_record(sock, fcgi.FCGI_PARAMS, reqid, params)
+        _fcgi_record(sock, fcgi.FCGI_PARAMS, reqid)
+    for reqid in queries:
+        _fcgi_record(sock, fcgi.FCGI_STDIN, reqid, "body{}".format(reqid).encode("ascii"))
+        _fcgi_record(sock, fcgi.FCGI_STDIN, reqid)
+    output = {reqid: [] for reqid in queries}
+    pending = set(queries)
+    while pending:
+        rec = fcgi.Record()
+        rec.read(sock)
+        if rec.type == fcgi.FCGI_STDOUT:
+            output[rec.requestId].append(rec.contentData)
+        elif rec.type == fcgi.FCGI_END_REQUEST:
+            pending.remove(rec.requestId)
+    return {reqid: b"".join(chunks).split(b"\r\n\r\n", 1)[1].decode("ascii")
+            for reqid, chunks in output.items()}
+
+
+class _HTTPEventRecorder(httpparser.HTTPParser):
+    """Collects parser events, joining consecutive body pieces."""
+    pause_on_complete = False
+
+    def __init__(self, kind=httpparser.REQUEST):
+        super(_HTTPEventRecorder, self).__init__(kind)
+        self.events = []
+        self.headers = []
+
+    def on_request(self, method, target, version):
+        self.events.append(("request", method, target, version))
+
+    def on_response(self, version, status, reason):
+        self.events.append(("response", version, status, reason))
+
+    def on_headers(self, headers):
+        self.headers.append(headers)
+        self.events.append(("headers", [str(h) for h in headers]))
+
+    def on_body(self, data):
+        if self.events[-1][0] == "body":
+            self.events[-1] = ("body", self.events[-1][1] + data)
+        else:
+            self.events.append(("body", data))
+
+    def on_trailers(self, headers):
+        self.events.append(("trailers", [str(h) for h in headers]))
+
+    def on_message_complete(self):
+        self.events.append(("complete", self.keep_alive))
+        if self.pause_on_complete:
+            self.pause()
+
+
 def _netstring_listener(path, q):
     os.unlink(path) if os.path.exists(path) else None
     sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, 0)
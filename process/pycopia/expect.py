@@ -22,11 +22,12 @@ interacting with processes.
 
 import os
 import re
-import fnmatch
 from errno import EINTR
+from time import monotonic
 
 from pycopia.OS import scheduler
-from pycopia.stringmatch import compile_exact
+from pycopia.asyncio import wait_readable, Poll, PollerInterface
+from pycopia.stringmatch import compile_exact, StringExpression
 import collections
 
 # matching types
@@ -40,6 +41,108 @@ class ExpectError(Exception):
     pass
 
 
+def _compile_glob(patt):
+    """Translate a shell style pattern to a regular expression. It is not
+    anchored, since expect searches a stream, and "*" is not greedy, so it
+    does not run on to the end of the input read so far.
+    """
+    text = patt.decode("latin1")
+    res = []
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        i += 1
+        if c == "*":
+            if not res or res[-1] != ".*?":
+                res.append(".*?")
+        elif c == "?":
+            res.append(".")
+        elif c == "[":
+            j = i
+            if j < n and text[j] == "!":
+                j += 1
+            if j < n and text[j] == "]":
+                j += 1
+            while j < n and text[j] != "]":
+                j += 1
+            if j >= n:
+                res.append("\\[")
+            else:
+                stuff = text[i:j].replace("\\", "\\\\")
+                i = j + 1
+                if stuff[0] == "!":
+                    stuff = "^" + stuff[1:]
+                elif stuff[0] == "^":
+                    stuff = "\\" + stuff
+                res.append("[" + stuff + "]")
+        else:
+            res.append(re.escape(c))
+    return re.compile(("(?s:" + "".join(res) + ")").encode("latin1"))
+
+
+# Compiled alternations of whole search lists, shared by all Expect objects.
+_union_cache = {}
+_MAXCACHE = 256
+
+_NUMERIC_BACKREF = re.compile(br"\\[1-9]")
+
+
+def _get_union(solist):
+    """Return a single regular expression matching any of the patterns in the
+    search list, each one wrapped in a named group, and a map from group
+    index to list index. Returns None if the list can't be combined, e.g.
+    because of numeric back references.
+    """
+    key = tuple((so.pattern, so.flags, isinstance(so, StringExpression))
+                for so, cb in solist)
+    try:
+        return _union_cache[key]
+    except KeyError:
+        pass
+    parts = []
+    for i, (patt, flags, exact) in enumerate(key):
+        if exact:
+            patt = re.escape(patt)
+        elif flags or _NUMERIC_BACKREF.search(patt):
+            parts = None
+            break
+        parts.append(b"(?P<_" + str(i).encode("ascii") + b">" + patt + b")")
+    union = None
+    if parts:
+        try:
+            regex = re.compile(b"|".join(parts))
+        except re.error:
+            pass
+        else:
+            union = (regex, dict((regex.groupindex["_{}".format(i)], i)
+                                 for i in range(len(parts))))
+    if len(_union_cache) >= _MAXCACHE:
+        _union_cache.clear()
+    _union_cache[key] = union
+    return union
+
+
+def _first_match(so, buf, start, endpos):
+    """Search buf[start:endpos] for the match that is complete first, as if
+    the input had been searched a byte at a time. A greedy pattern matched
+    against a whole read would otherwise take in more of it.
+    """
+    mo = so.search(buf, start, endpos)
+    if mo is None or isinstance(so, StringExpression):
+        return mo
+    # The first match is complete at some end point in (lo, hi]. No match
+    # can end before mo starts, since mo starts leftmost.
+    lo, hi = mo.start() - 1, mo.end()
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        m = so.search(buf, start, mid)
+        if m is None:
+            lo = mid
+        else:
+            hi, mo = mid, m
+    return mo
+
+
 class Expect:
     """Expect wraps a file-like object and provides enhanced read, write,
 readline, send, and expect methods. This is very useful when combined with
@@ -58,8 +161,17 @@ The wrapped object need only implement the following methods:
         restart(bool) - Turn on or off system call restart.
         dup()         - Duplicate the object and file descriptor (for cloning)
         interrupt()   - Interrupt the wrapped object (usually a process object)
+        timed_read(n, timeout) - read(n), waiting no longer than timeout.
+        readsome(n, timeout)   - read what is available, up to n bytes.
+        pending()     - Amount of input the object has buffered itself.
 
 """
+    # Input is read in chunks of up to chunksize bytes. Only new input, plus
+    # the last search_window bytes already searched, are searched again when
+    # more arrives. So a GLOB or REGEX match must not be longer than that.
+    chunksize = 16384
+    search_window = 4096
+
     def __init__(self, fo=None, prompt="$", timeout=90.0, logfile=None,
                  engine=None):
         if hasattr(fo, "fileno"):
@@ -76,12 +188,16 @@ The wrapped object need only implement the following methods:
         self.cmd_interp = None
         self._prompt = prompt.encode()
         self._patt_cache = {}
-        self._buf = ''
+        self._buf = bytearray()  # input read, but not yet consumed.
         self.eof = 0
         self.sched = scheduler.get_scheduler()
+        # Process objects know how to do a timed read themselves.
+        self._timed_read = getattr(self._fo, "timed_read", self._poll_read)
+        self._readsome = getattr(self._fo, "readsome", self._poll_read)
         self._engine = engine
         # If a match on a list occurs, the index in the list
-        # search on the last 'expect' method call is saved here.
+        # search on the last 'expect' method call is saved here. The match
+        # that ends first in the input wins, list order breaks ties.
         self.expectindex = -1
 
     def fileobject(self):
@@ -168,8 +284,7 @@ The wrapped object need only implement the following methods:
                 self._patt_cache[patt] = p = (compile_exact(patt), callback)
                 return p
             elif mtype == GLOB:
-                self._patt_cache[patt] = p = (re.compile(fnmatch.translate(patt)),  # noqa
-                                              callback)
+                self._patt_cache[patt] = p = (_compile_glob(patt), callback)
                 return p
             elif mtype == REGEX:
                 self._patt_cache[patt] = p = (re.compile(patt), callback)
@@ -184,6 +299,8 @@ The wrapped object need only implement the following methods:
         elif isinstance(patt, bytes):
             solist.append(self._get_re(patt, mtype, callback))
         elif ptype is tuple:
+            if isinstance(patt[0], str):
+                patt = (patt[0].encode(),) + patt[1:]
             solist.append(self._get_re(*patt))
         elif ptype is list:
             list([self._get_search_list(p, mtype, callback, solist)
@@ -199,28 +316,80 @@ The wrapped object need only implement the following methods:
     # string, match type, and callback.  Or, a list of tuples or strings
     # as just described. An optional callback method and timeout value may
     # also be supplied. The callback will be called when a match is found,
-    # with a match-object as a parameter.
+    # with a match-object as a parameter. The match is the one that would
+    # be found if the input were searched a byte at a time, the first to be
+    # complete. So a greedy REGEX such as "ok.*" matches just "ok".
 
     def expect(self, patt, mtype=EXACT, callback=None, timeout=None):
         solist = self._get_search_list(patt, mtype, callback)
         if not solist:
             raise ExpectError("Empty expect search.")
-        buf = bytes()
+        self.expectindex = -1
+        overlap = self._get_overlap(solist)
+        union = _get_union(solist) if len(solist) > 1 else None
+        start = 0
         while 1:
-            c = self.read(1, timeout)
-            if not c:
-                raise ExpectError("EOF during expect.")
-            buf += c
-            self.expectindex = i = -1
-            for so, cb in solist:
-                mo = so.search(buf)
-                if mo:
-                    # Save the list index of the match object
-                    self.expectindex = i+1
-                    if cb:
-                        cb(mo)
-                    return mo
-                i += 1
+            found = self._search(solist, union, start)
+            if found is not None:
+                return self._consume(solist, *found)
+            start = max(len(self._buf) - overlap, 0)
+            self._fill(timeout)
+
+    def _search(self, solist, union, start):
+        """Search the buffer from start. Returns (match, index) or None."""
+        buf = self._buf
+        endpos = len(buf)
+        if union is not None:
+            # One scan tells if anything matches, and where the first match
+            # to end must have ended by.
+            mo = union[0].search(buf, start)
+            if mo is None:
+                return None
+            endpos = mo.end()
+        # The earliest ending match wins, list order breaks ties. That does
+        # not depend on how the input was split into reads.
+        best = None
+        for i, (so, cb) in enumerate(solist):
+            mo = _first_match(so, buf, start, endpos)
+            if mo and (best is None or mo.end() < best[0].end()):
+                best = (mo, i)
+        return best
+
+    def _consume(self, solist, mo, i):
+        so, cb = solist[i]
+        # Match that pattern again on a bytes copy, since the buffer will be
+        # changed, and so the match object has the pattern's own groups.
+        mo = so.search(bytes(self._buf), mo.start(), mo.endpos)
+        del self._buf[:mo.end()]
+        # Save the list index of the match object
+        self.expectindex = i
+        if cb:
+            cb(mo)
+        return mo
+
+    def _get_overlap(self, solist):
+        overlap = 0
+        for so, cb in solist:
+            if isinstance(so, StringExpression):
+                overlap = max(overlap, len(so.pattern) - 1)
+            else:
+                overlap = max(overlap, self.search_window)
+        return overlap
+
+    def _fill(self, timeout=None):
+        """Add whatever input is available to the buffer, waiting up to
+        timeout seconds for some.
+        """
+        data = self._readsome(self.chunksize, timeout or self.default_timeout)
+        if not data:
+            raise ExpectError("EOF during expect.")
+        return self._feed(data)
+
+    def _feed(self, data):
+        if self._log:
+            self._log.write(data)
+        self._buf += data
+        return len(data)
 
     def expect_exact(self, patt, callback=None, timeout=None):
         return self.expect(patt, EXACT, callback, timeout)
@@ -232,48 +401,50 @@ The wrapped object need only implement the following methods:
         return self.expect(patt, REGEX, callback, timeout)
 
     def read(self, amt=-1, timeout=None):
-        self._timed_out = 0
         timeout = timeout or self.default_timeout
-        data = self.sched.iotimeout(self._fo.read, args=(amt,), timeout=timeout)
-#        ev = self.sched.add(self._timeout_cb, timeout)
-#        try:
-#            while 1:
-#                try:
-#                    data = self._fo.read(amt)
-#                except InterruptedError as val:
-#                    if self._timed_out == 1:
-#                        raise scheduler.TimeoutError(
-#                            "expect: timed out during read.")
-#                    else:
-#                        continue
-#                except EOFError:
-#                    return ""
-#                else:
-#                    break
-#        finally:
-#            self.sched.remove(ev)
+        buf = self._buf
+        if buf and amt >= 0:  # return what expect left over first.
+            data = bytes(buf[:amt])
+            del buf[:amt]
+            return data
+        data = self._timed_read(amt, timeout)
         if self._log:
             self._log.write(data)
+        if buf:
+            data = bytes(buf) + data
+            del buf[:]
         return data
 
-    def _timeout_cb(self):
-        self._timed_out = 1
+    def _poll_read(self, amt, timeout):
+        # Telnet objects may have input that was already read from the socket.
+        pending = getattr(self._fo, "pending", None)
+        if not (pending and pending()) and not wait_readable(
+                self._fo.fileno(), timeout):
+            raise scheduler.TimeoutError("expect: timed out during read.")
+        return self._fo.read(amt)
 
     def read_until(self, patt=None, timeout=None):
         if patt is None:
             patt = self._prompt
-        buf = ""
+        elif isinstance(patt, str):
+            patt = patt.encode()
+        buf = self._buf
+        start = 0
         while 1:
-            c = self.read(1, timeout)
-            if c == "":
-                raise ExpectError("EOF during read_until({!r}).".format(patt))
-            buf += c
-            i = buf.find(patt)
+            i = buf.find(patt, start)
             if i >= 0:
-                return buf[:i]
+                data = bytes(buf[:i])
+                del buf[:i + len(patt)]
+                return data
+            start = max(len(buf) - len(patt) + 1, 0)
+            try:
+                self._fill(timeout)
+            except ExpectError:
+                raise ExpectError(
+                    "EOF during read_until({!r}).".format(patt))
 
     def readline(self, timeout=None):
-        return self.read_until("\n", timeout)
+        return self.read_until(b"\n", timeout)
 
     def readlines(self, N=2147483646, filt=None, timeout=None):
         """Return a list of lines of input. Read up to N lines, optionally
@@ -315,6 +486,7 @@ The wrapped object need only implement the following methods:
     def clear_cache(self):
         """Clears the pattern cache."""
         self._patt_cache.clear()
+        _union_cache.clear()
 
     # write methods
     def write(self, data):
@@ -371,3 +543,213 @@ The wrapped object need only implement the following methods:
                     eng.step(next)
                 else:
                     break
+
+
+class GroupSession(PollerInterface):
+    """One Expect object and its script, run by an ExpectGroup.
+
+    After the group has run, the result attribute holds the return value of
+    the script, or error the exception that ended it. The elapsed attribute
+    is the run time of the whole session, and timings the time each expect
+    step waited for its match.
+    """
+    def __init__(self, exp, script, name, timeout):
+        self.exp = exp
+        self.script = script
+        self.name = name
+        self.timeout = timeout
+        self.result = None
+        self.error = None
+        self.elapsed = None
+        self.timings = []
+        self._gen = None
+        self._poller = None
+        self._timer = None
+
+    def __repr__(self):
+        return "{}({!r}, result={!r}, error={!r})".format(
+            self.__class__.__name__, self.name, self.result, self.error)
+
+    @property
+    def done(self):
+        return self.elapsed is not None
+
+    def start(self, poller):
+        if callable(self.script):
+            self._gen = self.script(self.exp)
+        else:
+            self._gen = _chat(self.exp, self.script)
+        self._poller = poller
+        self._starttime = monotonic()
+        poller.register(self)
+        self._step()
+
+    def _step(self, value=None, exc=None):
+        """Advance the script until it waits for input that is not already
+        in the buffer, or ends.
+        """
+        exp = self.exp
+        while 1:
+            try:
+                if exc is None:
+                    patt = self._gen.send(value)
+                else:
+                    patt, exc = self._gen.throw(exc), None
+            except StopIteration as stop:
+                self._finish(stop.value, None)
+                return
+            except Exception as err:  # noqa
+                self._finish(None, err)
+                return
+            solist = exp._get_search_list(patt, EXACT, None)
+            if not solist:
+                exc = ExpectError("Empty expect search.")
+                continue
+            exp.expectindex = -1
+            self._solist = solist
+            self._union = _get_union(solist) if len(solist) > 1 else None
+            self._overlap = exp._get_overlap(solist)
+            self._stepstart = monotonic()
+            found = exp._search(solist, self._union, 0)
+            if found is None:
+                self._start = max(len(exp._buf) - self._overlap, 0)
+                self._timer = self._poller.add_timer(self._timeout_cb,
+                                                     self.timeout)
+                return
+            self.timings.append(0.0)
+            value = exp._consume(solist, *found)
+
+    def _matched(self, found):
+        self._poller.remove_timer(self._timer)
+        self._timer = None
+        self.timings.append(monotonic() - self._stepstart)
+        self._step(self.exp._consume(self._solist, *found))
+
+    def _timeout_cb(self):
+        self._timer = None
+        self._step(exc=scheduler.TimeoutError("expect: timed out."))
+
+    def _finish(self, result, error):
+        self.elapsed = monotonic() - self._starttime
+        self.result = result
+        self.error = error
+        self._gen = None
+        self._solist = self._union = None
+        if self._timer is not None:
+            self._poller.remove_timer(self._timer)
+            self._timer = None
+        self._poller.unregister(self)
+
+    # PollerInterface
+    def fileno(self):
+        return self.exp.fileno()
+
+    def readable(self):
+        return self._gen is not None
+
+    def read_handler(self):
+        if self._timer is None:  # not waiting for a match.
+            return
+        exp = self.exp
+        try:
+            data = exp._readsome(exp.chunksize, 0.0)
+        except scheduler.TimeoutError:
+            return
+        if not data:
+            self._poller.remove_timer(self._timer)
+            self._timer = None
+            self._step(exc=ExpectError("EOF during expect."))
+            return
+        exp._feed(data)
+        found = exp._search(self._solist, self._union, self._start)
+        if found is None:
+            self._start = max(len(exp._buf) - self._overlap, 0)
+        else:
+            self._matched(found)
+
+    hangup_handler = read_handler
+
+    def exception_handler(self, ex, val, tb):
+        if self._gen is not None:
+            self._gen.close()
+            self._finish(None, val)
+
+
+def _chat(exp, steps):
+    mo = None
+    for patt, response in steps:
+        mo = yield patt
+        if response is not None:
+            if isinstance(response, str):
+                response = response.encode()
+            exp.send(response)
+    return mo
+
+
+class ExpectGroup(object):
+    """Drive many Expect objects at once from one poll loop, without
+    threads.
+
+    Each session has a script, which is a generator function. It is called
+    with the Expect object, and yields patterns in any form that the expect()
+    method takes. When the pattern is found the match object is sent back
+    into the generator, and exp.expectindex is set, as usual. If the pattern
+    is not found within the timeout, or end of file is reached, the
+    scheduler.TimeoutError or ExpectError is raised inside the generator.
+    The script may write to the Expect object between steps, and its return
+    value is the result of the session. As with expect(), a pattern is
+    matched as soon as it is complete, so a pattern ending in a greedy
+    repeat stops at the first complete match: "got (\\d+)" matches "got 4"
+    of "got 42". End such a pattern with what follows it, as in
+    "got (\\d+)\\n". For example:
+
+        def login(exp):
+            yield "login:"
+            exp.send(b"root\\n")
+            mo = yield [(br"(\\S+)# ", REGEX), "incorrect"]
+            return mo.group(1) if exp.expectindex == 0 else None
+
+    A script may also be a list of (pattern, response) pairs, in the manner
+    of chat(8). The response, if not None, is sent after the pattern is
+    found. The result is the last match object.
+    """
+    def __init__(self, timeout=None):
+        self.default_timeout = timeout
+        self._sessions = []
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __iter__(self):
+        return iter(self._sessions)
+
+    def add(self, exp, script, name=None, timeout=None):
+        """Add an Expect object and the script to run on it. The timeout
+        applies to each expect step, and defaults to the group's timeout,
+        then the Expect object's. Returns the GroupSession.
+        """
+        if name is None:
+            name = len(self._sessions)
+        sess = GroupSession(exp, script, name,
+                            timeout or self.default_timeout or
+                            exp.default_timeout)
+        self._sessions.append(sess)
+        return sess
+
+    def run(self):
+        """Run all sessions that have not yet run, until all of them are
+        finished. Returns a dictionary of session name to GroupSession.
+        """
+        poller = Poll()
+        try:
+            for sess in self._sessions:
+                if not sess.done:
+                    sess.start(poller)
+            poller.loop()
+        finally:
+            poller.close()
+        return dict((sess.name, sess) for sess in self._sessions)
+
+    def results(self):
+        """Return a dictionary of session name to script result."""
+        return dict((sess.name, sess.result) for sess in self._sessions)
@@ -21,11 +21,19 @@ Classes and functions for controlling, reading, and writing to co-processes.
 import sys
 import os
 import signal
+import struct
+import pickle
+import threading
+from functools import partial
+from select import EPOLLIN, poll, POLLIN
+from time import monotonic
 from signal import SIGCHLD, SIGTERM, SIGSTOP, SIGCONT, SIGHUP, SIG_DFL, SIGINT
 from errno import EBADF, EIO
 
 from pycopia import logging
 from pycopia import shparser
+from pycopia import asyncio
+from pycopia.asyncio import wait_readable
 from pycopia.aid import NULL
 from pycopia.OS.procfs import ProcStat
 from pycopia.OS.exitstatus import ExitStatus
@@ -38,20 +46,119 @@ class ProcessError(Exception):
     pass
 
 
+class ResourceUsage(object):
+    """Resource usage totals for the exited processes running one command.
+    maxrss is the largest of any one process, in kilobytes.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.utime = 0.0
+        self.stime = 0.0
+        self.maxrss = 0
+        self.minflt = 0
+        self.majflt = 0
+        self.inblock = 0
+        self.oublock = 0
+        self.nvcsw = 0
+        self.nivcsw = 0
+
+    def __str__(self):
+        return ("{}: {} run, user {:.3f}s, sys {:.3f}s, maxrss {} kB, "
+                "faults {}/{}, blocks in {} out {}, csw {}/{}".format(
+                    self.name, self.count, self.utime, self.stime,
+                    self.maxrss, self.minflt, self.majflt, self.inblock,
+                    self.oublock, self.nvcsw, self.nivcsw))
+
+    def add(self, ru):
+        """Add a resource.struct_rusage to the totals."""
+        self.count += 1
+        self.utime += ru.ru_utime
+        self.stime += ru.ru_stime
+        self.maxrss = max(self.maxrss, ru.ru_maxrss)
+        self.minflt += ru.ru_minflt
+        self.majflt += ru.ru_majflt
+        self.inblock += ru.ru_inblock
+        self.oublock += ru.ru_oublock
+        self.nvcsw += ru.ru_nvcsw
+        self.nivcsw += ru.ru_nivcsw
+
+
+# posix_spawn does not copy the address space of this process, as fork does,
+# so the cost of starting a command does not grow with the size of this
+# process. Not available before Python 3.8.
+_posix_spawnp = getattr(os, "posix_spawnp", None)
+
+# Not available before Python 3.10, data is copied through Python then.
+_splice = getattr(os, "splice", None)
+
+
+def _can_spawn(pwent=None, devnull=False):
+    # posix_spawn can't change the user, or run Python code in the child.
+    return _posix_spawnp is not None and not pwent and not devnull
+
+
+def _spawn(cmd, env, file_actions, **kwargs):
+    """Start cmd using posix_spawn, performing file_actions in the child.
+    Returns the child's pid.
+    """
+    return _posix_spawnp(cmd[0], cmd, env or os.environ,
+                         file_actions=file_actions, **kwargs)
+
+
+def _stdio_actions(stdin, stdout, stderr=None):
+    actions = [(os.POSIX_SPAWN_DUP2, stdin, 0),
+               (os.POSIX_SPAWN_DUP2, stdout, 1)]
+    if stderr is not None:
+        actions.append((os.POSIX_SPAWN_DUP2, stderr, 2))
+    return actions
+
+
+def _spawnpty(cmd, env):
+    """Start cmd using posix_spawn, in a new session with a new pty as its
+    controlling terminal. Returns the child's pid and the master pty file
+    descriptor.
+    """
+    master, slave = os.openpty()
+    try:
+        # Opening the tty in the new session makes it the controlling tty.
+        pid = _spawn(cmd, env,
+                     [(os.POSIX_SPAWN_OPEN, 0, os.ttyname(slave), os.O_RDWR, 0),
+                      (os.POSIX_SPAWN_DUP2, 0, 1),
+                      (os.POSIX_SPAWN_DUP2, 0, 2)],
+                     setsid=True)
+    except OSError:
+        os.close(master)
+        raise
+    finally:
+        os.close(slave)
+    return pid, master
+
+
+def _close_fds(*fds):
+    for fd in fds:
+        if fd is not None:
+            os.close(fd)
+
+
 class Process:
     """Abstract base class for Processes. Handles all process handling, and
     some common functionality. I/O is handled in subclasses.
     """
+    readsize = 16384  # amount to ask for on each buffered read.
+
     def __init__(self, cmdline, logfile=None, callback=None, async=False):
         self.cmdline = cmdline
         self.deadchild = 0
         self.closed = False
         self.callback = callback  # called at death of process
         self._restart = True  # restart interrupted system calls
-        self._buf = b''
+        self._buf = bytearray()  # input read, but not yet consumed
+        self._bufpos = 0  # offset of unconsumed input in _buf
         self._errbuf = b''
         self._writebuf = b''
         self.exitstatus = None
+        self.rusage = None  # resource.struct_rusage, once reaped.
         self._environment = None
         self._async = bool(async)  # use asyncio, or not
         self._authtoken = None
@@ -206,20 +313,110 @@ called when child dies. """
     def read(self, amt=2147483646):
         if amt < 0:
             amt = 2147483646
-        bs = len(self._buf)
+        buf = self._buf
         try:
-            while bs < amt:
-                c = self._read(4096)
+            while len(buf) - self._bufpos < amt:
+                c = self._read(self.readsize)
                 if not c:
                     break
-                self._buf += c
-                bs = len(self._buf)
+                buf += c
         except EOFError:  # TODO log an error
             pass  # let it ruturn rest of buffer
-        data = self._buf[:amt]
-        self._buf = self._buf[amt:]
+        return self._take(amt)
+
+    def readinto(self, b):
+        """Read up to len(b) bytes into the writable buffer b. Waits for input
+        only if none is buffered. Returns the number of bytes read, zero at
+        EOF.
+        """
+        with memoryview(b) as view, view.cast("B") as mv:
+            n = len(self._buf) - self._bufpos
+            if n == 0:
+                try:
+                    data = self._read(len(mv))
+                except EOFError:
+                    return 0
+                n = len(data)
+                mv[:n] = data
+                return n
+            n = min(n, len(mv))
+            start = self._bufpos
+            with memoryview(self._buf) as bv:
+                mv[:n] = bv[start:start + n]
+            self._consume(n)
+            return n
+
+    def timed_read(self, amt=2147483646, timeout=None):
+        """Like read(), but waits at most timeout seconds for data, by polling
+        for readability rather than with a timer signal. Returns what was read
+        if the time runs out with only part of the amount read. Raises
+        TimeoutError if nothing arrived at all.
+        """
+        if timeout is None:
+            return self.read(amt)
+        if amt < 0:
+            amt = 2147483646
+        deadline = monotonic() + timeout
+        buf = self._buf
+        try:
+            while len(buf) - self._bufpos < amt:
+                if not wait_readable(self.fileno(), deadline - monotonic()):
+                    if len(buf) == self._bufpos:
+                        raise scheduler.TimeoutError(
+                            "Process: timed out during read.")
+                    break
+                c = self._read(self.readsize)
+                if not c:
+                    break
+                buf += c
+        except EOFError:
+            pass
+        except OSError as err:
+            if err.errno != EIO:  # EIO is EOF on a pty.
+                raise
+        return self._take(amt)
+
+    def readsome(self, amt=4096, timeout=None):
+        """Return up to amt bytes of the input available now, waiting at most
+        timeout seconds (forever if None) for some to arrive. Returns an
+        empty bytes object at EOF.
+        """
+        if len(self._buf) == self._bufpos:
+            if timeout is not None and not wait_readable(self.fileno(),
+                                                         timeout):
+                raise scheduler.TimeoutError("Process: timed out during read.")
+            try:
+                return self._read(amt)
+            except EOFError:
+                return b""
+            except OSError as err:
+                if err.errno == EIO:
+                    return b""
+                raise
+        return self._take(amt)
+
+    def _take(self, amt):
+        """Remove and return up to amt bytes from the front of the buffer."""
+        start = self._bufpos
+        with memoryview(self._buf) as bv:
+            data = bv[start:start + amt].tobytes()
+        self._consume(len(data))
         return data
 
+    def _consume(self, amt):
+        # Consumed input is only advanced over, and removed from the buffer
+        # when all of it is used, or when it is more than half of a large
+        # buffer. This keeps the cost of removal linear overall.
+        buf = self._buf
+        pos = self._bufpos + amt
+        if pos >= len(buf):
+            del buf[:]
+            pos = 0
+        elif pos > 65536 and pos * 2 > len(buf):
+            del buf[:pos]
+            pos = 0
+        self._bufpos = pos
+
     def readerr(self, amt=2147483646):
         if amt < 0:
             amt = 2147483646
@@ -241,24 +438,29 @@ called when child dies. """
     def readline(self, amt=2147483646):
         if amt < 0:
             amt = 2147483646
-        bufs = []
-        rs = min(100, amt)
-        while 1:
-            c = self.read(rs)
-            i = c.find(b"\n")
-
-            if i < 0 and len(c) > amt:
-                i = amt-1
-            elif amt <= i:
-                i = amt-1
-            if i >= 0 or c == b'':
-                bufs.append(c[:i+1])
-                self._unread(c[i+1:])
-                return b"".join(bufs)
-
-            bufs.append(c)
-            amt -= len(c)
-            rs = min(amt, rs*2)
+        buf = self._buf
+        pos = start = self._bufpos
+        try:
+            while 1:
+                i = buf.find(b"\n", start, pos + amt) + 1
+                if i:
+                    data = bytes(buf[pos:i])
+                    # Inline the common case of _consume(), for speed.
+                    if i < len(buf) and i <= 65536:
+                        self._bufpos = i
+                    else:
+                        self._consume(i - pos)
+                    return data
+                if len(buf) - pos >= amt:
+                    break
+                start = len(buf)
+                c = self._read(self.readsize)
+                if not c:
+                    break
+                buf += c
+        except EOFError:
+            pass
+        return self._take(amt)
 
     def readlines(self, sizehint=2147483646):
         if sizehint < 0:
@@ -299,7 +501,8 @@ called when child dies. """
         return None
 
     def _unread(self, data):
-        self._buf = data + self._buf
+        self._buf[:self._bufpos] = data
+        self._bufpos = 0
 
     # Interface for asyncio poller.
     def readable(self):
@@ -338,7 +541,12 @@ class ProcessPipe(Process):
     process's stdio is connected to this instance via pipes, and can be read
     and written to by the instances read() and write() methods.
 
+    If the fastspawn attribute is true the command is started with
+    posix_spawn instead, when that is possible. A command that can't be
+    started then raises OSError, rather than exiting with status 127.
     """
+    fastspawn = False
+
     def __init__(self, cmdline, logfile=None,  env=None, callback=None,
                  merge=1, pwent=None, async=False, devnull=None, _pgid=0):
         super().__init__(cmdline, logfile, callback, async)
@@ -354,7 +562,18 @@ class ProcessPipe(Process):
             self._stderr, c2perr = None, None
         else:
             self._stderr, c2perr = os.pipe()
-        self.childpid = os.fork()
+        if self.fastspawn and _can_spawn(pwent):
+            try:
+                self.childpid = _spawn(
+                    cmd, env, _stdio_actions(p2cread, c2pwrite,
+                                             c2perr or c2pwrite),
+                    setpgroup=_pgid)
+            except OSError:
+                _close_fds(p2cread, self._p_stdin, self._p_stdout, c2pwrite,
+                           self._stderr, c2perr)
+                raise
+        else:
+            self.childpid = os.fork()
         self.childpid2 = None  # for compatibility with pipeline
         if self.childpid == 0:
             # Child
@@ -458,7 +677,12 @@ class ProcessPty(Process):
     process's stdio is connected to this instance via a pty, and can be read
     and written to by the instances read() and write() methods. That pty
     becomes the processes controlling terminal.
+
+    If the fastspawn attribute is true the command is started with
+    posix_spawn instead, when that is possible.
     """
+    fastspawn = False
+
     def __init__(self, cmdline, logfile=None, env=None, callback=None,
                  merge=1, pwent=None, async=False, devnull=False, _pgid=0):
         super().__init__(cmdline, logfile, callback, async)
@@ -466,7 +690,10 @@ class ProcessPty(Process):
             self.environment = env
         cmd = split_command_line(self.cmdline)
         try:
-            pid, self._fd = os.forkpty()
+            if self.fastspawn and _can_spawn(pwent, devnull):
+                pid, self._fd = _spawnpty(cmd, env)
+            else:
+                pid, self._fd = os.forkpty()
         except OSError as err:
             logging.error("ProcessPty error: {}".format(err))
             raise
@@ -632,16 +859,120 @@ class SubProcess(Process):
 
 
 # TODO need a more general pipeline
+class SplicePump(object):
+    """Moves data from the infd pipe to the outfd pipe by way of a capture
+    file, in a background thread. The data is moved with os.splice, so it is
+    never copied into Python objects.
+
+    The capture may be a file name, which is created, or an open file or
+    file descriptor, which must be readable and writable and is appended to.
+
+    If tap is given it is called as tap(offset, data) with up to tapsize bytes
+    from the capture file, at most once every tapinterval bytes, from the
+    pump thread.
+    """
+    chunksize = 1048576
+
+    def __init__(self, infd, outfd, capture, tap=None, tapsize=256,
+                 tapinterval=1048576):
+        self._infd = infd
+        self._outfd = outfd
+        if isinstance(capture, str):
+            self._capfd = os.open(capture,
+                                  os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            self._owncap = True
+        else:
+            if not isinstance(capture, int):
+                capture = capture.fileno()
+            self._capfd = capture
+            self._owncap = False
+        self.offset = self._origin = os.fstat(self._capfd).st_size
+        self._tap = tap
+        self._tapsize = tapsize
+        self._tapinterval = tapinterval
+        self.error = None
+        self._thread = threading.Thread(target=self.run,
+                                        name="SplicePump", daemon=True)
+
+    def __repr__(self):
+        return "{}(in={}, out={}, capture={})".format(
+            self.__class__.__name__, self._infd, self._outfd, self._capfd)
+
+    @property
+    def count(self):
+        """Number of bytes moved so far."""
+        return self.offset - self._origin
+
+    def start(self):
+        self._thread.start()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def run(self):
+        infd, outfd, capfd = self._infd, self._outfd, self._capfd
+        nexttap = self.offset
+        try:
+            while 1:
+                offset = self.offset
+                if _splice is None:
+                    data = os.read(infd, self.chunksize)
+                    n = len(data)
+                    if n:
+                        os.pwrite(capfd, data, offset)
+                else:
+                    n = _splice(infd, capfd, self.chunksize,
+                                offset_dst=offset)
+                if n == 0:
+                    break
+                if self._tap is not None and offset + n > nexttap:
+                    self._tap(nexttap, os.pread(capfd, self._tapsize, nexttap))
+                    nexttap += ((offset + n - nexttap) // self._tapinterval +
+                                1) * self._tapinterval
+                sent = 0
+                while sent < n:
+                    if _splice is None:
+                        sent += os.write(outfd, data[sent:])
+                    else:
+                        sent += _splice(capfd, outfd, n - sent,
+                                        offset_src=offset + sent)
+                self.offset = offset + n
+        except BrokenPipeError:  # second stage exited.
+            pass
+        except Exception as err:
+            self.error = err
+        finally:
+            self.close()
+
+    def close(self):
+        fds, self._infd, self._outfd = (self._infd, self._outfd), None, None
+        for fd in fds:
+            if fd is not None:
+                os.close(fd)
+        if self._owncap and self._capfd is not None:
+            os.close(self._capfd)
+            self._capfd = None
+
+
 class ProcessPipeline(ProcessPipe):
-    """Connects two commands via a pipe, they appear as one process object."""
+    """Connects two commands via a pipe, they appear as one process object.
+
+    If capture is given, the data between the commands is also written to it
+    by a SplicePump, available as the pump attribute. See SplicePump for the
+    capture and tap arguments.
+    """
     def __init__(self, cmdline, logfile=None,  env=None, callback=None,
-                 merge=None, pwent=None, async=False, devnull=None, _pgid=0):
+                 merge=None, pwent=None, async=False, devnull=None, _pgid=0,
+                 capture=None, tap=None):
         assert cmdline.count("|") == 1
         [cmdline1, cmdline2] = cmdline.split("|")
+        # Not ProcessPipe.__init__, that would start cmdline2 on its own.
+        Process.__init__(self, cmdline2, logfile, callback, async)
         if env:
             self.environment = env
-        super().__init__(cmdline2, logfile, callback, async)
         self._stderr = None
+        self.pump = None
 
         cmd1 = split_command_line(cmdline1)
         cmd2 = split_command_line(cmdline2)
@@ -651,31 +982,49 @@ class ProcessPipeline(ProcessPipe):
         _p_stdout, self._p_stdin = os.pipe()
         p_read, p_write = os.pipe()
         self._p_stdout, _p_stdin = os.pipe()
+        if capture is None:
+            pumpfds = ()
+        else:
+            # cmd1 -> p_write|pump_in -> pump -> pump_out|p_read -> cmd2
+            pump_in = p_read
+            p_read, pump_out = os.pipe()
+            pumpfds = (pump_in, pump_out)
 
-        self.childpid = os.fork()
-        # cmd1
-        if self.childpid == 0:
-            # Child 1
-            os.dup2(_p_stdout, 0)
-            os.dup2(p_write, 1)
-            self._exec(cmd1, env, pwent)
-            os._exit(127)
+        if self.fastspawn and _can_spawn(pwent):
+            try:
+                self.childpid = _spawn(cmd1, env,
+                                       _stdio_actions(_p_stdout, p_write))
+                self.childpid2 = _spawn(cmd2, env,
+                                        _stdio_actions(p_read, _p_stdin))
+            except OSError:
+                _close_fds(_p_stdout, self._p_stdin, p_read, p_write,
+                           self._p_stdout, _p_stdin, *pumpfds)
+                raise
+        else:
+            self.childpid = os.fork()
+            # cmd1
+            if self.childpid == 0:
+                # Child 1
+                os.dup2(_p_stdout, 0)
+                os.dup2(p_write, 1)
+                self._exec(cmd1, env, pwent)
+                os._exit(127)
 
-        # cmd2
-        cmd2pid = os.fork()
-        if cmd2pid == 0:
-            # Child 2
-            os.dup2(p_read, 0)
-            os.dup2(_p_stdin, 1)
-            self._exec(cmd2, env, pwent)
-            os._exit(127)
+            # cmd2
+            cmd2pid = os.fork()
+            if cmd2pid == 0:
+                # Child 2
+                os.dup2(p_read, 0)
+                os.dup2(_p_stdin, 1)
+                self._exec(cmd2, env, pwent)
+                os._exit(127)
 
-        self.childpid2 = cmd2pid
+            self.childpid2 = cmd2pid
         # close our copies
-        os.close(_p_stdout)
-        os.close(_p_stdin)
-        os.close(p_read)
-        os.close(p_write)
+        _close_fds(_p_stdout, _p_stdin, p_read, p_write)
+        if pumpfds:
+            self.pump = SplicePump(pump_in, pump_out, capture, tap)
+            self.pump.start()
 
     def _exec(self, cmd, env, pwent):
         # close all other file descriptors for child.
@@ -687,6 +1036,18 @@ class ProcessPipeline(ProcessPipe):
             os.execvp(cmd[0], cmd)
 
 
+class FastProcessPipe(ProcessPipe):
+    fastspawn = True
+
+
+class FastProcessPipeline(ProcessPipeline):
+    fastspawn = True
+
+
+class FastProcessPty(ProcessPty):
+    fastspawn = True
+
+
 class ProcManager(object):
     """An instance of ProcManager manages a collection of child processes. It
 is a singleton, and you should use the get_procmanager() factory function
@@ -695,6 +1056,10 @@ to get the instance.  """
     def __init__(self):
         self._pgid = os.getpgid(0)
         self._procs = {}
+        self._poller = None  # set if child exits are poller events.
+        self._pidfds = None  # pid to pidfd map, if using pidfds.
+        self._wakeup = None  # wakeup pipe, if using SIGCHLD to signal exits.
+        self._usage = {}  # command basename to ResourceUsage
         signal.signal(SIGCHLD, self._child_handler)
         signal.siginterrupt(SIGCHLD, False)
 
@@ -716,26 +1081,32 @@ to get the instance.  """
 
         if persistent and (callback is None):
             callback = self.respawn_callback
-        signal.signal(SIGCHLD, SIG_DFL)  # critical area
-        proc = pklass(cmd, logfile=logfile, env=env, callback=callback,
-                      merge=merge, pwent=pwent, async=async, devnull=devnull,
-                      _pgid=self._pgid)
-        self._procs[proc.childpid] = proc
-        # TODO need a more general pipeline
-        if proc.childpid2:
-            self._procs[proc.childpid2] = proc
-        signal.signal(SIGCHLD, self._child_handler)
-        signal.siginterrupt(SIGCHLD, False)
+        self._enter_critical()
+        try:
+            proc = pklass(cmd, logfile=logfile, env=env, callback=callback,
+                          merge=merge, pwent=pwent, async=async,
+                          devnull=devnull, _pgid=self._pgid)
+            self._manage(proc.childpid, proc)
+            # TODO need a more general pipeline
+            if proc.childpid2:
+                self._manage(proc.childpid2, proc)
+        finally:
+            self._leave_critical()
         return proc
 
     def spawnpipe(self, cmd, logfile=None, env=None, callback=None,
                   persistent=False, merge=True, pwent=None, async=False,
-                  devnull=False):
-        """Start a child process, connected by pipes."""
+                  devnull=False, fastspawn=False, capture=None, tap=None):
+        """Start a child process, connected by pipes. If fastspawn is true,
+        start it with posix_spawn rather than fork, where possible. For a
+        pipeline, capture and tap are passed on to a SplicePump.
+        """
         if cmd.find("|") > 0:
-            klass = ProcessPipeline
+            klass = FastProcessPipeline if fastspawn else ProcessPipeline
+            if capture is not None:
+                klass = partial(klass, capture=capture, tap=tap)
         else:
-            klass = ProcessPipe
+            klass = FastProcessPipe if fastspawn else ProcessPipe
         return self.spawnprocess(klass, cmd, logfile, env, callback,
                                  persistent, merge, pwent, async, devnull)
 
@@ -744,17 +1115,19 @@ to get the instance.  """
 
     def spawnpty(self, cmd, logfile=None, env=None, callback=None,
                  persistent=False, merge=True, pwent=None, async=False,
-                 devnull=False):
+                 devnull=False, fastspawn=False):
         """Start a child process using a pty. The <persistent> variable is the
         number of times the process will be respawned if the previous
-        invocation dies.
+        invocation dies. If fastspawn is true, start it with posix_spawn
+        rather than fork, where possible.
         """
-        return self.spawnprocess(ProcessPty, cmd, logfile, env, callback,
+        klass = FastProcessPty if fastspawn else ProcessPty
+        return self.spawnprocess(klass, cmd, logfile, env, callback,
                                  persistent, merge, pwent, async, devnull)
 
     def coprocess(self, method, args=(), logfile=None, env=None, callback=None,
                   async=False):
-        signal.signal(SIGCHLD, SIG_DFL)  # critical area
+        self._enter_critical()
         proc = CoProcessPipe(method, logfile=logfile, env=env,
                              callback=callback, async=async)
         if proc.childpid == 0:
@@ -776,9 +1149,8 @@ to get the instance.  """
             except:
                 rv = 0
             os._exit(rv)
-        self._procs[proc.childpid] = proc
-        signal.signal(SIGCHLD, self._child_handler)
-        signal.siginterrupt(SIGCHLD, False)
+        self._manage(proc.childpid, proc)
+        self._leave_critical()
         return proc
 
     def subprocess(self, _method, *args, **kwargs):
@@ -787,7 +1159,7 @@ to get the instance.  """
     def submethod(self, _method, args=None, kwargs=None, pwent=None):
         args = args or ()
         kwargs = kwargs or {}
-        signal.signal(SIGCHLD, SIG_DFL)  # critical area
+        self._enter_critical()
         proc = SubProcess(pwent=pwent)
         if proc.childpid == 0:  # in child
             os.setpgid(0, self._pgid)
@@ -821,9 +1193,8 @@ to get the instance.  """
                 rv = 0
             os._exit(rv)
         else:
-            self._procs[proc.childpid] = proc
-            signal.signal(SIGCHLD, self._child_handler)
-            signal.siginterrupt(SIGCHLD, False)
+            self._manage(proc.childpid, proc)
+            self._leave_critical()
             return proc
 
     # introspection and query methods
@@ -852,10 +1223,26 @@ to get the instance.  """
 
     def getstats(self):
         """getstats() Returns a list of process status objects (ProcStat) for
-        each managed process.
+        each managed process. See getusage() for exited processes.
         """
         return [ProcStat(o) for o in list(self._procs.keys())]
 
+    def getusage(self, name=None):
+        """getusage([name]) Returns the total resource usage (ResourceUsage)
+        of exited processes that ran the named command. Without a name,
+        returns a dictionary of command name to ResourceUsage.
+        """
+        if name is None:
+            return dict(self._usage)
+        name = os.path.basename(name)
+        try:
+            return self._usage[name]
+        except KeyError:
+            return ResourceUsage(name)
+
+    def clearusage(self):
+        self._usage.clear()
+
     def killall(self, name=None, sig=SIGTERM):
         """Kills all managed processes with the name 'name'. If 'name' not
         given kill ALL processes. Default signal is SIGTERM.
@@ -890,11 +1277,10 @@ to get the instance.  """
                 del procs
             else:
                 return
-        signal.signal(SIGCHLD, SIG_DFL)  # critical area
+        self._enter_critical()
         newproc = proc.clone()
-        self._procs[newproc.childpid] = newproc
-        signal.signal(SIGCHLD, self._child_handler)
-        signal.siginterrupt(SIGCHLD, False)
+        self._manage(newproc.childpid, newproc)
+        self._leave_critical()
         return newproc
 
     def respawn_callback(self, deadproc):
@@ -906,7 +1292,10 @@ to get the instance.  """
         elif not deadproc.exitstatus:
             logging.error("process {!r} died: %s (restarting in 1 sec.).\n".format(  # noqa
                          deadproc.cmdline, deadproc.exitstatus))
-            scheduler.add(self._respawn, 1.0, args=(deadproc,))
+            if self._poller is not None:
+                self._poller.add_timer(self._respawn, 1.0, args=(deadproc,))
+            else:
+                scheduler.add(self._respawn, 1.0, args=(deadproc,))
         else:
             logging.info("process {!r} normal exit (NOT restarting).\n".format(
                     deadproc.cmdline))
@@ -918,13 +1307,125 @@ to get the instance.  """
 
     # this is the SIGCHLD signal handler
     def _child_handler(self, sig, stack):
-        pid, sts = os.waitpid(-1, os.WNOHANG)
-        proc = self._procs.get(pid)
-        if proc is not None:
-            self._proc_status(proc, sts)
+        self._reap()
         signal.signal(SIGCHLD, self._child_handler)
         signal.siginterrupt(SIGCHLD, False)
 
+    def _reap(self):
+        # One signal may stand for several exits, so reap all of them.
+        while 1:
+            try:
+                pid, sts, rusage = os.wait4(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            proc = self._procs.get(pid)
+            if proc is not None:
+                self._proc_status(proc, sts, pid, rusage)
+
+    def _enter_critical(self):
+        if self._poller is None:
+            signal.signal(SIGCHLD, SIG_DFL)
+
+    def _leave_critical(self):
+        if self._poller is None:
+            signal.signal(SIGCHLD, self._child_handler)
+            signal.siginterrupt(SIGCHLD, False)
+
+    def _manage(self, pid, proc):
+        self._procs[pid] = proc
+        if self._pidfds is not None:
+            self._watch(pid)
+
+    def attach_poller(self, poller=None):
+        """Deliver child process exits as events to the poller (default is
+        the asyncio.poller singleton), instead of handling them in a SIGCHLD
+        signal handler. Exit callbacks, and respawns of persistent
+        processes, then run from the poller's loop.
+
+        Each process gets a pidfd where os.pidfd_open is available. Otherwise
+        SIGCHLD only writes to a wakeup pipe, and exits are reaped when the
+        pipe becomes readable.
+        """
+        if self._poller is not None:
+            self.detach_poller()
+        if poller is None:
+            asyncio.poller.fileno()  # replaces the builder with the instance.
+            poller = asyncio.poller
+        self._poller = poller
+        if hasattr(os, "pidfd_open"):
+            signal.signal(SIGCHLD, SIG_DFL)
+            self._pidfds = {}
+            for pid in list(self._procs.keys()):
+                self._watch(pid)
+        else:
+            rfd, wfd = os.pipe()
+            set_nonblocking(rfd)
+            set_nonblocking(wfd)
+            self._wakeup = (rfd, wfd, signal.set_wakeup_fd(wfd))
+            # A Python level handler is needed for the wakeup pipe to be
+            # written, but it has nothing to do.
+            signal.signal(SIGCHLD, _null_handler)
+            signal.siginterrupt(SIGCHLD, False)
+            poller.register_fd(rfd, EPOLLIN, self._wakeup_handler)
+            self._reap()
+        return poller
+
+    def detach_poller(self):
+        """Go back to handling child exits in a SIGCHLD signal handler."""
+        poller = self._poller
+        if poller is None:
+            return
+        if self._pidfds is not None:
+            for pid in list(self._pidfds.keys()):
+                self._unwatch(pid)
+            self._pidfds = None
+        if self._wakeup is not None:
+            rfd, wfd, oldfd = self._wakeup
+            signal.set_wakeup_fd(oldfd)
+            poller.unregister_fd(rfd)
+            os.close(rfd)
+            os.close(wfd)
+            self._wakeup = None
+        self._poller = None
+        self._leave_critical()
+        self._reap()
+
+    def _watch(self, pid):
+        try:
+            fd = os.pidfd_open(pid)
+        except ProcessLookupError:  # already reaped
+            return
+        self._pidfds[pid] = fd
+        self._poller.register_fd(fd, EPOLLIN, partial(self._pidfd_handler,
+                                                       pid))
+
+    def _unwatch(self, pid):
+        if self._pidfds is not None:
+            fd = self._pidfds.pop(pid, None)
+            if fd is not None:
+                self._poller.unregister_fd(fd)
+                os.close(fd)
+
+    def _pidfd_handler(self, pid):
+        self._unwatch(pid)
+        try:
+            rpid, sts, rusage = os.wait4(pid, os.WNOHANG)
+        except ChildProcessError:  # someone else reaped it.
+            rpid = 0
+        proc = self._procs.get(pid)
+        if rpid and proc is not None:
+            self._proc_status(proc, sts, pid, rusage)
+
+    def _wakeup_handler(self):
+        try:
+            while os.read(self._wakeup[0], 4096):
+                pass
+        except BlockingIOError:
+            pass
+        self._reap()
+
     def waitpid(self, pid, option=0):
         try:
             proc = self._procs[pid]
@@ -941,31 +1442,253 @@ to get the instance.  """
         """
         if proc.exitstatus is not None:
             return proc.exitstatus
-        signal.signal(SIGCHLD, SIG_DFL)
+        self._enter_critical()
         try:
-            pid, sts = os.waitpid(proc.childpid, option)
+            pid, sts, rusage = os.wait4(proc.childpid, option)
         finally:
-            signal.signal(SIGCHLD, self._child_handler)
-            signal.siginterrupt(SIGCHLD, False)
-        return self._proc_status(proc, sts)
+            self._leave_critical()
+        if pid == 0:  # WNOHANG, and still running.
+            return None
+        return self._proc_status(proc, sts, pid, rusage)
 
-    def _proc_status(self, proc, sts):
+    def _proc_status(self, proc, sts, pid=None, rusage=None):
+        if pid is None:
+            pid = proc.childpid
         es = ExitStatus(sts, proc.cmdline.split()[0])
         proc.set_exitstatus(es)
         # XXX untested with stopped processes
         if es.state != ExitStatus.STOPPED:
+            if rusage is not None:
+                proc.rusage = rusage
+                name = proc.basename
+                try:
+                    usage = self._usage[name]
+                except KeyError:
+                    usage = self._usage[name] = ResourceUsage(name)
+                usage.add(rusage)
+            self._procs.pop(pid, None)
+            self._unwatch(pid)
             proc.dead()
-            del self._procs[proc.childpid]
         return es
 
     def loop(self, poller, timeout=-1.0, callback=NULL):
-        while self._procs:
+        # Pending respawns are timers, if exits are events on this poller.
+        while self._procs or (poller is self._poller and poller.has_timers()):
             poller.poll(timeout)
             callback(self)
             if scheduler.get_scheduler():  # wait for any restarts
                 scheduler.sleep(1.5)
 
 
+class WorkerPool(object):
+    """A pool of forked worker processes that run functions for this one.
+
+    The function and arguments of each task, and the result, are pickled and
+    sent over a pair of pipes dedicated to each worker. So the function must
+    be picklable (e.g. a module level function). Since the workers are forks
+    of this process, functions defined in the main script work as well.
+
+    A worker is replaced after it has run maxtasks tasks, if maxtasks is
+    given. The pool is a context manager that closes it on exit.
+    """
+    def __init__(self, size=None, maxtasks=None):
+        self.size = size or os.cpu_count() or 1
+        self.maxtasks = maxtasks
+        self._workers = []
+        self._pm = get_procmanager()
+        for i in range(self.size):
+            self._workers.append(self._start_worker())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, extype, exvalue, traceback):
+        self.close()
+        return False
+
+    def __len__(self):
+        return len(self._workers)
+
+    def _start_worker(self):
+        taskr, taskw = os.pipe()
+        resultr, resultw = os.pipe()
+        # The child must not keep the pipes of the other workers open.
+        closefds = [taskw, resultr]
+        for worker in self._workers:
+            if worker.taskfd is not None:
+                closefds.extend((worker.taskfd, worker.resultfd))
+        proc = self._pm.submethod(_worker_main,
+                                  (taskr, resultw, self.maxtasks, closefds))
+        os.close(taskr)
+        os.close(resultw)
+        return _Worker(proc, taskw, resultr)
+
+    def _replace(self, worker):
+        worker.close()
+        i = self._workers.index(worker)
+        self._workers[i] = new = self._start_worker()
+        return new
+
+    def _send(self, worker, func, args, kwargs):
+        _write_frame(worker.taskfd,
+                     pickle.dumps((func, args, kwargs), pickle.HIGHEST_PROTOCOL))
+        worker.ntasks += 1
+
+    def _receive(self, worker):
+        """Get the result of the worker's current task. Returns a (success,
+        value) tuple, and the worker to use for the next task. That is a new
+        one if this one was used up, or died.
+        """
+        try:
+            result = pickle.loads(_read_frame(worker.resultfd))
+        except EOFError:
+            result = (False, ProcessError("worker {} died running task".format(
+                worker.proc.childpid)))
+            worker = self._replace(worker)
+        else:
+            if self.maxtasks and worker.ntasks >= self.maxtasks:
+                worker = self._replace(worker)
+        return result, worker
+
+    def call(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in a worker and return the result."""
+        worker = self._workers[0]
+        self._send(worker, func, args, kwargs)
+        (ok, value), worker = self._receive(worker)
+        if not ok:
+            raise value
+        return value
+
+    def imap(self, func, iterable, ordered=True):
+        """Like map(), but run func on the items in the workers, at most one
+        item per worker at a time. Results are yielded in the order of the
+        items, unless ordered is false. An exception raised by func is
+        raised here, once its result would be yielded.
+        """
+        args = iter(((item,) for item in iterable))
+        busy = {}  # result fd to (worker, index)
+        done = {}  # index to result, for those out of order
+        nextindex = 0
+        sent = 0
+        poller = poll()
+        try:
+            for worker in self._workers:
+                try:
+                    arg = next(args)
+                except StopIteration:
+                    break
+                self._send(worker, func, arg, {})
+                busy[worker.resultfd] = (worker, sent)
+                poller.register(worker.resultfd, POLLIN)
+                sent += 1
+            while busy:
+                for fd, ev in poller.poll():
+                    worker, index = busy.pop(fd)
+                    poller.unregister(fd)
+                    done[index], worker = self._receive(worker)
+                    try:
+                        arg = next(args)
+                    except StopIteration:
+                        continue
+                    self._send(worker, func, arg, {})
+                    busy[worker.resultfd] = (worker, sent)
+                    poller.register(worker.resultfd, POLLIN)
+                    sent += 1
+                if ordered:
+                    while nextindex in done:
+                        ok, value = done.pop(nextindex)
+                        nextindex += 1
+                        if not ok:
+                            raise value
+                        yield value
+                else:
+                    for index in list(done.keys()):
+                        ok, value = done.pop(index)
+                        if not ok:
+                            raise value
+                        yield value
+        finally:
+            # Collect what is still running, so the workers are ready again.
+            for worker, index in busy.values():
+                self._receive(worker)
+
+    def map(self, func, iterable):
+        return list(self.imap(func, iterable))
+
+    def close(self):
+        """Stop all workers, and wait for them to exit."""
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
+
+
+class _Worker(object):
+    def __init__(self, proc, taskfd, resultfd):
+        self.proc = proc
+        self.taskfd = taskfd
+        self.resultfd = resultfd
+        self.ntasks = 0
+
+    def close(self):
+        if self.taskfd is not None:
+            try:
+                _write_frame(self.taskfd, b"")  # request to exit
+            except BrokenPipeError:
+                pass
+            os.close(self.taskfd)
+            os.close(self.resultfd)
+            self.taskfd = self.resultfd = None
+            self.proc.wait()
+
+
+def _write_frame(fd, data):
+    data = struct.pack("!I", len(data)) + data
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def _read_exact(fd, amt):
+    parts = []
+    while amt:
+        data = os.read(fd, amt)
+        if not data:
+            raise EOFError("short read from worker pipe")
+        parts.append(data)
+        amt -= len(data)
+    return b"".join(parts)
+
+
+def _read_frame(fd):
+    size, = struct.unpack("!I", _read_exact(fd, 4))
+    return _read_exact(fd, size)
+
+
+def _worker_main(taskfd, resultfd, maxtasks, closefds):
+    for fd in closefds:
+        os.close(fd)
+    count = 0
+    while not maxtasks or count < maxtasks:
+        try:
+            task = _read_frame(taskfd)
+        except EOFError:
+            break
+        if not task:
+            break
+        try:
+            func, args, kwargs = pickle.loads(task)
+            result = (True, func(*args, **kwargs))
+        except Exception as err:
+            result = (False, err)
+        try:
+            data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        except Exception as err:
+            data = pickle.dumps((False, ProcessError(
+                "result could not be pickled: {}".format(err))))
+        _write_frame(resultfd, data)
+        count += 1
+    return 0
+
+
 def get_procmanager():
     """get_procmanager() returns the procmanager. A ProcManager is a singleton
 instance. Always use this factory function to get it."""
@@ -979,29 +1702,35 @@ instance. Always use this factory function to get it."""
 
 def remove_procmanager():
     global procmanager
+    procmanager.detach_poller()
     signal.signal(SIGCHLD, SIG_DFL)
     del procmanager
 
 
+def _null_handler(sig, stack):
+    pass
+
+
 #  Process manager factory functions
 def spawnpipe(cmd, logfile=None, env=None, callback=None,
-              persistent=False, merge=True, pwent=None, async=False):
+              persistent=False, merge=True, pwent=None, async=False,
+              fastspawn=False, capture=None, tap=None):
     """Start a child process, connected by pipes.
     """
     pm = get_procmanager()
     proc = pm.spawnpipe(cmd, logfile, env, callback, persistent, merge, pwent,
-                        async)
+                        async, fastspawn=fastspawn, capture=capture, tap=tap)
     return proc
 
 
 def spawnpty(cmd, logfile=None, env=None, callback=None,
              persistent=False, merge=True, pwent=None, async=False,
-             devnull=False):
+             devnull=False, fastspawn=False):
     """Start a child process using a pty.
     """
     pm = get_procmanager()
     proc = pm.spawnpty(cmd, logfile, env, callback, persistent, merge, pwent,
-                       async, devnull)
+                       async, devnull, fastspawn)
     return proc
 
 
@@ -1,6 +1,8 @@
 #!/usr/bin/python3.4
 # vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
 
+import os
+import time
 import unittest
 
 from pycopia import proctools
@@ -8,12 +10,22 @@ from pycopia import crontab
 from pycopia import expect
 from pycopia import sshlib
 from pycopia import sudo
+from pycopia import asyncio
+from pycopia.OS import scheduler
 
 def _sub_function():
     from pycopia.OS import scheduler
     scheduler.sleep(5)
     return None
 
+def _hash_task(n):
+    import hashlib
+    h = hashlib.sha1()
+    for i in range(n):
+        h.update(str(i).encode("ascii"))
+    return os.getpid(), h.hexdigest()
+
+
 def _co_function():
     import sys
     from pycopia.OS import scheduler
@@ -62,6 +74,209 @@ class ProcessTests(unittest.TestCase):
 #        es = ptest.stat()
 #        self.assertTrue(es)
 
+    def test_fastspawn(self):
+        proc = proctools.spawnpipe("sh -c 'echo $FOO; tty'", env={"FOO": "bar"},
+                                   fastspawn=True)
+        self.assertEqual(proc.readlines(), [b"bar\n", b"not a tty\n"])
+        proc.close()
+        self.assertFalse(proc.wait())  # tty exits 1
+        proc = proctools.spawnpty("tty", fastspawn=True)
+        self.assertTrue(proc.readline().startswith(b"/dev/pts/"))
+        self.assertTrue(proc.wait())
+        proc.close()
+
+    def XXXtest_spawn_rate(self):
+        count = 500
+        print("\nheap MB  method      starts/s  mean start ms")
+        for heapmb in (0, 256, 1024):
+            heap = bytearray(heapmb * 1024 * 1024)
+            for i in range(0, len(heap), 4096):  # make it resident
+                heap[i] = 1
+            for fastspawn in (False, True):
+                latency = 0.0
+                start = time.monotonic()
+                for i in range(count):
+                    t0 = time.monotonic()
+                    proc = proctools.spawnpipe("true", fastspawn=fastspawn)
+                    latency += time.monotonic() - t0
+                    proc.close()
+                    proc.wait()
+                elapsed = time.monotonic() - start
+                print("{:7d}  {:10s}  {:8.1f}  {:13.3f}".format(
+                      heapmb, "posix_spawn" if fastspawn else "fork",
+                      count / elapsed, latency / count * 1000.0))
+            del heap
+
+    def test_poller_reaping(self):
+        pm = proctools.get_procmanager()
+        poller = asyncio.Poll()
+        pm.attach_poller(poller)
+        try:
+            exits = []
+            for i in range(50):
+                proctools.spawnpipe("true", callback=exits.append)
+            pm.loop(poller, 1.0)
+            self.assertEqual(len(exits), 50)
+            self.assertTrue(all(proc.exitstatus for proc in exits))
+            self.assertFalse(poller)
+            proc = proctools.spawnpipe("sh -c 'exit 3'")
+            self.assertEqual(proc.wait().status, 3)
+        finally:
+            pm.detach_poller()
+            poller.close()
+
+    def test_usage(self):
+        pm = proctools.get_procmanager()
+        pm.clearusage()
+        for i in range(3):
+            proc = proctools.spawnpipe(
+                "sh -c 'i=0; while [ $i -lt 30000 ]; do i=$((i+1)); done'")
+            proc.wait()
+            proc.close()
+            self.assertGreater(proc.rusage.ru_utime + proc.rusage.ru_stime, 0)
+        usage = pm.getusage("/bin/sh")
+        self.assertEqual(usage.count, 3)
+        self.assertGreater(usage.utime, 0.0)
+        self.assertGreater(usage.maxrss, 0)
+        self.assertEqual(list(pm.getusage().keys()), ["sh"])
+        print(usage)
+
+    def test_pipeline_capture(self):
+        capfile = "/tmp/pycopia_capture_test"
+        taps = []
+        proc = proctools.spawnpipe("seq 1 500000 | wc -l", capture=capfile,
+                                   tap=lambda off, data: taps.append(off))
+        self.assertEqual(proc.read().strip(), b"500000")
+        self.assertTrue(proc.pump.join(5.0))
+        self.assertIsNone(proc.pump.error)
+        proc.close()
+        proc.wait()
+        with open(capfile, "rb") as fo:
+            captured = fo.read()
+        os.unlink(capfile)
+        self.assertEqual(len(captured), proc.pump.count)
+        self.assertTrue(captured.endswith(b"\n499999\n500000\n"))
+        self.assertEqual(taps[0], 0)
+        self.assertEqual(len(taps), len(captured) // 1048576 + 1)
+
+    def test_worker_pool(self):
+        with proctools.WorkerPool(4, maxtasks=3) as pool:
+            self.assertEqual(len(pool), 4)
+            results = pool.map(_hash_task, range(1000, 1020))
+            self.assertEqual([r[1] for r in results],
+                             [_hash_task(n)[1] for n in range(1000, 1020)])
+            self.assertGreater(len(set(r[0] for r in results)), 4)
+            self.assertEqual(sorted(pool.imap(abs, [-3, 2, -1], ordered=False)),
+                             [1, 2, 3])
+            self.assertEqual(pool.call(divmod, 7, 2), (3, 1))
+            self.assertRaises(ZeroDivisionError, pool.call, divmod, 1, 0)
+            self.assertRaises(TypeError, pool.map, abs, [1, "x", 3])
+            self.assertEqual(pool.map(abs, [-1]), [1])
+
+    def test_timed_read(self):
+        proc = proctools.spawnpipe("sh -c 'echo one; sleep 2; echo two'")
+        self.assertEqual(proc.timed_read(100, 1.0), b"one\n")
+        self.assertRaises(scheduler.TimeoutError, proc.timed_read, 100, 0.5)
+        self.assertEqual(proc.timed_read(-1, 5.0), b"two\n")
+        proc.close()
+        self.assertTrue(proc.wait())
+
+    def test_expect_bulk(self):
+        proc = proctools.spawnpipe("sh -c 'seq 1 50000; echo DONE; echo tail'")
+        exp = expect.Expect(proc, timeout=10)
+        mo = exp.expect(["nomatch", "DONE"])
+        self.assertEqual(exp.expectindex, 1)
+        self.assertEqual(mo.group(0), b"DONE")
+        self.assertEqual(exp.readline(), b"")
+        self.assertEqual(exp.readline(), b"tail")
+        exp.close()
+        proc.wait()
+
+    def test_expect_many(self):
+        proc = proctools.spawnpipe("sh -c 'seq 1 5000; echo login: tail'")
+        exp = expect.Expect(proc, timeout=10)
+        patterns = ["word{}:".format(i) for i in range(200)]
+        patterns.append((r"log\w+:", expect.REGEX))
+        patterns.append("tail")
+        mo = exp.expect(patterns)
+        self.assertEqual(exp.expectindex, 200)
+        self.assertEqual(mo.group(0), b"login:")
+        mo = exp.expect(["tai*", "t*l"], expect.GLOB)
+        self.assertEqual(exp.expectindex, 0)
+        exp.close()
+        proc.wait()
+
+    def test_expect_match_order(self):
+        r, w = os.pipe()
+        fo = os.fdopen(r, "rb", 0)
+        # The same match, whether "ef" came in the same read or a later one.
+        for data in (b"abcdef", b"abcd"):
+            exp = expect.Expect(fo, timeout=5)
+            exp._feed(data)
+            mo = exp.expect(["abcdef", "cd"])
+            self.assertEqual((exp.expectindex, mo.group(0)), (1, b"cd"))
+        exp = expect.Expect(fo, timeout=5)
+        exp._feed(b"login: x\nPassword: ")
+        mo = exp.expect("*:", expect.GLOB)
+        self.assertEqual(mo.group(0), b"login:")
+        # Greedy patterns match what they would have byte by byte.
+        exp._feed(b"ok 42 done")
+        mo = exp.expect([(rb"ok.*", expect.REGEX), (rb"(\d+) d", expect.REGEX)])
+        self.assertEqual((exp.expectindex, mo.group(0)), (0, b"ok"))
+        mo = exp.expect(rb"\d+", expect.REGEX)
+        self.assertEqual(mo.group(0), b"4")
+        # A terminated pattern takes in all of the digits.
+        exp._feed(b"got 42\n")
+        mo = exp.expect(rb"got (\d+)\n", expect.REGEX)
+        self.assertEqual(mo.group(1), b"42")
+        fo.close()
+        os.close(w)
+
+    def test_expect_group(self):
+        def _script(exp):
+            yield "ready"
+            exp.send(b"42\n")
+            mo = yield (rb"got (\d+)\n", expect.REGEX)
+            return int(mo.group(1))
+        group = expect.ExpectGroup(timeout=5)
+        procs = []
+        for i in range(20):
+            proc = proctools.spawnpipe(
+                "sh -c 'sleep 1; echo ready; read x; echo got $x'")
+            procs.append(proc)
+            group.add(expect.Expect(proc), _script)
+        proc = proctools.spawnpipe("sh -c 'sleep 1; echo login:; read x'")
+        procs.append(proc)
+        group.add(expect.Expect(proc), [("login:", "x\n"), ("never", None)],
+                  name="chat", timeout=3)
+        start = time.monotonic()
+        sessions = group.run()
+        self.assertLess(time.monotonic() - start, 4.0)
+        for i in range(20):
+            self.assertEqual(sessions[i].result, 42)
+            self.assertIsNone(sessions[i].error)
+            self.assertEqual(len(sessions[i].timings), 2)
+        self.assertIsInstance(sessions["chat"].error, expect.ExpectError)
+        for proc in procs:
+            proc.close()
+            proc.wait()
+
+    def test_buffered_io(self):
+        proc = proctools.spawnpipe("seq 1 100000")
+        self.assertEqual(proc.readline(), b"1\n")
+        self.assertEqual(proc.readline(3), b"2\n")
+        self.assertEqual(proc.readline(1), b"3")
+        b = bytearray(5)
+        self.assertEqual(proc.readinto(b), 5)
+        self.assertEqual(b, b"\n4\n5\n")
+        lines = proc.readlines()
+        self.assertEqual(len(lines), 100000 - 5)
+        self.assertEqual(lines[-1], b"100000\n")
+        self.assertEqual(proc.readline(), b"")
+        self.assertEqual(proc.readinto(b), 0)
+        proc.close()
+        proc.wait()
+
     def test_subprocess(self):
         sub = proctools.subprocess(_sub_function)
         es = sub.wait()